@@ -0,0 +1,35 @@
+import argparse
+from atm.account_service import AccountService
+'''
+Script used to run the shared account service
+
+Loads the accounts file once and serves the accounts to ATM processes over
+a Unix domain socket. ATMs started with --service use it instead of
+loading the accounts file themselves, so they start straight away however
+large the file is. Changes are written back to the accounts file as ATM
+sessions log out, and once more when the service stops.
+
+HOW TO USE:
+    python account_service.py data/current_accounts.txt --socket /tmp/atm-accounts.sock
+    python main.py data/current_accounts.txt session.atf --service /tmp/atm-accounts.sock
+
+OPTIONS:
+    --lazy : memory-map the accounts file and decode accounts only when used
+'''
+def main():
+    parser = argparse.ArgumentParser(description="Shared account service for ATM processes")
+    parser.add_argument("accounts_file")
+    parser.add_argument("--socket", required=True, help="Unix domain socket path to listen on")
+    parser.add_argument("--lazy", action="store_true", help="memory-map the accounts file and decode accounts on demand")
+    args = parser.parse_args()
+
+    service = AccountService(args.accounts_file, args.socket, lazyLoad=args.lazy)
+    try:
+        service.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        service.close()
+
+if __name__ == "__main__":
+    main()
@@ -2,5 +2,9 @@ from .atm import ATM
 from .session import Session
 from .account import Account
 from .account_store import AccountStore
+from .sqlite_store import SQLiteAccountStore
+from .event_store import EventSourcedStore
 from .input_stream import InputStream
-from .output_stream import OutputStream
\ No newline at end of file
+from .output_stream import OutputStream
+from .journal import Journal
+from .result import Result
\ No newline at end of file
@@ -1,3 +1,18 @@
+from array import array
+
+'''
+Converts a dollar amount to a whole number of cents, rounding to the nearest cent.
+'''
+
+def toCents(amount):
+    return round(amount * 100)
+
+
+# constraint: balances must fit the 8 character balance field
+MAX_BALANCE = 99999.99
+MAX_BALANCE_CENTS = toCents(MAX_BALANCE)
+
+
 '''
 Object to hold a single instance of an account.
 
@@ -10,12 +25,60 @@ Stores the following information
     - Balance
     - Status
     - Plan
+    - Offset of the record in the accounts file, when the store knows it
+
+Accounts are declared with __slots__ so no per-instance __dict__ is
+allocated, which keeps large master files cheap to hold in memory.
 
+The balance is held as a whole number of cents in a slot of a balance
+column, an array of 64-bit integers usually shared by every account of a
+store (see AccountStore.balances), so balances never drift by fractions of
+a cent and can be summed or checked in bulk. An account created on its own
+gets a column of its own. balance reads and writes the amount in dollars,
+rounded to the cent; cents reads and writes it as an integer.
 '''
 class Account:
-    def __init__(self, name, accountNum, balance, status, plan):
+    __slots__ = ('name', 'accountNum', 'status', 'plan', 'offset', 'column', 'slot')
+
+    def __init__(self, name, accountNum, balance, status, plan, offset=None, column=None, slot=0):
         self.name = name
         self.accountNum = accountNum
-        self.balance = balance
         self.status = status
-        self.plan = plan
\ No newline at end of file
+        self.plan = plan
+        self.offset = offset
+
+        # with a column given, the balance is already in its slot
+        if column is None:
+            column = array('q', (toCents(balance),))
+        self.column = column
+        self.slot = slot
+
+    @property
+    def cents(self):
+        return self.column[self.slot]
+
+    @cents.setter
+    def cents(self, value):
+        self.column[self.slot] = value
+
+    @property
+    def balance(self):
+        return self.column[self.slot] / 100
+
+    @balance.setter
+    def balance(self, value):
+        self.column[self.slot] = toCents(value)
+
+    '''
+    Moves the balance to another balance column, into the given slot or
+    else to the end of the column, leaving the old slot as it was.
+    '''
+
+    def moveTo(self, column, slot=None):
+        if slot is None:
+            column.append(self.column[self.slot])
+            slot = len(column) - 1
+        else:
+            column[slot] = self.column[self.slot]
+        self.column = column
+        self.slot = slot
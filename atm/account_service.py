@@ -0,0 +1,396 @@
+import os
+import socket
+import socketserver
+import threading
+from contextlib import contextmanager
+
+from atm.account_store import parseRecord, formatRecord, TOMBSTONE
+from atm.storage import openAccountStore
+
+'''
+The account service keeps the indexed accounts in memory in one long-lived
+process and serves them to ATM processes over a Unix domain socket, so an
+ATM starts without reading the accounts file at all.
+
+AccountService is the daemon side: it opens the accounts once (a file or a
+database, see openAccountStore) and answers lookups and changes from any number of clients,
+one thread per connection (the store is thread-safe, see locked).
+
+RemoteAccountStore is the client side: it offers the AccountStore methods
+the ATM uses, backed by a connection to the service, and can be passed to
+ATM(accounts=...). Connections are pooled per socket path and reused by
+later stores in the same process.
+
+Accounts travel as fixed-width account records (see formatRecord). The
+client keeps one Account object per account number, so an account looked
+up twice is the same object, as it is with a local store. Lookups always
+ask the service, so they see changes made by other ATM processes. Inside
+locked() the client also holds the accounts' locks in the service and
+re-reads them first, so a check-then-change cannot be lost to another
+process.
+
+Protocol (one request line, one reply line, fields separated by tabs):
+    NUM <number> / NAME <name> / RECORD <number>
+                                   -> OK <record> or NONE
+    FIND <name> <flags> <limit>    -> OK <record>...   (flags: P prefix, I ignore case;
+                                                        an empty limit for no limit)
+    CREATE <name> <balance> <status> -> OK <record> or NONE
+    DELETE <number>                -> OK
+    UPDATE <record>                -> OK   (balance and status of a changed account)
+    BATCH <change>...              -> OK <record>... or NONE   (see applyBatch; each change is
+                                      C <name> <balance> <status>, D <number> or U <record>,
+                                      and the records are those of the new accounts)
+    LOCK <number>...               -> OK   (held until UNLOCK or disconnect)
+    UNLOCK                         -> OK
+    FLUSH / COMPACT                -> OK
+    PUBLISH                        -> OK   (publishes the accounts created over this
+                                      connection only; those of other ATM processes
+                                      stay pending until their own sessions end)
+Failures are answered with ERR <message>.
+'''
+
+SEPARATOR = "\t"
+
+
+class ServiceError(Exception):
+    pass
+
+
+'''
+Serves one client connection.
+'''
+
+class AccountRequestHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # account locks this connection holds, in the order they were taken
+        self.held = []
+
+        # numbers of the accounts created over this connection and not published yet
+        self.created = []
+
+    def handle(self):
+        store = self.server.store
+        try:
+            for raw in self.rfile:
+                request = raw.decode().rstrip('\n').split(SEPARATOR)
+                try:
+                    answer = self.dispatch(store, request[0], request[1:])
+                except Exception as e:
+                    answer = f"ERR{SEPARATOR}{e}"
+                self.wfile.write((answer + "\n").encode())
+                self.wfile.flush()
+        finally:
+            # a client that disconnects mid-operation must not keep accounts locked
+            self.releaseLocks()
+
+    def dispatch(self, store, op, args):
+        if op == "NUM":
+            return reply(store.findAccountByAccountNum(args[0]))
+        if op == "NAME":
+            return reply(store.findAccountByName(args[0]))
+        if op == "RECORD":
+            return reply(store.findRecord(args[0]))
+        if op == "FIND":
+            accounts = store.findAccountsByName(args[0], prefix="P" in args[1], ignoreCase="I" in args[1],
+                                                limit=int(args[2]) if args[2] else None)
+            return SEPARATOR.join(["OK", *(formatRecord(account) for account in accounts)])
+        if op == "CREATE":
+            account = store.createAccount(args[0], float(args[1]), args[2])
+            if account is not None:
+                self.created.append(account.accountNum)
+            return reply(account)
+        if op == "DELETE":
+            account = store.findRecord(args[0])
+            if account is not None:
+                store.deleteAccount(account)
+            return "OK"
+        if op == "UPDATE":
+            account = applyImage(store, args[0])
+            if account is not None:
+                store.markDirty(account)
+            return "OK"
+        if op == "BATCH":
+            return self.batch(store, args)
+        if op == "LOCK":
+            # same order as AccountStore.locked, so clients cannot deadlock each other
+            for num in sorted(set(args), key=lambda num: (len(num), num)):
+                lock = store.lockFor(num)
+                lock.acquire()
+                self.held.append(lock)
+            return "OK"
+        if op == "UNLOCK":
+            self.releaseLocks()
+            return "OK"
+        if op == "FLUSH":
+            store.flush()
+            return "OK"
+        if op == "COMPACT":
+            store.compactIfNeeded()
+            return "OK"
+        if op == "PUBLISH":
+            store.publishPending(self.created)
+            self.created = []
+            return "OK"
+        raise ServiceError(f"unknown request '{op}'")
+
+    def batch(self, store, args):
+        creates = []
+        deletes = []
+        updates = []
+        fields = iter(args)
+        for kind in fields:
+            if kind == "C":
+                creates.append((next(fields), float(next(fields)), next(fields)))
+            elif kind == "D":
+                account = store.findRecord(next(fields))
+                if account is not None:
+                    deletes.append(account)
+            elif kind == "U":
+                account = applyImage(store, next(fields))
+                if account is not None:
+                    updates.append(account)
+            else:
+                raise ServiceError(f"unknown batch change '{kind}'")
+
+        created = store.applyBatch(creates, deletes, updates)
+        if created is None:
+            return "NONE"
+        self.created += [account.accountNum for account in created]
+        return SEPARATOR.join(["OK", *(formatRecord(account) for account in created)])
+
+    def releaseLocks(self):
+        for lock in reversed(self.held):
+            lock.release()
+        self.held = []
+
+
+'''
+Copies the balance and status of an account record sent by a client onto
+the store's account. Returns the account, or None if it no longer exists.
+'''
+
+def applyImage(store, record):
+    image = parseRecord(record)
+    account = store.findRecord(image.accountNum)
+    if account is not None:
+        account.balance = image.balance
+        account.status = image.status
+    return account
+
+
+'''
+Formats the reply for a lookup: the account's record, or NONE.
+'''
+
+def reply(account):
+    if account is None:
+        return "NONE"
+    return f"OK{SEPARATOR}{formatRecord(account)}"
+
+
+class AccountService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, accounts_path, socketPath, lazyLoad=False):
+        self.store = openAccountStore(accounts_path, lazy=lazyLoad)
+        self.socketPath = socketPath
+
+        if os.path.exists(socketPath):
+            os.remove(socketPath)
+        super().__init__(socketPath, AccountRequestHandler)
+
+    '''
+    Stops serving, writes back every pending change and removes the socket file.
+    '''
+
+    def close(self):
+        self.server_close()
+        self.store.flush()
+        if os.path.exists(self.socketPath):
+            os.remove(self.socketPath)
+
+
+# idle client connections by socket path
+connectionPool = {}
+poolLock = threading.Lock()
+
+
+'''
+One client connection to the account service.
+'''
+
+class ServiceConnection:
+    def __init__(self, socketPath):
+        self.socketPath = socketPath
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(socketPath)
+        self.file = self.sock.makefile('rwb')
+
+    '''
+    Sends one request and returns the fields of the reply after its status.
+
+    Returns None for a NONE reply; raises ServiceError for an ERR reply.
+    '''
+
+    def request(self, *fields):
+        self.file.write((SEPARATOR.join(fields) + "\n").encode())
+        self.file.flush()
+        line = self.file.readline()
+        if not line:
+            raise ServiceError("account service closed the connection")
+
+        status, _, rest = line.decode().rstrip('\n').partition(SEPARATOR)
+        if status == "NONE":
+            return None
+        if status == "ERR":
+            raise ServiceError(rest)
+        return rest
+
+    def close(self):
+        self.file.close()
+        self.sock.close()
+
+
+'''
+Takes an idle connection to the service from the pool, or opens a new one.
+'''
+
+def checkoutConnection(socketPath):
+    with poolLock:
+        idle = connectionPool.get(socketPath)
+        if idle:
+            return idle.pop()
+    return ServiceConnection(socketPath)
+
+
+'''
+Returns a connection to the pool for the next store in this process.
+'''
+
+def releaseConnection(connection):
+    with poolLock:
+        connectionPool.setdefault(connection.socketPath, []).append(connection)
+
+
+class RemoteAccountStore:
+    def __init__(self, socketPath):
+        self.connection = checkoutConnection(socketPath)
+
+        # one Account object per account number, refreshed by every lookup
+        self.cache = {}
+
+    '''
+    Updates the cached Account for a record received from the service.
+    '''
+
+    def toAccount(self, record):
+        if record is None:
+            return None
+
+        image = parseRecord(record)
+        account = self.cache.get(image.accountNum)
+        if account is None:
+            self.cache[image.accountNum] = image
+            return image
+
+        account.name = image.name
+        account.balance = image.balance
+        account.status = image.status
+        return account
+
+    def findAccountByAccountNum(self, accountNum):
+        return self.toAccount(self.connection.request("NUM", accountNum))
+
+    def findAccountByName(self, name):
+        return self.toAccount(self.connection.request("NAME", name))
+
+    def findAccountByNameAndNumber(self, name, accountNum):
+        account = self.findAccountByAccountNum(accountNum)
+        if account and account.name == name:
+            return account
+        return None
+
+    def findRecord(self, accountNum):
+        return self.toAccount(self.connection.request("RECORD", accountNum))
+
+    def findAccountsByName(self, name, prefix=False, ignoreCase=False, limit=None):
+        flags = ("P" if prefix else "") + ("I" if ignoreCase else "")
+        records = self.connection.request("FIND", name, flags, "" if limit is None else f"{limit}")
+        return [self.toAccount(record) for record in records.split(SEPARATOR) if record]
+
+    def createAccount(self, name, balance, status="A"):
+        return self.toAccount(self.connection.request("CREATE", name, f"{balance}", status))
+
+    def deleteAccount(self, account):
+        self.connection.request("DELETE", account.accountNum)
+        account.status = TOMBSTONE
+
+    def markDirty(self, account):
+        if account.status == TOMBSTONE:
+            return
+        self.connection.request("UPDATE", formatRecord(account))
+
+    '''
+    Sends a batch of admin changes to the service, which applies them in one go.
+    '''
+
+    def applyBatch(self, creates, deletes, updates):
+        fields = []
+        for name, balance, status in creates:
+            fields += ["C", name, f"{balance}", status]
+        for account in deletes:
+            fields += ["D", account.accountNum]
+        for account in updates:
+            fields += ["U", formatRecord(account)]
+
+        records = self.connection.request("BATCH", *fields)
+        if records is None:
+            return None
+        for account in deletes:
+            account.status = TOMBSTONE
+        return [self.toAccount(record) for record in records.split(SEPARATOR) if record]
+
+    '''
+    Holds the accounts' locks in the service for the duration of a with block.
+
+    The accounts are re-read once the locks are held, so the block checks
+    and changes their current state even if another process changed them.
+    An account deleted in the meantime is marked with the tombstone status.
+    '''
+
+    @contextmanager
+    def locked(self, *accounts):
+        self.connection.request("LOCK", *(account.accountNum for account in accounts))
+        try:
+            for account in accounts:
+                if self.findRecord(account.accountNum) is None:
+                    self.cache.pop(account.accountNum, None)
+                    account.status = TOMBSTONE
+            yield
+        finally:
+            self.connection.request("UNLOCK")
+
+    def flush(self):
+        self.connection.request("FLUSH")
+
+    def compactIfNeeded(self):
+        self.connection.request("COMPACT")
+
+    '''
+    Publishes the accounts created through this store. The service tracks
+    them per connection, so accountNums is accepted for compatibility with
+    AccountStore and not sent.
+    '''
+
+    def publishPending(self, accountNums=None):
+        self.connection.request("PUBLISH")
+
+    '''
+    Hands the connection back to the pool.
+    '''
+
+    def close(self):
+        if self.connection is not None:
+            releaseConnection(self.connection)
+            self.connection = None
@@ -1,4 +1,19 @@
+import atexit
+import mmap
+import os
+import sys
+import threading
+import weakref
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from contextlib import contextmanager
+from itertools import repeat
+
 from atm.account import Account
+from atm.journal import Journal, JOURNAL_SUFFIX
+from atm.snapshot import readSnapshot, writeSnapshot, fileStamp
+from atm.bulk_reader import readAccountColumns, splitTombstones
 
 '''
 The AccountStore class is the central storage and retrieval manager 
@@ -10,12 +25,197 @@ of the session. It provides lookup functionality to retrieve accounts
 by name, account number, or both.
 
 It maintains the collection of active accounts and serves as the primary
-access point for account queries within the system.
+access point for account queries within the system. Lookups are served
+from dictionary indexes so they take constant time regardless of how
+many accounts the bank holds. Searches by the start of a name, or
+regardless of case, go through a sorted name index instead (see
+findAccountsByName), built on the first search.
+
+New account numbers are handed out by an allocator that is seeded from the
+highest number seen in the file and from a small high-water mark sidecar
+file, so numbers stay unique across sessions and are never reused after a
+delete.
+
+In lazy mode the accounts file is memory-mapped instead of parsed up front.
+The store indexes record offsets incrementally, only as far into the file
+as a lookup needs, and decodes an Account the first time it is touched.
+
+Changes to balances and statuses are tracked as dirty accounts and written
+back by flush, which overwrites only the changed records at their known
+offsets in one pass instead of rewriting the file. Until then each change is
+also appended to a write-ahead journal, which is replayed on the next load
+if the process stopped before flushing.
+
+A fully loaded store also keeps a binary snapshot of itself next to the
+accounts file (see snapshot). Later loads read the snapshot instead of
+parsing the file as long as it still matches the file. The snapshot is
+written again when the process exits if the file has changed, so most
+starts never parse a record, and a batch of sessions writes it only once.
+
+Deleting an account overwrites the status byte of its record with a
+tombstone instead of rewriting the file. Loaders skip tombstoned records,
+and compaction rewrites the file once to drop them when enough of them
+have piled up.
+
+The store can be shared by sessions running on several threads. Each
+account has its own lock (see locked): an operation holds the locks of the
+accounts it changes while it checks and updates them, and operations on two
+accounts take both locks in account number order, so they cannot deadlock.
+Operations on different accounts never wait for each other. Changes to the
+store itself (indexes, dirty accounts, the accounts file) are serialised by
+a store lock that is only held for the bookkeeping step; journal entries
+are appended outside it, under the journal's own lock.
+
+Balances are kept as whole cents in one balance column, an array of 64-bit
+integers with a slot per account (see Account), rather than as a float
+object per account. The column can be summed in one step (see
+totalCents), or viewed as a NumPy array without copying it. An account
+leaving the store takes its balance with it; its slot is zeroed and
+handed to the next account that joins, so the column does not grow with
+every create and delete.
 '''
 
+# number of records indexed per step when a lazy lookup has to scan further
+LAZY_SCAN_BATCH = 4096
+
+# suffix of the sidecar file holding the highest account number ever allocated
+HIGH_WATER_MARK_SUFFIX = ".hwm"
+
+# account numbers are five digits wide
+MAX_ACCOUNT_NUM = 99999
+
+# column of the status byte in a record, and the status marking a deleted record
+STATUS_COLUMN = 27
+TOMBSTONE = "X"
+
+# width of a record, and its size on disk with the newline
+RECORD_WIDTH = 37
+RECORD_SIZE = RECORD_WIDTH + 1
+
+# compaction runs once there are at least this many tombstones
+# and they make up more than this fraction of the file
+COMPACT_MIN_TOMBSTONES = 64
+COMPACT_RATIO = 0.25
+COMPACT_SUFFIX = ".compact"
+
+
+'''
+Parses a single fixed-width account record.
+
+Returns the Account described by the line, or None for the END_OF_FILE record.
+'''
+
+def parseRecord(line):
+    # contraint: every line is exactly 37 characters (plus newline)
+    # intern the keys so the record and the indexes share one string,
+    # and holders with several accounts share a single name
+    account_num = sys.intern(line[0:5].strip())
+    name = sys.intern(line[6:26].strip())
+    status = line[27]
+    balance = float(line[29:37].strip())
+
+    # constraint: file ends with a special bank account END_OF_FILE
+    if name == "END_OF_FILE":
+        return None
+
+    #!TEMP FIX BECUASE PLAN IS NOT STORED
+    plan = None
+
+    return Account(name, account_num, balance, status, plan)
+
+
+'''
+Formats an account as a fixed-width record (without the newline).
+
+    NNNNN_AAAAAAAAAAAAAAAAAAAA_S_PPPPPPPP
+
+Raises ValueError if the account does not fit the record (a balance of
+$100000.00 or more, or a number longer than five digits), since a longer
+record written in place would run into the next one.
+'''
+
+def formatRecord(account):
+    record = f"{account.accountNum:0>5} {account.name:<20.20} {account.status} {account.balance:08.2f}"
+    if len(record) != RECORD_WIDTH:
+        raise ValueError(f"account {account.accountNum} does not fit a {RECORD_WIDTH} character record: '{record}'")
+    return record
+
+
+'''
+Writes the snapshot of a store when the process exits, unless the store
+has been closed or garbage collected by then.
+'''
+
+def saveSnapshotAtExit(ref):
+    store = ref()
+    if store is not None:
+        store.saveSnapshot()
+
+
 class AccountStore:
     def __init__(self):
-        self.accounts = []
+        # every account held, in the order it was added; the accounts are the
+        # keys of a dict rather than items of a list so removing one takes constant time
+        self.accounts = {}
+
+        # balance of every account held by the store, in cents (see Account),
+        # and the slots left free by accounts that left the store
+        self.balances = array('q')
+        self.freeSlots = []
+
+        # lookup indexes, kept in sync by addAccount / removeAccount
+        # (name, number) lookups go through the number index since account numbers are unique
+        self.accountsByNum = {}
+        self.accountsByName = {}
+
+        # sorted name index for searches, built on first use: holder names in
+        # lower case, in order, and the account of each (its record offset in lazy mode)
+        self.nameKeys = None
+        self.nameEntries = None
+
+        # account number allocation: highest number seen so far and the next one to hand out
+        self.path = None
+        self.highestAccountNum = 0
+        self.nextAccountNum = None
+
+        # accounts created this session: written to the file but not yet available for lookups
+        self.pending = {}
+
+        # END_OF_FILE record (if any) and its offset, kept last when appending
+        self.endOffset = None
+        self.endRecord = None
+
+        # tombstoned records still present in the file
+        self.tombstones = 0
+
+        # changed accounts waiting to be written back, by account number
+        self.dirty = {}
+
+        # write-ahead journal of changes not yet flushed to the accounts file
+        self.journal = None
+
+        # snapshot upkeep: whether snapshots are kept, the size and mtime of the
+        # accounts file after this store last read or wrote it (None once someone
+        # else has written it), and whether the file changed since the last snapshot
+        self.snapshots = False
+        self.stamp = None
+        self.snapshotStale = False
+        self.snapshotAtExit = False
+
+        # lazy mode state: the mapped file, how far it has been indexed,
+        # and record offsets by account number / holder name
+        self.lazy = False
+        self.map = None
+        self.scanPos = 0
+        self.scanDone = True
+        self.offsetsByNum = {}
+        self.offsetsByName = {}
+        self.decoded = {}
+
+        # per-account locks by account number, created on first use,
+        # and the lock guarding the store's own structures
+        self.locks = {}
+        self.storeLock = threading.RLock()
     
     # load accounts from file
 
@@ -25,32 +225,953 @@ class AccountStore:
     Reads each line from the specified file, parses the fixed-width
     account fields, creates Account objects, and stores them in memory.
     Stops loading when the END_OF_FILE marker is encountered.
+    Tombstoned (deleted) records are skipped.
+
+    When lazy is True the file is memory-mapped and nothing is parsed
+    until the first lookup, so startup does not depend on the file size.
+
+    When journal is True, changes are journaled until they are flushed, and
+    any journal left behind by a previous run is replayed first.
+
+    When snapshot is True (and lazy is not), the accounts are read from the
+    binary snapshot if it matches the file; otherwise the file is parsed and
+    a new snapshot is written by close, or when the process exits if the
+    store is still in use then. A load that fails writes no snapshot.
 
     Constraints:
         - Each line must follow the fixed-width format.
         - File must contain an END_OF_FILE record.
     '''
 
-    def load(self, path):
-        with open(path, 'r') as file:
-            for line in file:
-                line = line.rstrip('\n')
-                
-                # contraint: every line is exactly 37 characters (plus newline)
-                account_num = line[0:5].strip()
-                name = line[6:26].strip()
-                status = line[27]
-                balance = float(line[29:37].strip())
-                
-                # constraint: file ends with a special bank account END_OF_FILE
-                if name == "END_OF_FILE":
+    def load(self, path, lazy=False, journal=True, snapshot=True):
+        self.path = path
+        if lazy:
+            self.loadMapped(path)
+        else:
+            self.snapshots = snapshot
+            if snapshot:
+                self.stamp = fileStamp(path)
+            if not (snapshot and self.loadSnapshot(path)):
+                self.loadRecords(path)
+                self.snapshotStale = snapshot
+            self.seedAllocator()
+
+        if journal:
+            self.journal = Journal(path + JOURNAL_SUFFIX)
+            self.recover()
+
+        # once per store, and without keeping the store alive until the process exits
+        if self.snapshots and not self.snapshotAtExit:
+            self.snapshotAtExit = True
+            atexit.register(saveSnapshotAtExit, weakref.ref(self))
+
+    '''
+    Parses every record of the accounts file into memory.
+
+    With NumPy installed, a strictly fixed-width file is read in bulk (see
+    bulk_reader); otherwise it is parsed one line at a time.
+    '''
+
+    def loadRecords(self, path):
+        columns = readAccountColumns(path)
+        if columns is not None:
+            nums, names, statuses, cents, offsets, tombstones = splitTombstones(columns, TOMBSTONE)
+            self.addAccounts(nums, names, statuses, cents, offsets)
+            self.tombstones = tombstones
+            if len(columns.numbers):
+                self.highestAccountNum = max(self.highestAccountNum, int(columns.numbers.max()))
+            self.endOffset = columns.endOffset
+            self.endRecord = columns.endRecord
+            return
+
+        with open(path, 'rb') as file:
+            offset = 0
+            for raw in file:
+                account = parseRecord(raw.decode().rstrip('\n'))
+                if account is None:
+                    self.endOffset = offset
+                    self.endRecord = raw
                     break
-                
-                #!TEMP FIX BECUASE PLAN IS NOT STORED
-                plan = None
 
-                account = Account(name,account_num, balance, status, plan)
-                self.accounts.append(account)
+                account.offset = offset
+                offset += len(raw)
+
+                # deleted records keep their number reserved but are not loaded
+                if account.status == TOMBSTONE:
+                    self.noteAccountNum(account.accountNum)
+                    self.tombstones += 1
+                    continue
+
+                self.addAccount(account)
+
+    '''
+    Loads the accounts from the snapshot of the accounts file.
+
+    Returns False, leaving the store empty, if there is no snapshot that
+    matches the file.
+    '''
+
+    def loadSnapshot(self, path):
+        snapshot = readSnapshot(path)
+        if snapshot is None:
+            return False
+
+        self.addAccounts(snapshot.nums, snapshot.names, snapshot.statuses, snapshot.balances, snapshot.offsets)
+
+        self.tombstones = snapshot.tombstones
+        self.highestAccountNum = max(self.highestAccountNum, snapshot.highestAccountNum)
+        self.endOffset = snapshot.endOffset
+        self.endRecord = snapshot.endRecord
+        return True
+
+    '''
+    Writes a new snapshot if the accounts file changed since the last one.
+
+    Runs when the store is closed, or when the process exits. Nothing is
+    written while changes are waiting to be flushed, or once another process
+    has written the accounts file, since the accounts in memory may no longer
+    match it.
+    '''
+
+    def saveSnapshot(self):
+        with self.storeLock:
+            # unflushed changes are in memory but not in the file the snapshot must match
+            if not self.snapshotStale or self.dirty:
+                return
+            self.snapshotStale = False
+
+            # the snapshot only saves time, so a file that has gone or cannot be
+            # written just leaves the next load to parse the accounts file
+            try:
+                if self.stamp is None or fileStamp(self.path) != self.stamp:
+                    self.snapshots = False
+                    return
+
+                accounts = sorted([*self.accounts, *self.pending.values()], key=lambda account: account.offset)
+                writeSnapshot(self.path, accounts, self.tombstones, self.highestAccountNum, self.endOffset, self.endRecord)
+            except OSError:
+                pass
+
+    '''
+    Wraps a write of the accounts file by the store, keeping track of whether
+    the snapshot is out of date and whether anyone else wrote the file.
+    '''
+
+    @contextmanager
+    def writingFile(self):
+        if not self.snapshots:
+            yield
+            return
+
+        unchanged = self.stamp is not None and fileStamp(self.path) == self.stamp
+        yield
+        self.stamp = fileStamp(self.path) if unchanged else None
+        self.snapshotStale = True
+
+    '''
+    Memory-maps the accounts file for lazy loading.
+
+    Only the mapping is set up here; record offsets are indexed on demand
+    by the lookup methods and Account objects are decoded when first used.
+    '''
+
+    def loadMapped(self, path):
+        self.lazy = True
+        with open(path, 'rb') as file:
+            # an empty file cannot be mapped, and has nothing to index anyway
+            self.scanDone = file.seek(0, 2) == 0
+            if not self.scanDone:
+                self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    '''
+    Releases the memory-mapped accounts file, if one is open, and writes the
+    snapshot if it is out of date. Closing ends the store's snapshot upkeep.
+    '''
+
+    def close(self):
+        if self.snapshots:
+            self.saveSnapshot()
+            self.snapshots = False
+            self.snapshotStale = False
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.scanDone = True
+
+    '''
+    Indexes the next batch of records in the mapped file.
+
+    Only the account number and holder name are sliced out of each record;
+    the rest of the record is left undecoded until an account is requested.
+    '''
+
+    def scanMore(self):
+        mm = self.map
+        pos = self.scanPos
+        size = len(mm)
+
+        for _ in range(LAZY_SCAN_BATCH):
+            if pos >= size:
+                self.scanDone = True
+                break
+
+            end = mm.find(b'\n', pos)
+            if end == -1:
+                end = size
+
+            name = sys.intern(mm[pos + 6:pos + 26].decode().strip())
+
+            # constraint: file ends with a special bank account END_OF_FILE
+            if name == "END_OF_FILE":
+                self.endOffset = pos
+                self.endRecord = mm[pos:end + 1]
+                self.scanDone = True
+                break
+
+            account_num = sys.intern(mm[pos:pos + 5].decode().strip())
+            if mm[pos + STATUS_COLUMN:pos + STATUS_COLUMN + 1] == TOMBSTONE.encode():
+                self.noteAccountNum(account_num)
+                self.tombstones += 1
+            elif pos not in self.decoded:
+                # records published by publishPending are indexed already
+                self.indexOffset(account_num, name, pos)
+
+            pos = end + 1
+
+        self.scanPos = pos
+
+    '''
+    Registers a record offset in the lazy indexes.
+    '''
+
+    def indexOffset(self, accountNum, name, offset):
+        self.offsetsByNum.setdefault(accountNum, offset)
+        self.noteAccountNum(accountNum)
+
+        named = self.offsetsByName.get(name)
+        if named is None:
+            self.offsetsByName[name] = offset
+        elif isinstance(named, list):
+            named.append(offset)
+        else:
+            self.offsetsByName[name] = [named, offset]
+        self.indexName(name, offset)
+
+    '''
+    Looks up a record offset in one of the lazy indexes, scanning further
+    into the mapped file until the key is found or the file is exhausted.
+    '''
+
+    def findOffset(self, index, key):
+        while key not in index and not self.scanDone:
+            self.scanMore()
+
+        offset = index.get(key)
+        if isinstance(offset, list):
+            return offset[0]
+        return offset
+
+    '''
+    Returns the Account stored at the given offset of the mapped file,
+    decoding it on first access and caching it afterwards.
+    '''
+
+    def decodeAt(self, offset):
+        account = self.decoded.get(offset)
+        if account is None:
+            end = self.map.find(b'\n', offset)
+            if end == -1:
+                end = len(self.map)
+            account = parseRecord(self.map[offset:end].decode())
+            account.offset = offset
+            self.adoptBalance(account)
+            self.decoded[offset] = account
+            self.accounts[account] = None
+        return account
+
+    '''
+    Resolves an account through a lazy index, or returns None if no record matches.
+    '''
+
+    def findMapped(self, index, key):
+        with self.storeLock:
+            offset = self.findOffset(index, key)
+            if offset is None:
+                return None
+            return self.decodeAt(offset)
+
+    '''
+    Fills an empty store with accounts given column by column, in file order.
+
+    cents is an array('q') of the balances in cents, which becomes the
+    store's balance column as it is.
+
+    The indexes are built in bulk rather than through addAccount, with the
+    same result: the first account wins for a number or a name, and holders
+    with several accounts get a list in file order. Account numbers are not
+    noted for the allocator; the caller sets highestAccountNum.
+    '''
+
+    def addAccounts(self, nums, names, statuses, cents, offsets):
+        self.nameKeys = None
+        self.balances = cents
+        self.freeSlots = []
+        accounts = list(map(Account, names, nums, repeat(None), statuses, repeat(None), offsets,
+                            repeat(cents), range(len(cents))))
+        self.accounts = dict.fromkeys(accounts)
+
+        # built back to front, so the first account for a key is the one kept
+        self.accountsByNum = dict(zip(reversed(nums), reversed(accounts)))
+        self.accountsByName = dict(zip(reversed(names), reversed(accounts)))
+        if len(self.accountsByName) < len(accounts):
+            shared = {name for name, count in Counter(names).items() if count > 1}
+            for name in shared:
+                self.accountsByName[name] = []
+            for account in accounts:
+                if account.name in shared:
+                    self.accountsByName[account.name].append(account)
+
+    '''
+    Adds an account to the store and registers it in every lookup index.
+
+    When several accounts share a holder name, name lookups keep returning
+    the first one that was added, matching the original file order.
+    '''
+
+    def addAccount(self, account):
+        if account.column is not self.balances:
+            self.adoptBalance(account)
+        self.accounts[account] = None
+        self.noteAccountNum(account.accountNum)
+        self.accountsByNum.setdefault(account.accountNum, account)
+
+        # most holders own a single account, so the name index stores the account
+        # itself and only switches to a list for holders with several accounts
+        named = self.accountsByName.get(account.name)
+        if named is None:
+            self.accountsByName[account.name] = account
+        elif isinstance(named, list):
+            named.append(account)
+        else:
+            self.accountsByName[account.name] = [named, account]
+        self.indexName(account.name, account)
+
+    '''
+    Records an account number as seen, so the allocator never hands it out.
+    '''
+
+    def noteAccountNum(self, accountNum):
+        if accountNum.isdigit():
+            num = int(accountNum)
+            if num > self.highestAccountNum:
+                self.highestAccountNum = num
+
+    '''
+    Seeds the account number allocator.
+
+    The next number follows both the highest number in the accounts file and
+    the high-water mark left by earlier sessions. In lazy mode the rest of the
+    file is indexed first, so this only happens once an account is created.
+    '''
+
+    def seedAllocator(self):
+        while not self.scanDone:
+            self.scanMore()
+
+        highest = self.highestAccountNum
+        try:
+            with open(self.path + HIGH_WATER_MARK_SUFFIX, 'r') as file:
+                highest = max(highest, int(file.read().strip() or 0))
+        except (FileNotFoundError, ValueError):
+            pass
+
+        self.nextAccountNum = highest + 1
+
+    '''
+    Allocates a new, unique account number.
+
+    Persists the number as the new high-water mark so later sessions continue
+    after it. Returns the number as a five digit string, or None once every
+    account number has been used.
+    '''
+
+    def allocateAccountNum(self):
+        nums = self.allocateAccountNums(1)
+        return None if nums is None else nums[0]
+
+    '''
+    Allocates the given count of new, consecutive account numbers, persisting
+    the high-water mark once for all of them.
+
+    Returns the numbers as five digit strings, or None, allocating nothing,
+    if there are not that many account numbers left.
+    '''
+
+    def allocateAccountNums(self, count):
+        if self.nextAccountNum is None:
+            self.seedAllocator()
+
+        first = self.nextAccountNum
+        if first + count - 1 > MAX_ACCOUNT_NUM:
+            return None
+
+        if count:
+            self.nextAccountNum = first + count
+            self.writeHighWaterMark(first + count - 1)
+        return [f"{num:05d}" for num in range(first, first + count)]
+
+    '''
+    Persists the highest account number allocated so far.
+    '''
+
+    def writeHighWaterMark(self, num):
+        with open(self.path + HIGH_WATER_MARK_SUFFIX, 'w') as file:
+            file.write(f"{num:05d}\n")
+
+    '''
+    Creates a new account (active by default) and appends its record to the accounts file.
+
+    The account gets the next number from the allocator. It is kept as pending:
+    it can be deleted, but lookups do not return it until the next session.
+    If the file ends with an END_OF_FILE record, the new record takes its place
+    and the END_OF_FILE record is written again after it.
+
+    Returns the new Account, or None if no account number is available.
+    '''
+
+    def createAccount(self, name, balance, status="A"):
+        with self.storeLock:
+            acc_num = self.allocateAccountNum()
+            if acc_num is None:
+                return None
+
+            account = Account(name, acc_num, balance, status, None)
+            self.adoptBalance(account)
+            record = (formatRecord(account) + "\n").encode()
+
+            with self.writingFile(), open(self.path, 'r+b') as file:
+                account.offset = self.appendRecords(file, record)
+
+            self.pending[acc_num] = account
+            return account
+
+    '''
+    Writes records at the end of the open accounts file, in place of its
+    END_OF_FILE record if it ends with one (writing it again after them).
+
+    Returns the offset of the first record written.
+    '''
+
+    def appendRecords(self, file, records):
+        size = file.seek(0, 2)
+        if self.endRecord is not None and self.endOffset + len(self.endRecord) == size:
+            offset = self.endOffset
+            trailer = self.endRecord
+        else:
+            offset = size
+            trailer = b""
+
+            # never glue the new record onto a last line without a newline
+            if size > 0:
+                file.seek(size - 1)
+                if file.read(1) != b"\n":
+                    file.write(b"\n")
+                    offset += 1
+
+        file.seek(offset)
+        file.write(records + trailer)
+
+        if trailer:
+            self.endOffset = offset + len(records)
+        return offset
+
+    '''
+    Makes the accounts created this session available for lookups.
+
+    Called when a session ends, so that the next session in the same process
+    sees them just as it would after reloading the accounts file. With
+    accountNums given, only those accounts are published, so a session
+    sharing the store with others publishes only the accounts it created;
+    otherwise every pending account is.
+    '''
+
+    def publishPending(self, accountNums=None):
+        with self.storeLock:
+            if accountNums is None:
+                accountNums = list(self.pending)
+            for num in accountNums:
+                account = self.pending.pop(num, None)
+                if account is None:
+                    continue
+                if self.lazy:
+                    # the scan may have reached the record already
+                    if self.offsetsByNum.get(account.accountNum) != account.offset:
+                        self.indexOffset(account.accountNum, account.name, account.offset)
+                    if account.offset not in self.decoded:
+                        self.decoded[account.offset] = account
+                        self.accounts[account] = None
+                else:
+                    self.addAccount(account)
+
+    '''
+    Finds the record for an account number, including accounts created
+    this session that are not available for lookups yet.
+
+    Returns the matching Account object if found. Returns None if no match is found.
+    '''
+
+    def findRecord(self, accountNum):
+        account = self.findAccountByAccountNum(accountNum)
+        if account is None:
+            account = self.pending.get(accountNum)
+        return account
+
+    '''
+    Deletes an account by writing a tombstone over the status byte of its record.
+
+    The rest of the file is left untouched; the record is dropped for good the
+    next time the file is compacted. The account is also removed from the
+    lookup indexes straight away.
+    '''
+
+    def deleteAccount(self, account):
+        with self.storeLock:
+            with self.writingFile(), open(self.path, 'r+b') as file:
+                file.seek(account.offset + STATUS_COLUMN)
+                file.write(TOMBSTONE.encode())
+
+            self.forgetDeleted(account)
+
+    '''
+    Drops an account whose record has just been tombstoned from the store.
+    '''
+
+    def forgetDeleted(self, account):
+        if self.pending.get(account.accountNum) is account:
+            del self.pending[account.accountNum]
+            self.releaseBalance(account)
+        else:
+            self.removeAccount(account)
+        self.tombstones += 1
+
+        # a pending write-back would overwrite the tombstone, and a session
+        # still holding the account must not mark it dirty again
+        self.dirty.pop(account.accountNum, None)
+        account.status = TOMBSTONE
+
+    '''
+    Applies a batch of admin changes with a single pass over the accounts file.
+
+    creates holds the (name, balance, status) of each new account, deletes
+    the accounts to delete, and updates the accounts whose status changed.
+    The file is opened once: deleted records get their tombstone, changed
+    records are overwritten in place (and journaled, so an older journal
+    entry cannot undo them), the new records are appended in one write, and
+    the file is synced once at the end. The new accounts are pending, as
+    with createAccount.
+
+    Returns the new accounts in order, or None, changing nothing, if there
+    are not enough account numbers left for them.
+    '''
+
+    def applyBatch(self, creates, deletes, updates):
+        with self.storeLock:
+            nums = self.allocateAccountNums(len(creates))
+            if nums is None:
+                return None
+
+            created = []
+            for acc_num, (name, balance, status) in zip(nums, creates):
+                account = Account(name, acc_num, balance, status, None)
+                self.adoptBalance(account)
+                created.append(account)
+
+            deleted = set(map(id, deletes))
+            updates = sorted((account for account in updates if id(account) not in deleted),
+                             key=lambda account: account.offset)
+
+            with self.writingFile(), open(self.path, 'r+b') as file:
+                for account in deletes:
+                    file.seek(account.offset + STATUS_COLUMN)
+                    file.write(TOMBSTONE.encode())
+
+                for account in updates:
+                    record = formatRecord(account)
+                    if self.journal is not None:
+                        self.journal.append(record)
+                    file.seek(account.offset)
+                    file.write((record + "\n").encode())
+
+                if created:
+                    records = [(formatRecord(account) + "\n").encode() for account in created]
+                    offset = self.appendRecords(file, b"".join(records))
+                    for account, record in zip(created, records):
+                        account.offset = offset
+                        offset += len(record)
+
+                file.flush()
+                os.fsync(file.fileno())
+
+            for account in deletes:
+                self.forgetDeleted(account)
+            for account in updates:
+                self.dirty.pop(account.accountNum, None)
+            for account in created:
+                self.pending[account.accountNum] = account
+            return created
+
+    '''
+    Returns the lock of an account number, creating it on first use.
+    '''
+
+    def lockFor(self, accountNum):
+        lock = self.locks.get(accountNum)
+        if lock is None:
+            with self.storeLock:
+                lock = self.locks.setdefault(accountNum, threading.Lock())
+        return lock
+
+    '''
+    Holds the locks of the given accounts for the duration of a with block.
+
+    The locks are taken in account number order (an account given twice is
+    locked once), so two operations locking the same accounts can never
+    wait on each other in a cycle.
+    '''
+
+    @contextmanager
+    def locked(self, *accounts):
+        nums = sorted({account.accountNum for account in accounts}, key=lambda num: (len(num), num))
+        locks = [self.lockFor(num) for num in nums]
+        for lock in locks:
+            lock.acquire()
+        try:
+            yield
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+
+    '''
+    Marks an account as changed so its record is written back on the next flush.
+
+    Accounts deleted in the meantime are ignored. The store lock is only held
+    to mark the account; the change is journaled after that, under the
+    journal's own lock, so a flush in between cannot discard the entry
+    before its change is in the accounts file.
+    '''
+
+    def markDirty(self, account):
+        # formatted first, so an account that does not fit its record is not marked at all
+        record = formatRecord(account)
+        with self.storeLock:
+            if account.status == TOMBSTONE:
+                return
+            self.dirty[account.accountNum] = account
+
+        if self.journal is not None:
+            self.journal.append(record)
+
+    '''
+    Replays the journal left by a run that stopped before flushing.
+
+    Each journal entry is the full record of an account after a change, so
+    replaying is idempotent: the latest entry for an account wins. Accounts
+    deleted since the entry was written are skipped. The recovered changes
+    are flushed straight away, which also discards the journal.
+    '''
+
+    def recover(self):
+        for record in self.journal.entries():
+            image = parseRecord(record)
+            account = self.findAccountByAccountNum(image.accountNum)
+            if account is None:
+                continue
+
+            account.balance = image.balance
+            account.status = image.status
+            self.dirty[account.accountNum] = account
+
+        self.flush()
+
+    '''
+    Writes every dirty account back to the accounts file.
+
+    Records are fixed width, so each changed record is overwritten in place at
+    its offset. Records are written in file order and neighbouring records are
+    joined into a single write, so the cost depends only on how many accounts
+    changed and never on the size of the file.
+    '''
+
+    def flush(self):
+        with self.storeLock:
+            if self.dirty:
+                self.writeBack()
+                self.dirty = {}
+
+            # the accounts file now holds every journaled change
+            if self.journal is not None:
+                self.journal.checkpoint()
+
+    '''
+    Overwrites the records of the dirty accounts and syncs the accounts file.
+
+    Every record is formatted before the file is touched, so an account that
+    does not fit its record (see formatRecord) fails the write as a whole.
+    '''
+
+    def writeBack(self):
+        accounts = sorted(self.dirty.values(), key=lambda account: account.offset)
+        records = [(formatRecord(account) + "\n").encode() for account in accounts]
+        with self.writingFile(), open(self.path, 'r+b') as file:
+            run_offset = None
+            run_end = None
+            run = []
+            for account, record in zip(accounts, records):
+                # start a new write whenever the next record is not adjacent
+                if account.offset != run_end:
+                    if run:
+                        file.seek(run_offset)
+                        file.write(b"".join(run))
+                    run_offset = account.offset
+                    run = []
+
+                run.append(record)
+                run_end = account.offset + len(record)
+
+            file.seek(run_offset)
+            file.write(b"".join(run))
+
+            file.flush()
+            os.fsync(file.fileno())
+
+    '''
+    Checks whether enough tombstones have piled up to make compaction worthwhile.
+    '''
+
+    def needsCompaction(self):
+        if self.tombstones < COMPACT_MIN_TOMBSTONES:
+            return False
+        records = os.path.getsize(self.path) // RECORD_SIZE
+        return self.tombstones > records * COMPACT_RATIO
+
+    '''
+    Compacts the accounts file if the tombstone threshold has been reached.
+
+    Returns True if the file was compacted.
+    '''
+
+    def compactIfNeeded(self):
+        with self.storeLock:
+            if not self.needsCompaction():
+                return False
+            self.compact()
+            return True
+
+    '''
+    Rewrites the accounts file once without its tombstoned records.
+
+    The new file is written next to the old one and swapped in atomically.
+    Offsets of accounts held in memory are moved to their new positions, and
+    in lazy mode the offset indexes are rebuilt from the same pass.
+    '''
+
+    def compact(self):
+        # the tombstones about to be dropped may hold the highest number ever used
+        if self.nextAccountNum is None:
+            self.seedAllocator()
+        self.writeHighWaterMark(self.nextAccountNum - 1)
+
+        moved = {account.offset: account for account in self.accounts}
+        pending_offsets = set()
+        for account in self.pending.values():
+            moved[account.offset] = account
+            pending_offsets.add(account.offset)
+
+        if self.lazy:
+            self.close()
+            self.offsetsByNum = {}
+            self.offsetsByName = {}
+            self.nameKeys = None
+            self.decoded = {}
+
+        temp_path = self.path + COMPACT_SUFFIX
+        with open(self.path, 'rb') as src, open(temp_path, 'wb') as dst:
+            offset = 0
+            new_offset = 0
+            past_end = False
+            for raw in src:
+                size = len(raw)
+                if not past_end and raw[6:26].strip() == b"END_OF_FILE":
+                    self.endOffset = new_offset
+                    self.endRecord = raw
+                    past_end = True
+                elif not past_end and raw[STATUS_COLUMN:STATUS_COLUMN + 1] == TOMBSTONE.encode():
+                    offset += size
+                    continue
+                elif not past_end:
+                    account = moved.get(offset)
+                    if account is not None:
+                        account.offset = new_offset
+                    if self.lazy and offset not in pending_offsets:
+                        name = sys.intern(raw[6:26].decode().strip())
+                        self.indexOffset(sys.intern(raw[0:5].decode().strip()), name, new_offset)
+                        if account is not None:
+                            self.decoded[new_offset] = account
+
+                dst.write(raw)
+                offset += size
+                new_offset += size
+
+            dst.flush()
+            os.fsync(dst.fileno())
+
+        with self.writingFile():
+            os.replace(temp_path, self.path)
+        self.tombstones = 0
+
+        if self.lazy:
+            self.loadMapped(self.path)
+            self.scanDone = True
+
+    '''
+    Removes an account from the store and from every lookup index.
+
+    Returns True if the account was held by the store, False otherwise.
+    Disabling an account does not require any index maintenance since
+    the status is not part of any lookup key.
+    '''
+
+    def removeAccount(self, account):
+        if self.lazy and self.decoded.get(account.offset) is account:
+            return self.removeMapped(account)
+
+        if self.accountsByNum.get(account.accountNum) is not account:
+            return False
+
+        del self.accounts[account]
+        self.releaseBalance(account)
+        del self.accountsByNum[account.accountNum]
+
+        named = self.accountsByName[account.name]
+        if isinstance(named, list):
+            named.remove(account)
+            if len(named) == 1:
+                self.accountsByName[account.name] = named[0]
+        else:
+            del self.accountsByName[account.name]
+        self.unindexName(account.name, account)
+        return True
+
+    '''
+    Removes a decoded account from the lazy indexes.
+
+    Returns True if the account was held by the store, False otherwise.
+    '''
+
+    def removeMapped(self, account):
+        offset = account.offset
+        if self.decoded.get(offset) is not account:
+            return False
+
+        del self.decoded[offset]
+        del self.accounts[account]
+        self.releaseBalance(account)
+        if self.offsetsByNum.get(account.accountNum) == offset:
+            del self.offsetsByNum[account.accountNum]
+
+        named = self.offsetsByName[account.name]
+        if isinstance(named, list):
+            named.remove(offset)
+            if len(named) == 1:
+                self.offsetsByName[account.name] = named[0]
+        else:
+            del self.offsetsByName[account.name]
+        self.unindexName(account.name, offset)
+        return True
+
+    '''
+    Builds the sorted name index from every account in the store. In lazy
+    mode the rest of the mapped file is indexed first, and the index holds
+    record offsets, so no account is decoded until a search returns it.
+
+    Entries are sorted by the lower case name; entries sharing a name keep
+    the order of the other indexes (file order).
+    '''
+
+    def buildNameIndex(self):
+        if self.lazy:
+            while not self.scanDone:
+                self.scanMore()
+            entries = []
+            for name, offsets in self.offsetsByName.items():
+                key = name.lower()
+                if isinstance(offsets, list):
+                    entries.extend((key, offset) for offset in offsets)
+                else:
+                    entries.append((key, offsets))
+            entries.sort()
+        else:
+            entries = sorted(((account.name.lower(), account) for account in self.accounts),
+                             key=lambda entry: entry[0])
+
+        self.nameKeys = [key for key, _ in entries]
+        self.nameEntries = [entry for _, entry in entries]
+
+    '''
+    Adds an account (or record offset) to the sorted name index, if it has been built.
+    '''
+
+    def indexName(self, name, entry):
+        if self.nameKeys is None:
+            return
+        key = name.lower()
+        position = bisect_right(self.nameKeys, key)
+        self.nameKeys.insert(position, key)
+        self.nameEntries.insert(position, entry)
+
+    '''
+    Removes an account (or record offset) from the sorted name index, if it has been built.
+    '''
+
+    def unindexName(self, name, entry):
+        if self.nameKeys is None:
+            return
+        key = name.lower()
+        start = bisect_left(self.nameKeys, key)
+        for position in range(start, bisect_right(self.nameKeys, key, start)):
+            if self.nameEntries[position] == entry:
+                del self.nameKeys[position]
+                del self.nameEntries[position]
+                return
+
+    '''
+    Moves the balance of an account leaving the store into a column of its
+    own, so it stays readable, and zeroes its slot in the balance column.
+    '''
+
+    def releaseBalance(self, account):
+        if account.column is self.balances:
+            slot = account.slot
+            account.moveTo(array('q'))
+            self.balances[slot] = 0
+            self.freeSlots.append(slot)
+
+    '''
+    Moves the balance of an account joining the store into the balance
+    column, reusing a slot left free by an account that left if there is one.
+    '''
+
+    def adoptBalance(self, account):
+        account.moveTo(self.balances, self.freeSlots.pop() if self.freeSlots else None)
+
+    '''
+    Returns the total balance, in cents, of the accounts in memory, including
+    those created this session (in lazy mode, only those decoded so far).
+    '''
+
+    def totalCents(self):
+        with self.storeLock:
+            return sum(self.balances)
         
     '''
     Searches for an account using both account holder name
@@ -60,9 +1181,9 @@ class AccountStore:
     '''
 
     def findAccountByNameAndNumber(self, name, accountNum):
-        for account in self.accounts:
-            if account.name == name and account.accountNum == accountNum:
-                return account
+        account = self.findAccountByAccountNum(accountNum)
+        if account and account.name == name:
+            return account
         return None
     
     '''
@@ -72,10 +1193,15 @@ class AccountStore:
     '''
 
     def findAccountByName(self, name):
-        for account in self.accounts:
-            if account.name == name:
+        if self.lazy:
+            account = self.findMapped(self.offsetsByName, name)
+            if account:
                 return account
-        return None
+
+        named = self.accountsByName.get(name)
+        if isinstance(named, list):
+            return named[0]
+        return named
 
     '''
     Searches for an account using only the account number.
@@ -84,7 +1210,45 @@ class AccountStore:
     '''
 
     def findAccountByAccountNum(self, accountNum):
-        for account in self.accounts:
-            if account.accountNum == accountNum:
+        if self.lazy:
+            account = self.findMapped(self.offsetsByNum, accountNum)
+            if account:
                 return account
-        return None
\ No newline at end of file
+
+        return self.accountsByNum.get(accountNum)
+
+    '''
+    Searches for accounts by holder name through the sorted name index.
+
+    Matches the whole name, or with prefix the start of it, and with
+    ignoreCase regardless of case. Each search is a binary search of the
+    index plus a step per match, however many accounts the bank holds.
+    Accounts created this session are not found until they are published.
+
+    Returns the matching accounts ordered by name (accounts sharing a name
+    in file order), at most limit of them when a limit is given.
+    '''
+
+    def findAccountsByName(self, name, prefix=False, ignoreCase=False, limit=None):
+        with self.storeLock:
+            if self.nameKeys is None:
+                self.buildNameIndex()
+
+            key = name.lower()
+            start = bisect_left(self.nameKeys, key)
+            if prefix:
+                # every name starting with the key sorts before the key followed by the last code point
+                end = bisect_left(self.nameKeys, key + "\U0010ffff", start)
+            else:
+                end = bisect_right(self.nameKeys, key, start)
+
+            matches = []
+            for position in range(start, end):
+                if limit is not None and len(matches) >= limit:
+                    break
+                entry = self.nameEntries[position]
+                account = self.decodeAt(entry) if self.lazy else entry
+                if not ignoreCase and not (account.name.startswith(name) if prefix else account.name == name):
+                    continue
+                matches.append(account)
+            return matches
@@ -1,89 +1,317 @@
+import os
+import re
+from collections import deque
+
+from .account import toCents, MAX_BALANCE, MAX_BALANCE_CENTS
+from .account_service import ServiceError
+from .account_store import TOMBSTONE
+from .event_store import EventSourcedStore
 from .session import Session
-from .account_store import AccountStore
+from .storage import openAccountStore
 from .input_stream import InputStream
-from .output_stream import OutputStream
+from .output_stream import OutputStream, sessionPath
 from .record_actions import RecordActions
+from .result import Result, success, failure
 
 
 version = "alpha v1.4"
 
+# main menu shown before every command
+MENU = "\n".join([
+    "\n--> login",
+    "--> deposit",
+    "--> withdraw",
+    "--> transfer",
+    "--> paybill",
+    "--> create",
+    "--> delete",
+    "--> disable",
+    "--> changeplan",
+    "--> logout\n",
+])
+
+# one field of a command line: a double or single quoted string, or a run of non-spaces
+FIELD_PATTERN = re.compile(r'"([^"]*)"|\'([^\']*)\'|(\S+)')
+
+'''
+Splits a command line into the command and the fields given after it.
+
+Fields are separated by spaces; a field holding spaces (a holder name) is
+quoted, e.g. paybill "boss test" 00002 EC 120.00
+'''
+
+def splitCommand(line):
+    line = line.strip()
+    if " " not in line:
+        return line.lower(), []
+
+    words = []
+    for match in FIELD_PATTERN.finditer(line):
+        double, single, bare = match.groups()
+        if double is not None:
+            words.append(double)
+        elif single is not None:
+            words.append(single)
+        else:
+            words.append(bare)
+    return words[0].lower(), words[1:]
+
+
+# companies bills can be paid to
+VALID_COMPANIES = {
+    "EC": "The Bright Light Electric Company",
+    "CQ": "Credit Card Company Q",
+    "FI": "Fast Internet, Inc."
+}
+
+# most accounts a find lists
+FIND_LIMIT = 20
+
+# operations a bulk batch file may hold; each takes two fields
+BATCH_OPERATIONS = ("create", "delete", "disable", "changeplan")
+
+# amounts a standard session may withdraw, transfer and pay in bills, in cents
+WITHDRAWAL_LIMIT = 50000
+TRANSFER_LIMIT = 100000
+PAYBILL_LIMIT = 200000
+
+
+'''
+Raised when the amount field of a command is not a number.
+'''
+
+class InvalidNumber(ValueError):
+    pass
+
 '''
 The ATM Class is the main controller class of the ATM Banking system
 
 This class initiates a session for a user, and then allows the user to manage
-banking operations such as deposit, withdraw or transfer money. 
+banking operations such as deposit, withdraw or transfer money.
 It also allows for administrative operations such as account creation, account deletion,
 disabling accounts and changing plans.
 It maintains session state and logs operations into a file upon logout
+
+Every operation is available as a method that takes its fields as arguments
+and returns a Result, e.g. atm.withdraw(name, account_num, amount), so other
+code can drive the ATM in-process. The command line is a thin adapter over
+these methods: run() reads a command, looks up its handler in the command
+table, and the handler prompts for the fields one at a time, stopping at the
+first field that is rejected, then prints the messages of the Result.
+
+A command may also carry its fields on the same line (see splitCommand).
+They are used in order in place of the prompts, and any field left out is
+still prompted for, so a scripted client needs one read per command.
+
+In batch mode the ATM keeps running after a logout and serves the next
+session from the same input, reusing the loaded accounts. Every session
+writes its own transaction file (see sessionPath), and the run ends at the
+end of the input.
+
+With events set, the accounts are event-sourced (see EventSourcedStore):
+every recorded transaction is also logged as an event, and a checkpoint is
+taken every that many events, between commands.
+
+The bulk command reads a batch file on the machine running the ATM. With
+bulk off it is refused; with batchDir set it only reads files inside that
+directory. Sessions whose client is not the ATM's own operator (see
+ATMServer) set one or the other.
 '''
 
 class ATM:
-    def __init__(self, accounts_path, outputPath):
+    def __init__(self, accounts_path, outputPath, lazyLoad=False, streaming=False, batch=False, buffered=False, quiet=False,
+                 accounts=None, inputStream=None, outputStream=None, events=None, bulk=True, batchDir=None):
         self.session = Session()
-        self.accounts = AccountStore()
-        self.inputStream = InputStream()
-        self.outputStream = OutputStream(outputPath)
+        self.inputStream = inputStream or InputStream()
+        self.outputStream = outputStream or OutputStream(outputPath, buffered=buffered, quiet=quiet)
         self.running = True
-        self.accounts.load(accounts_path)
         self.accounts_path = accounts_path
 
-        # log transactions to write on logout
-        self.recordActions = RecordActions()
-
-        # track session limits
-        self.session_withdrawals = 0.0
-        self.session_transfers = 0.0
-        self.session_paybills = 0.0
+        # an already loaded store can be shared by several ATMs (see ATMServer)
+        if accounts is None:
+            accounts = openAccountStore(accounts_path, lazy=lazyLoad, events=events)
+        self.accounts = accounts
+
+        # event-sourced accounts log every recorded transaction
+        self.events = accounts if isinstance(accounts, EventSourcedStore) else None
+
+        # batch mode: sessions served so far, each with its own transaction file
+        self.batch = batch
+        self.outputPath = outputPath
+        self.sessionCount = 0
+
+        # log transactions to write on logout, or stream them out as they happen
+        self.recordActions = RecordActions(self.outputStream if streaming else None, events=self.events)
+
+        # track session limits, in cents
+        self.session_withdrawals = 0
+        self.session_transfers = 0
+        self.session_paybills = 0
+
+        # accounts created this session, published to the shared store at logout
+        self.createdAccounts = []
+
+        # whether bulk may read batch files, and the directory they must be in, if any
+        self.bulkAllowed = bulk
+        self.batchDir = batchDir
+
+        # fields given on the command line, used before prompting for more
+        self.pipelined = deque()
+
+        # command line commands and their handlers
+        self.commands = {
+            "login": self.loginCommand,
+            "logout": self.logoutCommand,
+            "withdraw": self.withdrawCommand,
+            "deposit": self.depositCommand,
+            "transfer": self.transferCommand,
+            "paybill": self.paybillCommand,
+            "create": self.createCommand,
+            "delete": self.deleteCommand,
+            "disable": self.disableCommand,
+            "changeplan": self.changeplanCommand,
+            "find": self.findCommand,
+            "bulk": self.bulkCommand,
+        }
 
     '''
     This is the main execution loop for the ATM system.
-    
+
     Runs automatically when the system is started, and displays the main menu,
     it then processes user inputs and routes to the correct operation
     methods
 
     If there is an issue during a method, the system gets re-routed to this interface
+
+    In batch mode the loop ends at the end of the input; a session that is
+    still open is logged out first so its transactions are written.
     '''
     def run(self):
-        self.outputStream.write(f"welcome to ATM {version}")
-
-        while self.running:
-            self.outputStream.write("\n--> login")
-            self.outputStream.write("--> deposit")
-            self.outputStream.write("--> withdraw")
-            self.outputStream.write("--> transfer")
-            self.outputStream.write("--> paybill")
-            self.outputStream.write("--> create")
-            self.outputStream.write("--> delete")
-            self.outputStream.write("--> disable")
-            self.outputStream.write("--> changeplan")
-            self.outputStream.write("--> logout\n")
-
-            cli_choice = self.inputStream.readNextLine().strip().lower()
-            
-            if cli_choice == "login":
-                self.login()
-            elif cli_choice == "logout":
-                self.logout()
-            elif cli_choice == "withdraw":
-                self.withdraw()
-            elif cli_choice == "deposit":
-                self.deposit()
-            elif cli_choice == "transfer":
-                self.transfer()
-            elif cli_choice == "paybill":
-                self.paybill()
-            elif cli_choice == "create":
-                self.create()
-            elif cli_choice == "delete":
-                self.delete()
-            elif cli_choice == "disable":
-                self.disable()
-            elif cli_choice == "changeplan":
-                self.changeplan()
-            else:
-                self.outputStream.write("not an option, try again")
+        self.outputStream.prompt(f"welcome to ATM {version}")
+
+        try:
+            while self.running:
+                try:
+                    self.runCommand()
+                except EOFError:
+                    if not self.batch:
+                        raise
+                    if self.session.loggedIn:
+                        self.report(self.logout())
+                    self.running = False
+        finally:
+            self.outputStream.flush()
+
+    '''
+    Displays the main menu, reads one command and routes it to its handler.
+    '''
+    def runCommand(self):
+        self.outputStream.prompt(MENU)
+        self.dispatch(self.inputStream.readNextLine())
+
+    '''
+    Routes one command line to its handler.
+
+    A request to the account service that fails (see RemoteAccountStore)
+    fails the command with the service's message.
+    '''
+    def dispatch(self, line):
+        cli_choice, fields = splitCommand(line)
+
+        command = self.commands.get(cli_choice)
+        if command is None:
+            self.outputStream.write("not an option, try again")
+            return
+        self.pipelined = deque(fields)
+        try:
+            command()
+        except ServiceError as e:
+            self.report(failure(f"Error: account service request failed: {e}"))
+
+        # between commands every change has its event logged
+        if self.events is not None:
+            self.events.checkpointIfDue()
+
+    '''
+    Prints the messages of a Result and returns it.
+    '''
+    def report(self, result):
+        for message in result.messages:
+            self.outputStream.write(message)
+        return result
+
+    '''
+    Prompts for one field of a command and reads it, unless the field was
+    given on the command line.
+    '''
+    def readField(self, prompt):
+        if self.pipelined:
+            return self.pipelined.popleft()
+        self.outputStream.prompt(prompt)
+        return self.inputStream.readNextLine()
 
+    '''
+    Prompts for the amount field of a command and converts it to a number.
+    Raises InvalidNumber if it is not one.
+    '''
+    def readAmount(self, prompt):
+        field = self.readField(prompt)
+        try:
+            return float(field)
+        except ValueError:
+            raise InvalidNumber(f"invalid amount '{field.strip()}'") from None
+
+    '''
+    Reads the account holder name for a command: admins are asked for it,
+    standard sessions use the holder that logged in.
+    '''
+    def readHolderName(self):
+        if self.session.isAdmin:
+            return self.readField("enter account holder name:").strip()
+        return self.session.accountHolderName
+
+    # checks shared by the operations and their command handlers;
+    # each returns a failed Result, or None when the check passes
+
+    '''
+    Checks that a session is open.
+    '''
+    def checkLoggedIn(self):
+        if not self.session.loggedIn:
+            return failure("not logged in. please login first")
+        return None
+
+    '''
+    Checks that an admin session is open; message is the operation's own refusal.
+    '''
+    def checkAdmin(self, message):
+        rejected = self.checkLoggedIn()
+        if rejected is None and not self.session.isAdmin:
+            return failure(message)
+        return rejected
+
+    '''
+    Finds the account with the given number owned by the named holder.
+
+    Returns a tuple of the account and a failed Result (or None). When
+    disabledMessage is given, a disabled account is rejected with it.
+    '''
+    def findHolderAccount(self, name, account_num, disabledMessage=None):
+        account = self.accounts.findAccountByNameAndNumber(name, account_num)
+        if not account:
+            return None, failure(f"no account found for '{name}' with account number '{account_num}'")
+        if disabledMessage is not None and account.status == "D":
+            return account, failure(disabledMessage.format(account_num=account_num), account)
+        return account, None
+
+    '''
+    Returns the holder an operation acts for: the named holder in admin
+    mode, and the holder that logged in for standard sessions.
+    '''
+    def holderName(self, name):
+        if self.session.isAdmin:
+            return name
+        return self.session.accountHolderName
 
 
     '''
@@ -92,42 +320,53 @@ class ATM:
     Admin : Granted full system privliges without an account association
     Standard : Requries account holder name and checks to see if a valid accounts exists.
 
-    Constraints : 
+    Constraints :
         - This function cannot be run if a user is already logged in.
         - Standard accounts must have created an account before logging in.
 
     '''
-    def login(self):    
+    def login(self, session_type, account_name=None):
         # constraint: no subsequent login should be accepted after a login, until after a logout
         if self.session.loggedIn:
-            self.outputStream.write("already logged in. please logout first")
-            return
-        
-        self.outputStream.write("Enter session type 'standard' or 'admin':")
-        session_type = self.inputStream.readNextLine().strip().lower()
-        
+            return failure("already logged in. please logout first")
+
+        session_type = session_type.strip().lower()
         if session_type == "admin":
+            self.startSession()
             self.session.loggedIn = True
             self.session.isAdmin = True
-            self.outputStream.write("logged in as admin")
-            
-        elif session_type == "standard":
-            self.outputStream.write("enter account holder name:")
-            account_name = self.inputStream.readNextLine().strip()
-                        
+            return success("logged in as admin")
+
+        if session_type == "standard":
             # check if account holder exists
             if not self.accounts.findAccountByName(account_name):
-                self.outputStream.write(f"no account found for '{account_name}'")
-                return
-            
+                return failure(f"no account found for '{account_name}'")
+
+            self.startSession()
             self.session.loggedIn = True
             self.session.isAdmin = False
             self.session.accountHolderName = account_name
-            self.outputStream.write(f"Logged in as {account_name}")
-            
-        else:
-            self.outputStream.write("not an option, try 'standard' or 'admin'")
-            return
+            return success(f"Logged in as {account_name}")
+
+        return failure("not an option, try 'standard' or 'admin'")
+
+    def loginCommand(self):
+        if self.session.loggedIn:
+            return self.report(self.login(""))
+
+        session_type = self.readField("Enter session type 'standard' or 'admin':").strip().lower()
+        account_name = None
+        if session_type == "standard":
+            account_name = self.readField("enter account holder name:").strip()
+        return self.report(self.login(session_type, account_name))
+
+    '''
+    Starts a new session. In batch mode the session gets its own transaction file.
+    '''
+    def startSession(self):
+        self.sessionCount += 1
+        if self.batch:
+            self.outputStream.srcPath = sessionPath(self.outputPath, self.sessionCount)
 
 
     '''
@@ -136,18 +375,31 @@ class ATM:
     Then ensures that the current sesion is cleared by erasing transaction history from memory and resetting account
     information. Essentially clears the state.
 
-    Constraints : 
+    Constraints :
         - Only accepted when logged in
 
     '''
-    def logout(self):    
+    def logout(self):
         # constraint: should only be accepted when logged in
-        if not self.session.loggedIn:
-            self.outputStream.write("not logged in. please login first")
-            return
-        
-        # should write out the bank account transaction file 
-        self.outputStream.writeTransactionFile(self.recordActions.get_transactions())
+        rejected = self.checkLoggedIn()
+        if rejected:
+            return rejected
+
+        # should write out the bank account transaction file
+        if self.recordActions.stream is not None:
+            self.outputStream.closeTransactionFile()
+        else:
+            self.outputStream.writeTransactionFile(self.recordActions.get_transactions())
+
+        # write changed accounts back in place, then drop deleted records
+        # from the accounts file once enough of them pile up
+        self.accounts.flush()
+        self.accounts.compactIfNeeded()
+
+        # accounts created this session become available to the next one;
+        # those created by other sessions sharing the store stay pending
+        self.accounts.publishPending(self.createdAccounts)
+        self.createdAccounts = []
 
         # clear session data
         self.session.loggedIn = False
@@ -156,157 +408,159 @@ class ATM:
         self.recordActions.clear_transactions()
 
         # reset session limits
-        self.session_withdrawals = 0.0
-        self.session_transfers = 0.0
-        self.session_paybills = 0.0
-        
-        self.outputStream.write("logged out successfully")
-        self.outputStream.write(f"thank you for using ATM {version}!")
-        self.running = False
+        self.session_withdrawals = 0
+        self.session_transfers = 0
+        self.session_paybills = 0
+
+        # in batch mode the next session is read from the same input
+        if not self.batch:
+            self.running = False
+
+        return success("logged out successfully", f"thank you for using ATM {version}!")
+
+    def logoutCommand(self):
+        return self.report(self.logout())
 
 
     '''
-    Processes a deposit transaction to add funds to a bank account 
+    Processes a deposit transaction to add funds to a bank account
 
-    If the user is admin, asks for an account holder name
+    In admin mode the deposit is made for the named account holder
     Records transaction and ensures deposited funds are not available for use in session
 
-    Contraints : 
-        - User must be logged in 
-        - Account must be valid for the account holder 
+    Contraints :
+        - User must be logged in
+        - Account must be valid for the account holder
         - Deposited funds can only be used after logout
     '''
-    def deposit(self):
+    def deposit(self, account_name, account_num, amount):
         # constraint: bank account must be a valid account for the account holder currently logged in.
-        if not self.session.loggedIn:
-            self.outputStream.write("not logged in. please login first")
-            return
+        rejected = self.checkLoggedIn()
+        if rejected:
+            return rejected
+        account_name = self.holderName(account_name)
 
-        # should ask for the account holder’s name (if logged in as admin)
-        if self.session.isAdmin:
-            self.outputStream.write("enter account holder name:")
-            account_name = self.inputStream.readNextLine().strip()
-        else:
-            account_name = self.session.accountHolderName
-
-        # should ask for the account number (as a text line)
-        self.outputStream.write("enter account number:")
-        account_num = self.inputStream.readNextLine().strip()
+        # find account, and check if it is disabled
+        account, rejected = self.findHolderAccount(account_name, account_num, "error: Account {account_num} is disabled")
+        if rejected:
+            return rejected
 
-        # find account
-        account = self.accounts.findAccountByNameAndNumber(account_name, account_num)
-        if not account:
-            self.outputStream.write(f"no account found for '{account_name}' with account number '{account_num}'")
-            return
-
-        # check if account disabled
-        if account.status == "D":
-            self.outputStream.write(f"error: Account {account_num} is disabled")
-            return
-        
-        # then should ask for the amount to deposit
-        self.outputStream.write("enter deposit amount:")
-        amount = float(self.inputStream.readNextLine())
-        
         # check number is positive
         if amount <= 0:
-            self.outputStream.write("error: amount must be positive")
-            return
-        
-        # consrtaint: Deposited funds should not be available for use in this session
-        self.outputStream.write(f"deposited ${amount:.2f} to account {account_num}. funds will be available after logout")
-        
+            return failure("error: amount must be positive", account)
+
         # should save this information for the bank account transaction file
         self.recordActions.record_transaction("04", account_name, account_num, amount, "")
 
+        # consrtaint: Deposited funds should not be available for use in this session
+        return success(f"deposited ${amount:.2f} to account {account_num}. funds will be available after logout", account=account)
+
+    def depositCommand(self):
+        rejected = self.checkLoggedIn()
+        if rejected:
+            return self.report(rejected)
+
+        # should ask for the account holder’s name (if logged in as admin)
+        account_name = self.readHolderName()
+
+        # should ask for the account number (as a text line)
+        account_num = self.readField("enter account number:").strip()
+        account, rejected = self.findHolderAccount(account_name, account_num, "error: Account {account_num} is disabled")
+        if rejected:
+            return self.report(rejected)
+
+        # then should ask for the amount to deposit
+        amount = self.readAmount("enter deposit amount:")
+        return self.report(self.deposit(account_name, account_num, amount))
+
 
     '''
     Processes a withdrawl transaction to remove funds from a bank account
 
-    If the user is an admin, it prompts for an account holder name
-    If the user is not an admin, it uses the current session account holder's name
+    In admin mode the withdrawal is made for the named account holder
+    In standard mode it uses the current session account holder's name
 
-    Constraints 
-        - Must be logged in 
+    Constraints
+        - Must be logged in
         - Account must be valid for the account  holder
         - Maximum withdraw in standard mode is $500.00
         - Account must remain more than $0.00 after withdrawl
 
     '''
-    def withdraw(self):
+    def withdraw(self, account_name, account_num, amount):
         # constraint: bank account must be a valid account for the account holder currently logged in.
-        if not self.session.loggedIn:
-            self.outputStream.write("not logged in. please login first")
-            return
-
-        # should ask for the account holder’s name (if logged in as admin)
-        if self.session.isAdmin:
-            self.outputStream.write("enter account holder name:")
-            account_name = self.inputStream.readNextLine().strip()
-        else:
-            account_name = self.session.accountHolderName
+        rejected = self.checkLoggedIn()
+        if rejected:
+            return rejected
+        account_name = self.holderName(account_name)
 
-        # should ask for the account number (as a text line)
-        self.outputStream.write("enter account number:")
-        account_num = self.inputStream.readNextLine().strip()
-
-
-        # find account
-        account = self.accounts.findAccountByNameAndNumber(account_name, account_num)
-        if not account:
-            self.outputStream.write(f"no account found for '{account_name}' with account number '{account_num}'")
-            return
-
-        # check if account disabled
-        if account.status == "D":
-            self.outputStream.write(f"error: Account {account_num} is disabled")
-            return
-        
-        # then should ask for the amount to withdraw
-        self.outputStream.write("enter withdraw amount:")
-
-        # ensure amount is a number not a letter
-
-        try:
-            amount = float(self.inputStream.readNextLine())
-        except ValueError:
-            self.outputStream.write("Withdraw amoutn must be a valid number")
-            return 
+        # find account, and check if it is disabled
+        account, rejected = self.findHolderAccount(account_name, account_num, "error: Account {account_num} is disabled")
+        if rejected:
+            return rejected
 
-
-        
         # check number is positive
         if amount <= 0:
-            self.outputStream.write("error: amount must be positive")
-            return
+            return failure("error: amount must be positive", account)
+        cents = toCents(amount)
 
         # consrtaint: Maximum amount that can be withdrawn in current session is $500.00 in standard mode
         if not self.session.isAdmin:
-            if self.session_withdrawals + amount > 500.00:
-                self.outputStream.write(f"withdrawal exceeds session limit. remaining: ${500.00 - self.session_withdrawals:.2f}")
-                return
-        
-        # constraint: Account balance must be at least $0.00 after withdrawal
-        if account.balance < amount:
-            self.outputStream.write("insufficient funds for withdrawal")
-            return
-        
-        # withdraw funds from account balance
-        account.balance -= amount
+            if self.session_withdrawals + cents > WITHDRAWAL_LIMIT:
+                return failure(f"withdrawal exceeds session limit. remaining: ${(WITHDRAWAL_LIMIT - self.session_withdrawals) / 100:.2f}", account)
+
+        # the balance is checked and changed under the account's lock,
+        # so sessions on other threads cannot spend the same funds
+        with self.accounts.locked(account):
+            # another session may have deleted or disabled the account since it was looked up
+            if account.status == TOMBSTONE:
+                return failure(f"no account found for '{account_name}' with account number '{account_num}'")
+            if account.status == "D":
+                return failure(f"error: Account {account_num} is disabled", account)
+
+            # constraint: Account balance must be at least $0.00 after withdrawal
+            if account.cents < cents:
+                return failure("insufficient funds for withdrawal", account)
+
+            # withdraw funds from account balance
+            account.cents -= cents
+            self.accounts.markDirty(account)
 
         # add to session withdrawls count
         if not self.session.isAdmin:
-            self.session_withdrawals += amount
+            self.session_withdrawals += cents
 
-        self.outputStream.write(f"withdrew ${amount:.2f} from account {account_num}. funds will be available after logout")
-        
         # should save this information for the bank account transaction file
         self.recordActions.record_transaction("01", account_name, account_num, amount, "")
 
+        return success(f"withdrew ${amount:.2f} from account {account_num}. funds will be available after logout", account=account)
+
+    def withdrawCommand(self):
+        rejected = self.checkLoggedIn()
+        if rejected:
+            return self.report(rejected)
+
+        # should ask for the account holder’s name (if logged in as admin)
+        account_name = self.readHolderName()
+
+        # should ask for the account number (as a text line)
+        account_num = self.readField("enter account number:").strip()
+        account, rejected = self.findHolderAccount(account_name, account_num, "error: Account {account_num} is disabled")
+        if rejected:
+            return self.report(rejected)
+
+        # then should ask for the amount to withdraw, ensuring it is a number not a letter
+        try:
+            amount = self.readAmount("enter withdraw amount:")
+        except InvalidNumber:
+            return self.report(failure("Withdraw amoutn must be a valid number", account))
+
+        return self.report(self.withdraw(account_name, account_num, amount))
+
     '''
-    Processes a transfer between two accounts 
+    Processes a transfer between two accounts
 
-    If the user is admin, it prompts for an account holder's name 
+    In admin mode the transfer is made for the named account holder
     Otherwise, uses the current sessions account holder name
     Validates amounts and balances before `transfer`
 
@@ -315,98 +569,106 @@ class ATM:
         - Transfer amount must be greater than $0.00
         - Maximum transfer in standard mode has to be less than $1000
         - Sender balance must remain greather than $0.00 after transfer
+        - Receiver balance must remain at most $99999.99 after transfer
     '''
-    def transfer(self):
+    def transfer(self, account_name, account_sender_num, account_reciever_num, transfer_amount):
         # constraint: bank account must be a valid account for the account holder currently logged in.
-        if not self.session.loggedIn:
-            self.outputStream.write("not logged in. please login first")
-            return
-
-        # should ask for the account holder’s name (if logged in as admin)
-        if self.session.isAdmin:
-            self.outputStream.write("enter account holder name:")
-            account_name = self.inputStream.readNextLine().strip()
-        else:
-            account_name = self.session.accountHolderName
-        
-        # get the account number of the money sender
-        self.outputStream.write("enter account number to transfer money from")
-        account_sender_num = self.inputStream.readNextLine().strip()
-
-        # get the account number of the money reciever
-        self.outputStream.write("enter account number to transfer money to")
-        account_reciever_num = self.inputStream.readNextLine().strip()
-
-        # get the amount that will be transferred 
-        self.outputStream.write("enter transfer amount:")
-        transfer_amount = float(self.inputStream.readNextLine())
+        rejected = self.checkLoggedIn()
+        if rejected:
+            return rejected
+        account_name = self.holderName(account_name)
 
         # constraint : can't transfer 0 or less dollars
         if transfer_amount <= 0:
-            self.outputStream.write("can't transfer 0 or less dollars")
-            return
+            return failure("can't transfer 0 or less dollars")
+        cents = toCents(transfer_amount)
 
         # constraint : standard accounts can't transfer more than 1000 dollars
         if not self.session.isAdmin:
-            if self.session_transfers + transfer_amount > 1000.00:
-                self.outputStream.write(f"transfer exceeds session limit. remaining: ${1000.00 - self.session_transfers:.2f}")
-                return
+            if self.session_transfers + cents > TRANSFER_LIMIT:
+                return failure(f"transfer exceeds session limit. remaining: ${(TRANSFER_LIMIT - self.session_transfers) / 100:.2f}")
 
         # find sender account
         accountSender = self.accounts.findAccountByNameAndNumber(account_name, account_sender_num)
         if not accountSender:
-            self.outputStream.write(f"sender account not found for '{account_name}' with account number '{account_sender_num}'")
-            return
-        
+            return failure(f"sender account not found for '{account_name}' with account number '{account_sender_num}'")
+
         # check if sender account is disabled
         if accountSender.status == 'D':
-            self.outputStream.write(f"Error: Sender account {account_sender_num} is disabled.")
-            return
-        
+            return failure(f"Error: Sender account {account_sender_num} is disabled.", accountSender)
+
         # find receiver account
         accountReceiver = self.accounts.findAccountByAccountNum(account_reciever_num)
         if not accountReceiver:
-            self.outputStream.write(f"receiver account {account_reciever_num} not found")
-            return
-        
+            return failure(f"receiver account {account_reciever_num} not found", accountSender)
+
         # check if receiver account is disabled
         if accountReceiver.status == 'D':
-            self.outputStream.write(f"Error: Receiver account {account_reciever_num} is disabled.")
-            return
-
-        # constraint: Sender balance must be at least $0.00 after withdrawal
-        if accountSender.balance < transfer_amount:
-            self.outputStream.write("Sender has insufficient funds for transfer")
-            return
-
-        # constraint: Reciever balance must be at least $0.00 after withdrawal
-        if accountReceiver.balance + transfer_amount < 0:
-            self.outputStream.write("Reciever has insufficient funds for transfer")
-            return
-
-        accountSender.balance = accountSender.balance - transfer_amount
-        accountReceiver.balance = accountReceiver.balance + transfer_amount
+            return failure(f"Error: Receiver account {account_reciever_num} is disabled.", accountSender)
+
+        # both accounts are locked (in account number order) while the balances are checked and moved
+        with self.accounts.locked(accountSender, accountReceiver):
+            # another session may have deleted or disabled either account since it was looked up
+            if accountSender.status == TOMBSTONE:
+                return failure(f"sender account not found for '{account_name}' with account number '{account_sender_num}'")
+            if accountSender.status == 'D':
+                return failure(f"Error: Sender account {account_sender_num} is disabled.", accountSender)
+            if accountReceiver.status == TOMBSTONE:
+                return failure(f"receiver account {account_reciever_num} not found", accountSender)
+            if accountReceiver.status == 'D':
+                return failure(f"Error: Receiver account {account_reciever_num} is disabled.", accountSender)
+
+            # constraint: Sender balance must be at least $0.00 after withdrawal
+            if accountSender.cents < cents:
+                return failure("Sender has insufficient funds for transfer", accountSender)
+
+            # constraint: Reciever balance must be at least $0.00 after withdrawal
+            if accountReceiver.cents + cents < 0:
+                return failure("Reciever has insufficient funds for transfer", accountSender)
+
+            # constraint: Reciever balance can be at most $99999.99, the most an account record holds
+            if accountReceiver.cents + cents > MAX_BALANCE_CENTS:
+                return failure(f"Error: Receiver account {account_reciever_num} balance would exceed ${MAX_BALANCE:.2f}", accountSender)
+
+            accountSender.cents -= cents
+            accountReceiver.cents += cents
+            self.accounts.markDirty(accountSender)
+            self.accounts.markDirty(accountReceiver)
 
         # add to session transfers count
         if not self.session.isAdmin:
-            self.session_transfers += transfer_amount
+            self.session_transfers += cents
 
         # Record Transfer
-        self.recordActions.record_transfer(code="02", account_num_sender=account_sender_num, 
+        self.recordActions.record_transfer(code="02", account_num_sender=account_sender_num,
                              account_num_reciever=account_reciever_num, amount=transfer_amount, misc="N/A", name=account_name)
 
-        self.outputStream.write("Transaction Completed")
-        return
+        return success("Transaction Completed", account=accountSender)
+
+    def transferCommand(self):
+        rejected = self.checkLoggedIn()
+        if rejected:
+            return self.report(rejected)
+
+        # should ask for the account holder’s name (if logged in as admin)
+        account_name = self.readHolderName()
+
+        # get the account numbers of the money sender and reciever, and the amount that will be transferred
+        account_sender_num = self.readField("enter account number to transfer money from").strip()
+        account_reciever_num = self.readField("enter account number to transfer money to").strip()
+        transfer_amount = self.readAmount("enter transfer amount:")
+
+        return self.report(self.transfer(account_name, account_sender_num, account_reciever_num, transfer_amount))
 
 
     '''
     Processes a bill payment transaction to an approved company
 
-    Makes sure the session is in a logged in state, otherwise return to menu
-    If the session is in admin mode, it prompts for the account holder name
-    Validates the company, amount limits, and account balance before processing the payment 
+    Makes sure the session is in a logged in state
+    In admin mode the bill is paid for the named account holder
+    Validates the company, amount limits, and account balance before processing the payment
 
-    Constraints: 
+    Constraints:
         - Must be logged in
         - Account must be valid for the account holder
         - Account must  not be disabled
@@ -416,308 +678,283 @@ class ATM:
         - Account balance must remain >= $0.00 after payment
 
     '''
-    def paybill(self):
+    def paybill(self, account_name, account_num, company_code, amount):
         # constraint: bank account must be a valid account for the account holder currently logged in.
-        if not self.session.loggedIn:
-            self.outputStream.write("not logged in. please login first")
-            return
+        rejected = self.checkLoggedIn()
+        if rejected:
+            return rejected
+        account_name = self.holderName(account_name)
 
-        # should ask for the account holder’s name (if logged in as admin)
-        if self.session.isAdmin:
-            self.outputStream.write("enter account holder name:")
-            account_name = self.inputStream.readNextLine().strip()
-        else:
-            account_name = self.session.accountHolderName
-
-        # should ask for the account number (as a text line)
-        self.outputStream.write("enter account number:")
-        account_num = self.inputStream.readNextLine().strip()
-
-        # find account
-        account = self.accounts.findAccountByNameAndNumber(account_name, account_num)
-        if not account:
-            self.outputStream.write(f"no account found for '{account_name}' with account number '{account_num}'")
-            return
-
-        # check if account disabled
-        if account.status == 'D':
-            self.outputStream.write(f"Error: Account {account_num} is disabled.")
-            return
-        
-        # should ask for the company to whom the bill is being paid
-        self.outputStream.write("Enter company (EC/CQ/FI):")
-        company_code = self.inputStream.readNextLine().strip().upper()
+        # find account, and check if it is disabled
+        account, rejected = self.findHolderAccount(account_name, account_num, "Error: Account {account_num} is disabled.")
+        if rejected:
+            return rejected
 
         # constraint: The company to whom the bill is being paid must be “The Bright Light Electric Company (EC)”, “Credit Card Company Q (CQ)” or “Fast Internet, Inc. (FI)”
-        valid_companies = {
-            "EC": "The Bright Light Electric Company",
-            "CQ": "Credit Card Company Q",
-            "FI": "Fast Internet, Inc."
-        }
-
-        if company_code not in valid_companies:
-            self.outputStream.write("error: Invalid company. must be EC, CQ, or FI")
-            return
-        
-        # should ask for the amount to pay
-        self.outputStream.write("enter bill amount:")
-
-        # ensure amount is numerical 
-        try:
-            amount = float(self.inputStream.readNextLine().strip())
-        except ValueError:
-            self.outputStream.write("Error: Invalid amount format.")
-            return
+        company_code = company_code.strip().upper()
+        if company_code not in VALID_COMPANIES:
+            return failure("error: Invalid company. must be EC, CQ, or FI", account)
 
         # check that number is positive
         if amount <= 0:
-            self.outputStream.write("Error: Amount must be positive.")
-            return
-        
+            return failure("Error: Amount must be positive.", account)
+        cents = toCents(amount)
+
         # constraint: maximum amount that can be paid to a bill holder in current session is $2000.00 in standard mode
         if not self.session.isAdmin:
-            if self.session_paybills + amount > 2000.00:
-                self.outputStream.write(f"bill payment exceeds session limit. remaining: ${2000.00 - self.session_paybills:.2f}")
-                return
-            
-        # constraint: account balance must be at least $0.00 after bill is paid
-        if account.balance < amount:
-            self.outputStream.write("error: Insufficient funds")
-            return
-        
-        # withdraw funds from account balance to pay bill
-        account.balance -= amount
+            if self.session_paybills + cents > PAYBILL_LIMIT:
+                return failure(f"bill payment exceeds session limit. remaining: ${(PAYBILL_LIMIT - self.session_paybills) / 100:.2f}", account)
+
+        with self.accounts.locked(account):
+            # another session may have deleted or disabled the account since it was looked up
+            if account.status == TOMBSTONE:
+                return failure(f"no account found for '{account_name}' with account number '{account_num}'")
+            if account.status == "D":
+                return failure(f"Error: Account {account_num} is disabled.", account)
+
+            # constraint: account balance must be at least $0.00 after bill is paid
+            if account.cents < cents:
+                return failure("error: Insufficient funds", account)
+
+            # withdraw funds from account balance to pay bill
+            account.cents -= cents
+            self.accounts.markDirty(account)
 
         # add to session bill payments count
         if not self.session.isAdmin:
-            self.session_paybills += amount
+            self.session_paybills += cents
 
-        self.outputStream.write(f"withdrew ${amount:.2f} from account {account_num} to pay bill")
-        
         # should save this information for the bank account transaction file
         self.recordActions.record_transaction("03", account_name, account_num, amount, company_code)
-    
+
+        return success(f"withdrew ${amount:.2f} from account {account_num} to pay bill", account=account)
+
+    def paybillCommand(self):
+        rejected = self.checkLoggedIn()
+        if rejected:
+            return self.report(rejected)
+
+        # should ask for the account holder’s name (if logged in as admin)
+        account_name = self.readHolderName()
+
+        # should ask for the account number (as a text line)
+        account_num = self.readField("enter account number:").strip()
+        account, rejected = self.findHolderAccount(account_name, account_num, "Error: Account {account_num} is disabled.")
+        if rejected:
+            return self.report(rejected)
+
+        # should ask for the company to whom the bill is being paid
+        company_code = self.readField("Enter company (EC/CQ/FI):").strip().upper()
+        if company_code not in VALID_COMPANIES:
+            return self.report(failure("error: Invalid company. must be EC, CQ, or FI", account))
+
+        # should ask for the amount to pay, ensuring it is numerical
+        try:
+            amount = self.readAmount("enter bill amount:")
+        except InvalidNumber:
+            return self.report(failure("Error: Invalid amount format.", account))
+
+        return self.report(self.paybill(account_name, account_num, company_code, amount))
+
     '''
     Creates a new bank account with a unique account number
     Admin command only
 
-    Generates an account number that is not in use (incremental). 
-    Prompts for account holder name and initial balance, then creates account with active initial status.
-    
-    Constraints: 
+    Generates an account number that is not in use (incremental) from the account store's allocator.
+    Takes the account holder name and initial balance, then creates account with active initial status.
+
+    Constraints:
         - Must be logged in
         - Must be in admin mode (privileged transaction)
-        - Account numbers must be unique 
+        - Account numbers must be unique
         - Account holder name limited to 20 characters maximum
         - Initial balance must be between $0.00 and $99999.99
         - New account not available for transactions until next session
 
-    
+
     '''
-    def create(self):
+    def create(self, acc_name, acc_balance):
         # constraint: privileged transaction - only accepted when logged in admin mode
-        if not self.session.loggedIn:
-            self.outputStream.write("not logged in. please login first")
-            return
-        
-        if not self.session.isAdmin:
-            self.outputStream.write("Error: Admin privileges required")
-            return 
-
-        # should read the last account number from the accounts file
-        with open(self.accounts_path, "r") as file:
-            lines = file.readlines()
-    
-        # constraint: bank account numbers must be unique in the Bank System
-        # derive the next account number from valid account records, ignoring EOF markers
-        max_account_num = 0
-        for line in lines:
-            if len(line) < 26:
-                continue
-
-            account_name = line[6:26].strip()
-            if account_name == "END_OF_FILE":
-                continue
+        rejected = self.checkAdmin("Error: Admin privileges required")
+        if rejected:
+            return rejected
 
-            account_num_raw = line[0:5].strip()
-            if account_num_raw.isdigit():
-                max_account_num = max(max_account_num, int(account_num_raw))
+        rejected = self.checkNewAccountName(acc_name)
+        if rejected:
+            return rejected
 
-        acc_num = f"{max_account_num + 1:05d}"
+        # constraint: account balance can be at most $99999.99
+        if acc_balance < 0 or acc_balance > 99999.99:
+            return failure("Error: Balance number out of range ($0 - $99999.99)")
 
         # should set the account status to active (A)
         acc_status = "A"
 
+        # constraint: bank account numbers must be unique in the Bank System
+        # the account store hands out numbers past the highest one ever used,
+        # and writes the new fixed-width record to the accounts file
+        account = self.accounts.createAccount(acc_name, acc_balance, acc_status)
+        if account is None:
+            return failure("Error: No account numbers available")
+        acc_num = account.accountNum
+        self.createdAccounts.append(acc_num)
+
+        # record create account to transaction file
+        self.recordActions.record_transaction("05", acc_name, acc_num, acc_balance, "")
+
+        return success(f"Account created: {acc_num} for {acc_name} with balance ${acc_balance:.2f}",
+                       "Note: This account will not be available for transactions until next session",
+                       account=account)
+
+    def createCommand(self):
+        rejected = self.checkAdmin("Error: Admin privileges required")
+        if rejected:
+            return self.report(rejected)
+
         # should ask for the name of the account holder (as a text line)
-        self.outputStream.write("Input New Account Name (max 20 characters):")
-        acc_name = self.inputStream.readNextLine().strip()
+        acc_name = self.readField("Input New Account Name (max 20 characters):").strip()
+        rejected = self.checkNewAccountName(acc_name)
+        if rejected:
+            return self.report(rejected)
+
+        # should ask for the initial balance of the account
+        acc_balance = self.readAmount("Initial Balance (max $99999.99):")
+        return self.report(self.create(acc_name, acc_balance))
 
+    '''
+    Checks the holder name of a new account.
+    '''
+    def checkNewAccountName(self, acc_name):
         # constraint: new account holder name is limited to at most 20 characters
         if len(acc_name) > 20:
-            self.outputStream.write("Error: Name larger than 20 characters")
-            return
-        
+            return failure("Error: Name larger than 20 characters")
+
         # 2/26 - ensure account name is more then length 0
         if len(acc_name) == 0:
-            self.outputStream.write("Error: Account name can't be empty")
-            return
-        
-        if acc_name.replace(" ", "").isalpha() == False:
-            self.outputStream.write("Error: Account name can only have letters")
-            return 
-
+            return failure("Error: Account name can't be empty")
 
-        # format the account holder name to fixed width
-        acc_name = f"{acc_name:<20}"[:19]
-
-        # should ask for the initial balance of the account
-        self.outputStream.write("Initial Balance (max $99999.99):")
-        acc_balance = float(self.inputStream.readNextLine())
-        
-        # constraint: account balance can be at most $99999.99
-        if acc_balance < 0 or acc_balance > 99999.99:
-            self.outputStream.write("Error: Balance number out of range ($0 - $99999.99)")
-            return
-        
-        # format the balance to fixed width currency field
-        acc_balance_str = f"{acc_balance:08.2f}"
-
-        # write the new account to the file
-        with open(self.accounts_path, "a") as file:
-            full_acc = f"{acc_num} {acc_name} {acc_status} {acc_balance_str}\n"
-            file.write(full_acc)
-       
-        # record create account to transaction file
-        self.recordActions.record_transaction("05", acc_name.strip(), acc_num, acc_balance, "")
+        if acc_name.replace(" ", "").isalpha() == False:
+            return failure("Error: Account name can only have letters")
+        return None
 
-        self.outputStream.write(f"Account created: {acc_num} for {acc_name.strip()} with balance ${acc_balance:.2f}")
-        self.outputStream.write("Note: This account will not be available for transactions until next session")
-    
     '''
     Deletes an exisiting bank account from the system
 
-    Prompts for account holder name, ensures the account exists and then removes it 
-    from the accounts file by rewriting the file without that account    
-    
-    Constraints : 
+    Takes the account holder name, ensures the account exists and then removes it
+    from the accounts file by writing a tombstone over its record
+
+    Constraints :
         - Must be logged in
         - Must be in admin mode
-        - Account musdt be valid (must exist)    
+        - Account musdt be valid (must exist)
     '''
-    def delete(self):
+    def delete(self, account_name, account_num):
         # constraint: privileged transaction - only accepted when logged in admin mode
-        if not self.session.loggedIn:
-            self.outputStream.write("not logged in. please login first")
-            return
-        
-        if not self.session.isAdmin:
-            self.outputStream.write("Error: Admin privileges required")
-            return
-        
-        # ask for the bank account holder's name (as a text line)
-        self.outputStream.write("Enter account holder name:")
-        account_name = self.inputStream.readNextLine().strip()
-        
+        rejected = self.checkAdmin("Error: Admin privileges required")
+        if rejected:
+            return rejected
+
         # constraint: name limited to 20 characters
-        if len(account_name) > 20:
-            self.outputStream.write("Error: Name too long (max 20 characters)")
-            return
-        
-        # format name to fixed width 20 characters for file comparison
-        account_name_formatted = f"{account_name:<20}"[:20]
+        rejected = self.checkDeleteName(account_name)
+        if rejected:
+            return rejected
 
-        # ask for the account number (as a text line)
-        self.outputStream.write("Enter account number:")
-        account_num = self.inputStream.readNextLine().strip()
-        
         # constraint: account number must be 5 digits
         if len(account_num) != 5 or not account_num.isdigit():
-            self.outputStream.write("Error: Invalid account number format (must be 5 digits)")
-            return
-        
-        # read all existing accounts from the file
-        with open(self.accounts_path, "r") as file:
-            lines = file.readlines()
-        
-        # filter the account to be deleted
-        found = False
-        new_lines = []
-        for line in lines:
-            # extract account number and account holder name from line
-            line_acc_num = line[0:5]
-            line_name = line[6:26]
-            # if line matches the account to delete, skip it
-            if line_acc_num == account_num and line_name.lower() == account_name_formatted.lower():
-                found = True
-                continue
-            # otherwise, keep the line
-            new_lines.append(line.rstrip("\n"))
+            return failure("Error: Invalid account number format (must be 5 digits)")
+
+        # look up the record, including accounts created earlier in this session
+        # the holder name is matched case-insensitively
+        account = self.accounts.findRecord(account_num)
 
         # if the account was not found, output error and return
-        if not found:
-            self.outputStream.write(f"No account found for {account_name} with account number {account_num}")
-            return 
+        if not account or account.name.lower() != account_name.lower():
+            return failure(f"No account found for {account_name} with account number {account_num}")
 
-        # write the remaining accounts back to the file, effectively deleting the chosen account
+        # tombstone the record in the accounts file, effectively deleting the chosen account
+        # (under its lock, so a change in progress on another thread finishes first)
         try:
-            with open(self.accounts_path, "w") as file:
-                for line in new_lines:
-                    file.write(line + "\n")
+            with self.accounts.locked(account):
+                self.accounts.deleteAccount(account)
         except Exception as e:
-            self.outputStream.write(f"Error writing accounts file: {e}")
-            return
+            return failure(f"Error writing accounts file: {e}", account)
 
         # record transaction for account deletion
         self.recordActions.record_transaction("06", account_name, account_num, 0.0, "")
 
-        self.outputStream.write(f"Account {account_num} for {account_name} has been deleted.")
+        return success(f"Account {account_num} for {account_name} has been deleted.", account=account)
+
+    def deleteCommand(self):
+        rejected = self.checkAdmin("Error: Admin privileges required")
+        if rejected:
+            return self.report(rejected)
+
+        # ask for the bank account holder's name (as a text line)
+        account_name = self.readField("Enter account holder name:").strip()
+        rejected = self.checkDeleteName(account_name)
+        if rejected:
+            return self.report(rejected)
+
+        # ask for the account number (as a text line)
+        account_num = self.readField("Enter account number:").strip()
+        return self.report(self.delete(account_name, account_num))
+
+    '''
+    Checks the holder name given for a delete.
+    '''
+    def checkDeleteName(self, account_name):
+        if len(account_name) > 20:
+            return failure("Error: Name too long (max 20 characters)")
+        return None
 
     '''
     Disables an existing account, (changes status from active to disabled)
 
-    Prompts for an account holder name and account number, validates that the acount exists, then changes
+    Takes an account holder name and account number, validates that the acount exists, then changes
     status to "D" (disabled).
     Disabled accounts can not be used for transactions until re-enabled
-    
+
     Constraints
         - Must be logged in
         - Must be in admin mode
         - Account nuumber must exist and match specified account holder
 
     '''
-    def disable(self):
+    def disable(self, account_name, account_num):
         # constraint: privileged transaction - only accepted when logged in admin mode
-        if not self.session.loggedIn:
-            self.outputStream.write("not logged in. please login first")
-            return
-        
-        if not self.session.isAdmin:
-            self.outputStream.write("not an admin. access denied")
-            return
-        
-        # should ask for the bank account holder’s name (as a text line)
-        self.outputStream.write("enter account holder name:")
-        account_name = self.inputStream.readNextLine().strip()
-        
-        # should ask for the account number (as a text line)
-        # constraint: account number must be the number of the account holder specified
-        self.outputStream.write("enter account number:")
-        account_num = self.inputStream.readNextLine().strip()
+        rejected = self.checkAdmin("not an admin. access denied")
+        if rejected:
+            return rejected
 
         # constraint: account holder’s name must be the name of an existing account holder
-        account = self.accounts.findAccountByNameAndNumber(account_name, account_num)
-        if not account:
-            self.outputStream.write(f"no account found for '{account_name}' with account number '{account_num}'")
-            return
+        # constraint: account number must be the number of the account holder specified
+        account, rejected = self.findHolderAccount(account_name, account_num)
+        if rejected:
+            return rejected
 
         # should change the bank account from active (A) to disabled (D)
-        account.status = "D"
+        with self.accounts.locked(account):
+            # a record deleted since it was looked up must keep its tombstone
+            if account.status == TOMBSTONE:
+                return failure(f"no account found for '{account_name}' with account number '{account_num}'")
+            account.status = "D"
+            self.accounts.markDirty(account)
 
         # should save this information for the bank account transaction file
         self.recordActions.record_transaction("07", account_name, account_num, 0.0, "")
-    
-        self.outputStream.write(f"account {account_num} for {account_name} has been disabled") 
-    
+
+        return success(f"account {account_num} for {account_name} has been disabled", account=account)
+
+    def disableCommand(self):
+        rejected = self.checkAdmin("not an admin. access denied")
+        if rejected:
+            return self.report(rejected)
+
+        # should ask for the bank account holder’s name and the account number (as text lines)
+        account_name = self.readField("enter account holder name:").strip()
+        account_num = self.readField("enter account number:").strip()
+        return self.report(self.disable(account_name, account_num))
+
     '''
     Changes account payment plan between Student to Non-Student
     If an account is student, it changes payment plan to non-student and vice versa
@@ -726,47 +963,288 @@ class ATM:
     Contraints
         - Must be logged in
         - Must be in admin mode
-        - Account holder name must exist 
+        - Account holder name must exist
         - Account number must match the specified name
         - Account plan must either be "SP" (student plan) or "NP" (non-student plan)
-    
+
     '''
-    def changeplan(self):
-        if not self.session.loggedIn:
-            self.outputStream.write("not logged in. please login first")
-            return
-        
+    def changeplan(self, account_name, account_num):
         # constraint: privileged transaction - only accepted when logged in admin mode
-        if not self.session.isAdmin:
-            self.outputStream.write("Error: This is a privileged transaction. Admin access required.")
-            return
-        
-        # should ask for the bank account holder’s name (as a text line)
-        self.outputStream.write("enter account holder name:")
-        account_name = self.inputStream.readNextLine().strip()
-        
-        # should ask for the account number (as a text line)
-        # constraint: account number must be the number of the account holder specified
-        self.outputStream.write("enter account number:")
-        account_num = self.inputStream.readNextLine().strip()
+        rejected = self.checkAdmin("Error: This is a privileged transaction. Admin access required.")
+        if rejected:
+            return rejected
 
         # constraint: account holder’s name must be the name of an existing account holder
-        account = self.accounts.findAccountByNameAndNumber(account_name, account_num)
-        if not account:
-            self.outputStream.write(f"no account found for '{account_name}' with account number '{account_num}'")
-            return
-        
+        # constraint: account number must be the number of the account holder specified
+        account, rejected = self.findHolderAccount(account_name, account_num)
+        if rejected:
+            return rejected
+
         # should set the bank account payment plan from student (SP) to non-student (NP)
-        if account.plan == "SP":
-            account.plan = "NP"
-            self.outputStream.write(f"account plan changed from Student to Non-Student for account {account_num}")
-        elif account.plan == "NP":
-            account.plan = "SP"
-            self.outputStream.write(f"account plan changed from Non-Student to Student for account {account_num}")
-        else:
-            self.outputStream.write(f"account {account_num} has an invalid plan")
-            return
+        with self.accounts.locked(account):
+            if account.status == TOMBSTONE:
+                return failure(f"no account found for '{account_name}' with account number '{account_num}'")
+            if account.plan == "SP":
+                account.plan = "NP"
+                message = f"account plan changed from Student to Non-Student for account {account_num}"
+            elif account.plan == "NP":
+                account.plan = "SP"
+                message = f"account plan changed from Non-Student to Student for account {account_num}"
+            else:
+                return failure(f"account {account_num} has an invalid plan", account)
+            self.accounts.markDirty(account)
 
         # should save this information for the bank account transaction file
+        self.recordActions.record_transaction("08", account_name, account_num, 0.0, "")
+
+        return success(message, account=account)
 
-        self.recordActions.record_transaction("08", account_name, account_num, 0.0, "")
\ No newline at end of file
+    def changeplanCommand(self):
+        rejected = self.checkAdmin("Error: This is a privileged transaction. Admin access required.")
+        if rejected:
+            return self.report(rejected)
+
+        # should ask for the bank account holder’s name and the account number (as text lines)
+        account_name = self.readField("enter account holder name:").strip()
+        account_num = self.readField("enter account number:").strip()
+        return self.report(self.changeplan(account_name, account_num))
+
+    '''
+    Searches for accounts by holder name, so admins can look a holder up by part of their name
+
+    Lists the accounts whose holder name starts with the given text, regardless
+    of case (or only those matching it exactly, see prefix and ignoreCase),
+    ordered by name. At most FIND_LIMIT accounts are listed. The command is
+    left out of the menu, which only shows the transactions.
+
+    Constraints
+        - Must be logged in
+        - Must be in admin mode
+        - The search text can't be empty
+    '''
+    def find(self, account_name, prefix=True, ignoreCase=True):
+        # constraint: privileged transaction - only accepted when logged in admin mode
+        rejected = self.checkAdmin("Error: Admin privileges required")
+        if rejected:
+            return rejected
+
+        if len(account_name) == 0:
+            return failure("Error: Search name can't be empty")
+
+        # one more than is listed, to tell whether any were left out
+        accounts = self.accounts.findAccountsByName(account_name, prefix=prefix, ignoreCase=ignoreCase,
+                                                    limit=FIND_LIMIT + 1)
+        if not accounts:
+            return failure(f"no accounts found matching '{account_name}'")
+
+        messages = [f"{account.accountNum} {account.name} ({account.status}) balance ${account.balance:.2f}"
+                    for account in accounts[:FIND_LIMIT]]
+        if len(accounts) > FIND_LIMIT:
+            messages.append(f"more than {FIND_LIMIT} accounts match '{account_name}', showing the first {FIND_LIMIT}")
+        return success(*messages, accounts=accounts[:FIND_LIMIT])
+
+    def findCommand(self):
+        rejected = self.checkAdmin("Error: Admin privileges required")
+        if rejected:
+            return self.report(rejected)
+
+        # should ask for the holder name, or the start of it (as a text line)
+        account_name = self.readField("enter account holder name (or the start of it):").strip()
+        return self.report(self.find(account_name))
+
+    '''
+    Applies a batch file of admin operations in one go, for admins opening or closing many accounts at once
+
+    Each line of the file is one operation with its fields, written as on the
+    command line (see splitCommand); blank lines and lines starting with # are skipped
+        create <name> <initial balance>
+        delete <name> <account number>
+        disable <name> <account number>
+        changeplan <name> <account number>
+
+    Every operation is checked first, against the store's indexes and the
+    operations before it in the file, with the constraints of its own command.
+    If any operation is rejected the whole batch is refused and every rejected
+    line is reported by its number; the contents of the file are never shown,
+    nor whether a file that cannot be read exists. Otherwise the changes are
+    applied together with a single
+    pass over the accounts file (see applyBatch), and one transaction is
+    recorded per operation, in file order. The command is left out of the menu.
+
+    Constraints
+        - Must be logged in
+        - Must be in admin mode
+        - Bulk must be allowed, and the file in the batch directory if there is one
+        - Every operation must pass the checks of its own command
+        - New accounts not available for transactions until next session
+    '''
+    def bulk(self, batch_path):
+        # constraint: privileged transaction - only accepted when logged in admin mode
+        rejected = self.checkAdmin("Error: Admin privileges required")
+        if rejected:
+            return rejected
+
+        if not self.bulkAllowed:
+            return failure("Error: bulk is not available in this session")
+        if self.batchDir is not None:
+            batch_dir = os.path.realpath(self.batchDir)
+            batch_path = os.path.realpath(os.path.join(batch_dir, batch_path))
+            if os.path.commonpath([batch_dir, batch_path]) != batch_dir:
+                return failure("Error: batch file must be in the batch directory")
+
+        try:
+            with open(batch_path, 'r') as file:
+                lines = file.read().splitlines()
+        except (OSError, UnicodeDecodeError):
+            return failure("Error: batch file could not be read")
+
+        operations = []
+        errors = []
+        # accounts deleted by earlier lines, and the plan each changed account ends up with
+        deleted = set()
+        plans = {}
+        for line_num, line in enumerate(lines, 1):
+            if not line.strip() or line.lstrip().startswith("#"):
+                continue
+            operation, rejected = self.checkBatchOperation(line, deleted, plans)
+            if rejected:
+                errors.append(f"line {line_num} rejected")
+            else:
+                operations.append(operation)
+
+        if errors:
+            return Result(False, [f"batch refused: {len(errors)} operation(s) rejected, nothing was applied", *errors])
+        if not operations:
+            return failure("Error: batch file holds no operations")
+
+        creates = []
+        deletes = []
+        updates = {}
+        for op, name, value, account in operations:
+            if op == "create":
+                creates.append((name, value, "A"))
+            elif op == "delete":
+                deletes.append(account)
+            else:
+                updates[id(account)] = account
+        accounts = deletes + list(updates.values())
+
+        # the accounts are locked while they change, as for the single commands,
+        # and restored if the batch cannot be applied
+        with self.accounts.locked(*accounts):
+            # another session may have deleted an account since the batch was checked
+            gone = [account.accountNum for account in accounts if account.status == TOMBSTONE]
+            if gone:
+                return Result(False, ["batch refused: nothing was applied",
+                                      *(f"account {num} was deleted by another session" for num in gone)])
+
+            saved = [(account, account.status, account.plan) for account in updates.values()]
+            for op, name, value, account in operations:
+                if op == "disable":
+                    account.status = "D"
+                elif op == "changeplan":
+                    account.plan = value
+            try:
+                created = self.accounts.applyBatch(creates, deletes, list(updates.values()))
+            except Exception as e:
+                created = None
+                rejected = failure(f"Error writing accounts file: {e}")
+            else:
+                rejected = failure("Error: No account numbers available") if created is None else None
+                if created is not None:
+                    self.createdAccounts += [account.accountNum for account in created]
+            if rejected:
+                for account, status, plan in saved:
+                    account.status = status
+                    account.plan = plan
+                return rejected
+
+        # record every operation for the transaction file, in batch file order
+        messages = []
+        created = iter(created)
+        for op, name, value, account in operations:
+            if op == "create":
+                account = next(created)
+                self.recordActions.record_transaction("05", name, account.accountNum, value, "")
+                messages.append(f"Account created: {account.accountNum} for {name} with balance ${value:.2f}")
+            elif op == "delete":
+                self.recordActions.record_transaction("06", name, account.accountNum, 0.0, "")
+                messages.append(f"Account {account.accountNum} for {name} has been deleted.")
+            elif op == "disable":
+                self.recordActions.record_transaction("07", name, account.accountNum, 0.0, "")
+                messages.append(f"account {account.accountNum} for {name} has been disabled")
+            else:
+                self.recordActions.record_transaction("08", name, account.accountNum, 0.0, "")
+                plan = "Student" if value == "SP" else "Non-Student"
+                messages.append(f"account plan changed to {plan} for account {account.accountNum}")
+
+        messages.append(f"batch applied: {len(operations)} operation(s)")
+        if creates:
+            messages.append("Note: new accounts will not be available for transactions until next session")
+        return success(*messages)
+
+    '''
+    Checks one line of a batch file, as its own command would check it.
+
+    deleted and plans carry the effect of the lines before it. Returns a tuple
+    of the operation (name, holder name, balance or new plan, account) and a
+    failed Result (or None).
+    '''
+    def checkBatchOperation(self, line, deleted, plans):
+        op, fields = splitCommand(line)
+        if op not in BATCH_OPERATIONS:
+            return None, failure("Error: unknown batch operation")
+        if len(fields) != 2:
+            return None, failure(f"Error: {op} takes 2 fields")
+        name = fields[0].strip()
+
+        if op == "create":
+            rejected = self.checkNewAccountName(name)
+            if rejected:
+                return None, rejected
+            try:
+                balance = float(fields[1])
+            except ValueError:
+                return None, failure("Error: Invalid balance format")
+            # constraint: account balance can be at most $99999.99
+            if balance < 0 or balance > 99999.99:
+                return None, failure("Error: Balance number out of range ($0 - $99999.99)")
+            return (op, name, balance, None), None
+
+        account_num = fields[1].strip()
+        if op == "delete":
+            rejected = self.checkDeleteName(name)
+            if rejected:
+                return None, rejected
+            if len(account_num) != 5 or not account_num.isdigit():
+                return None, failure("Error: Invalid account number format (must be 5 digits)")
+            # the holder name is matched case-insensitively, as for delete
+            account = self.accounts.findRecord(account_num)
+            if not account or account.name.lower() != name.lower() or account_num in deleted:
+                return None, failure(f"No account found for {name} with account number {account_num}")
+            deleted.add(account_num)
+            return (op, name, None, account), None
+
+        account, rejected = self.findHolderAccount(name, account_num)
+        if not rejected and account_num in deleted:
+            rejected = failure(f"no account found for '{name}' with account number '{account_num}'")
+        if rejected:
+            return None, rejected
+        if op == "disable":
+            return (op, name, None, account), None
+
+        # the plan toggles on every changeplan of the account
+        plan = plans.get(account_num, account.plan)
+        if plan not in ("SP", "NP"):
+            return None, failure(f"account {account_num} has an invalid plan")
+        plans[account_num] = "NP" if plan == "SP" else "SP"
+        return (op, name, plans[account_num], account), None
+
+    def bulkCommand(self):
+        rejected = self.checkAdmin("Error: Admin privileges required")
+        if rejected:
+            return self.report(rejected)
+
+        # should ask for the path of the batch file (as a text line)
+        batch_path = self.readField("enter batch file path:").strip()
+        return self.report(self.bulk(batch_path))
@@ -0,0 +1,504 @@
+import io
+import sys
+from array import array
+from itertools import repeat
+
+from atm.account import Account, toCents, MAX_BALANCE, MAX_BALANCE_CENTS
+from atm.account_store import TOMBSTONE, formatRecord
+from atm.bulk_reader import NUMPY_AVAILABLE, readAccountColumns, readTransactionChunks, centsColumn
+
+'''
+The BackEnd class is the overnight batch processor of the Banking system.
+
+It reads the master bank accounts file, applies the day's transaction
+files produced by the ATM front end, and writes a new master accounts file,
+a new current accounts file for the next day's front end sessions, and a
+log of every transaction it had to reject.
+
+Transaction files are streamed one line at a time and applied as they are
+read, so memory depends only on the number of accounts and never on the
+number of transactions processed. With NumPy installed, the accounts file
+is read in bulk and transaction files in chunks of whole lines, converting
+each column in one vectorized step (see bulk_reader).
+
+Balances are kept in one balance column of whole cents (see Account), and
+every check and change is integer arithmetic on cents, so a day of
+transactions cannot leave a balance a fraction of a cent off.
+
+Master accounts file format (45 characters per line):
+    NNNNN_AAAAAAAAAAAAAAAAAAAA_S_PPPPPPPP_TTTT_PP
+    - the current accounts record (number, name, status, balance),
+      followed by the number of transactions applied to the account
+      and its plan (SP student / NP non-student)
+A plain current accounts file is also accepted as input; its accounts
+start with no transactions on the non-student plan.
+'''
+
+# transaction codes, see formatTransaction in output_stream
+WITHDRAWAL = "01"
+TRANSFER = "02"
+PAYBILL = "03"
+DEPOSIT = "04"
+CREATE = "05"
+DELETE = "06"
+DISABLE = "07"
+CHANGEPLAN = "08"
+END_OF_SESSION = "00"
+
+# constraint: transaction counts must fit the 4 character count field
+MAX_TRANSACTIONS = 9999
+
+
+'''
+Parses one transaction file line into the same fields RecordActions records.
+
+    CC_AAAAAAAAAAAAAAAAAAAA_NNNNN_PPPPPPPP_MM
+
+Returns None if the line is too short to hold a transaction code.
+'''
+
+def parseTransaction(line):
+    line = line.rstrip('\n')
+    if len(line) < 2:
+        return None
+
+    return {
+        'code': line[0:2],
+        'name': line[3:23].strip(),
+        'account_num': line[24:29].strip(),
+        'amount': float(line[30:38].strip() or 0),
+        'misc': line[39:41].strip()
+    }
+
+
+'''
+Yields the transactions held by TransactionColumns, as parseTransaction returns them.
+'''
+
+def transactionsFrom(columns):
+    for code, name, num, amount, misc in zip(columns.code.tolist(), columns.name.tolist(), columns.num.tolist(),
+                                             columns.amount.tolist(), columns.misc.tolist()):
+        yield {'code': code, 'name': name, 'account_num': num, 'amount': amount, 'misc': misc}
+
+
+'''
+Parses one master accounts file line.
+
+Returns a tuple of the Account and its transaction count, or None for the
+END_OF_FILE record.
+'''
+
+def parseMasterRecord(line):
+    line = line.rstrip('\n')
+    name = line[6:26].strip()
+    if name == "END_OF_FILE":
+        return None
+
+    account = Account(sys.intern(name), sys.intern(line[0:5].strip()), float(line[29:37]), line[27], "NP")
+    count = 0
+    if len(line) >= 45:
+        count = int(line[38:42])
+        account.plan = line[43:45]
+    return account, count
+
+
+'''
+Formats an account and its transaction count as a master accounts file line (without the newline).
+'''
+
+def formatMasterRecord(account, count):
+    return f"{formatRecord(account)} {count:04d} {account.plan}"
+
+
+class BackEnd:
+    def __init__(self):
+        # accounts by number, with the number of transactions applied to each
+        self.accounts = {}
+        self.counts = {}
+
+        # balance of every account, in cents (see Account), and the slots
+        # left free by deleted accounts, reused by the next accounts created
+        self.balances = array('q')
+        self.freeSlots = []
+
+        # error log that rejected transactions are written to as they happen;
+        # without one they are collected in errors instead
+        self.errorLog = None
+        self.errors = []
+        self.errorCount = 0
+
+        # first half of a transfer, waiting for the line with the receiving account
+        self.pendingTransfer = None
+
+    '''
+    Loads the master accounts file (or a current accounts file) into memory.
+
+    Stops at the END_OF_FILE record and skips deleted (tombstoned) records.
+    '''
+
+    def loadMaster(self, path):
+        columns = readAccountColumns(path)
+        if columns is not None:
+            self.loadColumns(columns)
+            return
+
+        with open(path, 'r') as file:
+            for line in file:
+                parsed = parseMasterRecord(line)
+                if parsed is None:
+                    break
+
+                account, count = parsed
+                if account.status == TOMBSTONE:
+                    continue
+                self.adoptBalance(account)
+                self.accounts[account.accountNum] = account
+                self.counts[account.accountNum] = count
+
+    '''
+    Loads the accounts of a master (or current) accounts file read in bulk.
+    '''
+
+    def loadColumns(self, columns):
+        # the balances become the balance column as they are; the slots of
+        # deleted records are free for the accounts created later
+        self.balances = centsColumn(columns.balance)
+        self.freeSlots = []
+        counts = repeat(0) if columns.count is None else columns.count.tolist()
+        plans = repeat("NP") if columns.plan is None else columns.plan.tolist()
+        for slot, (num, name, status, count, plan) in enumerate(zip(columns.num.tolist(), columns.name.tolist(),
+                                                                   columns.status.tolist(), counts, plans)):
+            if status == TOMBSTONE:
+                self.balances[slot] = 0
+                self.freeSlots.append(slot)
+                continue
+            self.accounts[num] = Account(sys.intern(name), sys.intern(num), None, status, plan,
+                                         column=self.balances, slot=slot)
+            self.counts[num] = count
+
+    '''
+    Streams a transaction file and applies every transaction in it, in order.
+    '''
+
+    def applyFile(self, path):
+        if NUMPY_AVAILABLE:
+            line_num = 0
+            for chunk, columns in readTransactionChunks(path):
+                if columns is None:
+                    line_num = self.applyLines(path, io.StringIO(chunk.decode(), newline=None), line_num)
+                    continue
+                for trans in transactionsFrom(columns):
+                    line_num += 1
+                    self.applyTransaction(trans, (path, line_num))
+        else:
+            with open(path, 'r') as file:
+                self.applyLines(path, file, 0)
+
+        # a transfer cannot be completed by the next file
+        if self.pendingTransfer is not None:
+            self.error(self.pendingTransfer[1], "transfer is missing the receiving account")
+            self.pendingTransfer = None
+
+    '''
+    Parses and applies transaction lines, numbering them on from the given line.
+
+    Returns the number of the last line applied.
+    '''
+
+    def applyLines(self, path, lines, line_num):
+        for line_num, line in enumerate(lines, line_num + 1):
+            where = (path, line_num)
+            try:
+                trans = parseTransaction(line)
+            except ValueError:
+                self.error(where, f"malformed transaction '{line.rstrip()}'")
+                continue
+
+            if trans is not None:
+                self.applyTransaction(trans, where)
+        return line_num
+
+    '''
+    Applies a single transaction to the accounts.
+
+    Every transaction is checked against the back end constraints first; a
+    transaction that breaks one is logged and leaves the accounts unchanged.
+    Transfers arrive as two consecutive lines and are applied once both
+    halves have been read.
+    '''
+
+    def applyTransaction(self, trans, where):
+        code = trans['code']
+
+        if self.pendingTransfer is not None:
+            sender, sender_where = self.pendingTransfer
+            self.pendingTransfer = None
+            if code == TRANSFER:
+                self.transfer(sender, trans, sender_where)
+                return
+            self.error(sender_where, "transfer is missing the receiving account")
+
+        if code == END_OF_SESSION:
+            return
+        if code == TRANSFER:
+            self.pendingTransfer = (trans, where)
+            return
+        if code == CREATE:
+            self.create(trans, where)
+            return
+
+        account = self.accounts.get(trans['account_num'])
+        if account is None:
+            self.error(where, f"account {trans['account_num']} does not exist")
+            return
+
+        # constraint: the holder named in the transaction must own the account
+        # (deletes match the name regardless of case, like the front end)
+        if code == DELETE:
+            name_matches = account.name.lower() == trans['name'].lower()
+        else:
+            name_matches = account.name == trans['name']
+        if not name_matches:
+            self.error(where, f"account {account.accountNum} does not belong to '{trans['name']}'")
+            return
+
+        cents = toCents(trans['amount'])
+        if code == WITHDRAWAL or code == PAYBILL:
+            if not self.checkActive(account, where):
+                return
+            if account.cents - cents < 0:
+                self.error(where, f"account {account.accountNum} balance would fall below $0.00")
+                return
+            account.cents -= cents
+        elif code == DEPOSIT:
+            if not self.checkActive(account, where):
+                return
+            if account.cents + cents > MAX_BALANCE_CENTS:
+                self.error(where, f"account {account.accountNum} balance would exceed ${MAX_BALANCE:.2f}")
+                return
+            account.cents += cents
+        elif code == DELETE:
+            del self.accounts[account.accountNum]
+            del self.counts[account.accountNum]
+            self.releaseBalance(account)
+            return
+        elif code == DISABLE:
+            account.status = "D"
+        elif code == CHANGEPLAN:
+            account.plan = "NP" if account.plan == "SP" else "SP"
+        else:
+            self.error(where, f"unknown transaction code '{code}'")
+            return
+
+        self.countTransaction(account)
+
+    '''
+    Applies a transfer once both of its lines have been read.
+    '''
+
+    def transfer(self, sender_trans, receiver_trans, where):
+        cents = toCents(sender_trans['amount'])
+        sender = self.accounts.get(sender_trans['account_num'])
+        receiver = self.accounts.get(receiver_trans['account_num'])
+
+        if sender is None:
+            self.error(where, f"account {sender_trans['account_num']} does not exist")
+            return
+        if receiver is None:
+            self.error(where, f"account {receiver_trans['account_num']} does not exist")
+            return
+        if not self.checkSender(sender, sender_trans, where) or not self.checkReceiver(receiver, cents, where):
+            return
+
+        sender.cents -= cents
+        receiver.cents += cents
+        self.countTransaction(sender)
+        if receiver is not sender:
+            self.countTransaction(receiver)
+
+    '''
+    Applies the sending half of a transfer whose receiving account is handled
+    elsewhere (see ParallelBackEnd).
+
+    Returns True if the sender was debited, False if the transfer was rejected.
+    '''
+
+    def transferOut(self, sender_trans, where):
+        sender = self.accounts.get(sender_trans['account_num'])
+        if sender is None:
+            self.error(where, f"account {sender_trans['account_num']} does not exist")
+            return False
+        if not self.checkSender(sender, sender_trans, where):
+            return False
+
+        sender.cents -= toCents(sender_trans['amount'])
+        self.countTransaction(sender)
+        return True
+
+    '''
+    Applies the receiving half of a transfer whose sender was already debited.
+
+    If the receiving account cannot take the money, the sender is refunded
+    and the transfer is logged as rejected. A refund to a sender deleted in
+    the meantime cannot be made, and is logged as lost.
+    '''
+
+    def transferIn(self, sender_num, receiver_num, amount, where):
+        cents = toCents(amount)
+        receiver = self.accounts.get(receiver_num)
+
+        if receiver is None:
+            self.error(where, f"account {receiver_num} does not exist")
+        elif self.checkReceiver(receiver, cents, where):
+            receiver.cents += cents
+            self.countTransaction(receiver)
+            return
+
+        # the sender may have been deleted later in the day, leaving nobody to refund
+        sender = self.accounts.get(sender_num)
+        if sender is None:
+            self.error(where, f"refund of ${amount:.2f} to account {sender_num} lost: the account no longer exists")
+            return
+        sender.cents += cents
+
+    '''
+    Checks that the sending account of a transfer belongs to the holder,
+    is active and can cover the amount.
+    '''
+
+    def checkSender(self, sender, sender_trans, where):
+        if sender.name != sender_trans['name']:
+            self.error(where, f"account {sender.accountNum} does not belong to '{sender_trans['name']}'")
+            return False
+        if not self.checkActive(sender, where):
+            return False
+        if sender.cents - toCents(sender_trans['amount']) < 0:
+            self.error(where, f"account {sender.accountNum} balance would fall below $0.00")
+            return False
+        return True
+
+    '''
+    Checks that the receiving account of a transfer is active and can take the amount, in cents.
+    '''
+
+    def checkReceiver(self, receiver, cents, where):
+        if not self.checkActive(receiver, where):
+            return False
+        if receiver.cents + cents > MAX_BALANCE_CENTS:
+            self.error(where, f"account {receiver.accountNum} balance would exceed ${MAX_BALANCE:.2f}")
+            return False
+        return True
+
+    '''
+    Creates the account described by a create (05) transaction.
+    '''
+
+    def create(self, trans, where):
+        account_num = trans['account_num']
+
+        # constraint: account numbers must be unique
+        if account_num in self.accounts:
+            self.error(where, f"account {account_num} already exists")
+            return
+        account = Account(sys.intern(trans['name']), sys.intern(account_num), trans['amount'], "A", "NP")
+        if account.cents > MAX_BALANCE_CENTS:
+            self.error(where, f"account {account_num} balance would exceed ${MAX_BALANCE:.2f}")
+            return
+
+        self.adoptBalance(account)
+        self.accounts[account_num] = account
+        self.counts[account_num] = 0
+
+    '''
+    Moves the balance of a deleted account into a column of its own, so it
+    stays readable, and frees its slot in the balance column, as
+    AccountStore.releaseBalance does.
+    '''
+
+    def releaseBalance(self, account):
+        if account.column is self.balances:
+            slot = account.slot
+            account.moveTo(array('q'))
+            self.balances[slot] = 0
+            self.freeSlots.append(slot)
+
+    '''
+    Moves the balance of a new account into the balance column, reusing a
+    slot left free by a deleted account if there is one.
+    '''
+
+    def adoptBalance(self, account):
+        account.moveTo(self.balances, self.freeSlots.pop() if self.freeSlots else None)
+
+    '''
+    Checks that an account is not disabled, logging an error if it is.
+    '''
+
+    def checkActive(self, account, where):
+        if account.status == "D":
+            self.error(where, f"account {account.accountNum} is disabled")
+            return False
+        return True
+
+    '''
+    Counts a transaction applied to an account, saturating at the field width.
+    '''
+
+    def countTransaction(self, account):
+        count = self.counts[account.accountNum]
+        if count < MAX_TRANSACTIONS:
+            self.counts[account.accountNum] = count + 1
+
+    '''
+    Logs a rejected transaction.
+    '''
+
+    def error(self, where, message):
+        path, line_num = where
+        line = f"ERROR: {path}:{line_num}: {message}"
+        self.errorCount += 1
+        if self.errorLog is not None:
+            self.errorLog.write(line + "\n")
+        else:
+            self.errors.append(line)
+
+    '''
+    Writes the new master accounts file, ordered by account number.
+    '''
+
+    def writeMaster(self, path):
+        with open(path, 'w') as file:
+            for account_num in sorted(self.accounts):
+                account = self.accounts[account_num]
+                file.write(formatMasterRecord(account, self.counts[account_num]) + "\n")
+
+    '''
+    Writes the new current accounts file for the front end, ordered by
+    account number and terminated by the END_OF_FILE record.
+    '''
+
+    def writeCurrent(self, path):
+        with open(path, 'w') as file:
+            for account_num in sorted(self.accounts):
+                file.write(formatRecord(self.accounts[account_num]) + "\n")
+            file.write(formatRecord(Account("END_OF_FILE", "00000", 0.0, "D", None)) + "\n")
+
+    '''
+    Runs a full overnight pass: load the master file, apply every transaction
+    file in order while logging rejected transactions, then write the new
+    master and current accounts files.
+    '''
+
+    def run(self, masterPath, transactionPaths, newMasterPath, currentPath, errorPath):
+        self.loadMaster(masterPath)
+
+        with open(errorPath, 'w') as errorLog:
+            self.errorLog = errorLog
+            try:
+                for path in transactionPaths:
+                    self.applyFile(path)
+            finally:
+                self.errorLog = None
+
+        self.writeMaster(newMasterPath)
+        self.writeCurrent(currentPath)
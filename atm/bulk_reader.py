@@ -0,0 +1,308 @@
+from array import array
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# whether the bulk readers can be used at all
+NUMPY_AVAILABLE = np is not None
+
+'''
+Bulk readers for the fixed-width accounts and transaction files.
+
+Every record in these files has the same width, so a whole file can be
+viewed as a NumPy structured array with one field per column, and each
+column converted in a single vectorized step instead of slicing and
+converting every line in Python:
+    - accounts records:    NNNNN_AAAAAAAAAAAAAAAAAAAA_S_PPPPPPPP            (37 characters)
+    - master records:      NNNNN_AAAAAAAAAAAAAAAAAAAA_S_PPPPPPPP_TTTT_PP    (45 characters)
+    - transaction records: CC_AAAAAAAAAAAAAAAAAAAA_NNNNN_PPPPPPPP_MM        (41 characters,
+                           40 for the end of session record)
+
+NumPy is optional. Every reader returns None when NumPy is not installed,
+or when the file is not strictly fixed width (a short or long line, a
+missing field, a name that is not ASCII), and the caller then falls back to its
+line-by-line parser, which also reports the malformed lines.
+
+Transaction files can be read in chunks of whole lines, so memory stays
+bounded however long the day's files are.
+'''
+
+# bytes of a transaction file read per chunk (about 100,000 transactions)
+TRANSACTION_CHUNK_SIZE = 1 << 22
+
+# separator columns are named '' and dropped; every record ends with a newline
+ACCOUNT_FIELDS = [('num', 'S5'), ('', 'S1'), ('name', 'S20'), ('', 'S1'), ('status', 'S1'), ('', 'S1'),
+                  ('balance', 'S8')]
+MASTER_FIELDS = ACCOUNT_FIELDS + [('', 'S1'), ('count', 'S4'), ('', 'S1'), ('plan', 'S2')]
+# width of a transaction record, and of a record one column short of it
+# (the end of session record) that is padded to full width before reading
+TRANSACTION_WIDTH = 41
+SHORT_TRANSACTION_WIDTH = 40
+
+TRANSACTION_FIELDS = [('code', 'S2'), ('', 'S1'), ('name', 'S20'), ('', 'S1'), ('num', 'S5'), ('', 'S1'),
+                      ('amount', 'S8'), ('', 'S1'), ('misc', 'S2')]
+
+
+'''
+Builds the structured dtype of a record, including its newline.
+'''
+
+def recordType(fields):
+    named = []
+    for index, (name, kind) in enumerate(fields):
+        named.append((name or f"_{index}", kind))
+    return np.dtype(named + [('newline', 'S1')])
+
+
+'''
+Columns of an accounts or master file, up to its END_OF_FILE record.
+
+    - num: account numbers as strings; numbers: the same as integers (0 if not numeric)
+    - name, status: strings
+    - balance: float64
+    - count: int64 transaction counts, plan: strings (master files only, else None)
+    - recordSize: size of one record, so record i starts at i * recordSize
+    - endOffset and endRecord: the END_OF_FILE record, or None if there is none
+'''
+
+class AccountColumns:
+    __slots__ = ('num', 'numbers', 'name', 'status', 'balance', 'count', 'plan',
+                 'recordSize', 'endOffset', 'endRecord')
+
+
+'''
+Columns of a transaction file, one entry per line.
+
+    - code, name, num, misc: strings
+    - amount: float64
+'''
+
+class TransactionColumns:
+    __slots__ = ('code', 'name', 'num', 'amount', 'misc')
+
+
+'''
+Views a file as an array of records of the given fields.
+
+Returns None if NumPy is missing, or if the file is not a whole number of
+records that each end in a newline. A last record without its newline is
+accepted.
+'''
+
+def readRecords(path, fields):
+    if np is None:
+        return None
+
+    return viewRecords(readBytes(path), fields)
+
+
+'''
+Reads a file as an array of bytes, adding the newline a last line may lack.
+'''
+
+def readBytes(path):
+    return withNewline(np.fromfile(path, dtype=np.uint8))
+
+
+'''
+Adds a newline to an array of bytes if its last line lacks one.
+'''
+
+def withNewline(data):
+    if data.size and data[-1] != ord('\n'):
+        data = np.append(data, np.uint8(ord('\n')))
+    return data
+
+
+'''
+Views an array of bytes as records of the given fields, or returns None if
+the bytes are not a whole number of records that each end in a newline.
+'''
+
+def viewRecords(data, fields):
+    dtype = recordType(fields)
+    if data.size % dtype.itemsize != 0:
+        return None
+
+    records = data.view(dtype)
+    if not (records['newline'] == b'\n').all():
+        return None
+    return records
+
+
+'''
+Converts a bytes column into a string column, stripping the padding when asked.
+
+The conversion only accepts ASCII, so any other byte raises a ValueError
+(the fixed-width format has no room for multi-byte characters anyway).
+'''
+
+def text(column, strip=True):
+    if strip:
+        column = np.char.strip(column)
+    return column.astype(str)
+
+
+'''
+Reads an accounts file, or a master accounts file, as columns.
+
+The record width is taken from the first line: 37 characters for an
+accounts file, 45 for a master file. Records after END_OF_FILE are ignored.
+
+Returns an AccountColumns, or None if the file cannot be read in bulk.
+'''
+
+def readAccountColumns(path):
+    if np is None:
+        return None
+
+    with open(path, 'rb') as file:
+        width = len(file.readline().rstrip(b'\n'))
+    if width == 45:
+        fields = MASTER_FIELDS
+    elif width == 37:
+        fields = ACCOUNT_FIELDS
+    else:
+        return None
+
+    records = readRecords(path, fields)
+    if records is None:
+        return None
+
+    columns = AccountColumns()
+    columns.recordSize = records.dtype.itemsize
+
+    names = np.char.strip(records['name'])
+    end = np.flatnonzero(names == b'END_OF_FILE')
+    if end.size:
+        columns.endOffset = int(end[0]) * columns.recordSize
+        columns.endRecord = records[end[0]].tobytes()
+        records = records[:end[0]]
+        names = names[:end[0]]
+    else:
+        columns.endOffset = None
+        columns.endRecord = None
+
+    try:
+        columns.num = text(records['num'])
+        columns.name = text(names, strip=False)
+        columns.status = text(records['status'], strip=False)
+        columns.balance = records['balance'].astype(np.float64)
+        if fields is MASTER_FIELDS:
+            columns.count = records['count'].astype(np.int64)
+            columns.plan = text(records['plan'], strip=False)
+        else:
+            columns.count = None
+            columns.plan = None
+    except ValueError:
+        # a number that does not parse, or a name that is not ASCII
+        return None
+
+    numeric = np.char.isdigit(columns.num)
+    columns.numbers = np.zeros(len(records), dtype=np.int64)
+    if numeric.any():
+        columns.numbers[numeric] = columns.num[numeric].astype(np.int64)
+    return columns
+
+
+'''
+Converts a column of balances in dollars into an array('q') of cents, the
+form of a balance column (see Account).
+'''
+
+def centsColumn(balances):
+    cents = array('q')
+    cents.frombytes(np.rint(balances * 100).astype(np.int64).tobytes())
+    return cents
+
+
+'''
+Splits account columns into the live accounts and the tombstoned records.
+
+Returns the numbers, names, statuses and offsets of the live accounts as
+lists, their balances as a balance column in cents, and the number of
+records carrying the tombstone status.
+'''
+
+def splitTombstones(columns, tombstone):
+    live = columns.status != tombstone
+    offsets = np.flatnonzero(live) * columns.recordSize
+    return (columns.num[live].tolist(), columns.name[live].tolist(), columns.status[live].tolist(),
+            centsColumn(columns.balance[live]), offsets.tolist(), int(live.size - np.count_nonzero(live)))
+
+
+'''
+Reads a transaction file as columns.
+
+Returns a TransactionColumns, or None if the file cannot be read in bulk.
+'''
+
+def readTransactionColumns(path):
+    if np is None:
+        return None
+    return transactionColumns(readBytes(path))
+
+
+'''
+Reads a transaction file in chunks of whole lines.
+
+Yields every chunk as bytes together with its TransactionColumns, or with
+None if the chunk cannot be read in bulk (the caller then parses its lines).
+Needs NumPy (see NUMPY_AVAILABLE).
+'''
+
+def readTransactionChunks(path, chunkSize=TRANSACTION_CHUNK_SIZE):
+    with open(path, 'rb') as file:
+        rest = b""
+        while True:
+            block = file.read(chunkSize)
+            if not block:
+                break
+
+            block = rest + block
+            cut = block.rfind(b'\n') + 1
+            chunk, rest = block[:cut], block[cut:]
+            if chunk:
+                yield chunk, transactionColumns(np.frombuffer(chunk, dtype=np.uint8))
+
+        if rest:
+            yield rest, transactionColumns(withNewline(np.frombuffer(rest, dtype=np.uint8)))
+
+
+'''
+Converts the bytes of whole transaction lines into columns.
+
+Lines one column short (the end of session record) are padded with a space
+first; the padding only lands in the misc field, whose padding is stripped
+anyway. A blank amount reads as 0, as it does for parseTransaction.
+
+Returns a TransactionColumns, or None if the lines are not all fixed width.
+'''
+
+def transactionColumns(data):
+    ends = np.flatnonzero(data == ord('\n'))
+    lengths = np.diff(ends, prepend=-1) - 1
+    short = lengths == SHORT_TRANSACTION_WIDTH
+    if not (short | (lengths == TRANSACTION_WIDTH)).all():
+        return None
+    if short.any():
+        data = np.insert(data, ends[short], np.uint8(ord(' ')))
+
+    records = viewRecords(data, TRANSACTION_FIELDS)
+    if records is None:
+        return None
+
+    columns = TransactionColumns()
+    try:
+        columns.code = text(records['code'], strip=False)
+        columns.name = text(records['name'])
+        columns.num = text(records['num'])
+        amounts = np.char.strip(records['amount'])
+        amounts[amounts == b''] = b'0'
+        columns.amount = amounts.astype(np.float64)
+        columns.misc = text(records['misc'])
+    except ValueError:
+        return None
+    return columns
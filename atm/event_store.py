@@ -0,0 +1,374 @@
+import os
+
+from atm.account import Account, toCents
+from atm.account_store import AccountStore
+from atm.backend import (parseTransaction, WITHDRAWAL, TRANSFER, PAYBILL, CREATE, DELETE, DISABLE, CHANGEPLAN)
+from atm.output_stream import formatTransaction
+from atm.snapshot import fileChecksum, readSnapshot, writeSnapshot
+
+'''
+The EventSourcedStore class is an AccountStore whose state is rebuilt from
+the day's transactions instead of being written back to the accounts file.
+
+The accounts file is left as it was at the start of the day. Every
+transaction the ATM records is appended to an event log next to it, in the
+transaction file format (see formatTransaction), and applied to the
+accounts in memory as usual. Every given number of events the store writes
+a checkpoint: a snapshot of all its accounts (see snapshot) that also
+records how far into the event log it reaches. Writing the checkpoint is
+the only time the whole state is written out.
+
+Loading restores the latest checkpoint and replays only the events logged
+after it, so a restart after a crash costs the tail of the log, not the
+whole day. Replaying applies each event as the front end did when it was
+recorded (withdrawals, bill payments and transfers move money, deposits
+wait for the back end, creates, deletes, disables and plan changes change
+the accounts) without checking it again. A torn last event from a crash in
+the middle of an append is dropped.
+
+The event log and its checkpoints belong to the accounts file they started
+from. The log opens with a header line recording the size and CRC-32 of
+that file. When the file changes (the back end has written the next day's
+accounts), the header no longer matches, the event log is discarded, and
+the new file becomes the starting state. A checkpoint that is missing or
+damaged while the log still matches costs a replay of the whole log from
+the accounts file; the log itself is never discarded for it. A log without
+a header, or shorter than its checkpoint says it is, fails the load.
+
+Events are handed to the operating system as they are appended and synced
+at every checkpoint and flush (every logout). Checkpoints are only taken
+between commands (see checkpointIfDue), so a checkpoint never holds a change
+whose event has not been logged yet. The store is meant for sessions served
+one at a time by one ATM.
+'''
+
+# suffixes of the event log and of the checkpoint kept next to the accounts file
+EVENTS_SUFFIX = ".events"
+CHECKPOINT_SUFFIX = ".checkpoint"
+
+# events logged between two checkpoints
+CHECKPOINT_INTERVAL = 10000
+
+# first line of the event log: magic, then the size and CRC-32 of the accounts file
+EVENTS_MAGIC = "ATMEVENTS"
+EVENTS_HEADER_SIZE = len(EVENTS_MAGIC) + 33
+
+
+'''
+Returns the header line of an event log started from an accounts file of
+the given size and CRC-32.
+'''
+
+def eventsHeader(size, crc):
+    return f"{EVENTS_MAGIC} {size:020d} {crc:010d}\n".encode()
+
+
+'''
+Reads the size and CRC-32 of the accounts file from the header of an event log.
+
+Returns None if there is no event log or it is empty, and raises a
+ValueError if it does not start with a header.
+'''
+
+def readEventsHeader(eventsPath):
+    try:
+        with open(eventsPath, 'rb') as file:
+            data = file.read(EVENTS_HEADER_SIZE)
+    except FileNotFoundError:
+        return None
+    if not data:
+        return None
+
+    fields = data.decode(errors='replace').split()
+    if (len(data) != EVENTS_HEADER_SIZE or not data.endswith(b"\n") or len(fields) != 3
+            or fields[0] != EVENTS_MAGIC or not fields[1].isdigit() or not fields[2].isdigit()):
+        raise ValueError(f"{eventsPath}: event log does not start with an {EVENTS_MAGIC} header")
+    return int(fields[1]), int(fields[2])
+
+
+class EventSourcedStore(AccountStore):
+    def __init__(self, interval=CHECKPOINT_INTERVAL):
+        super().__init__()
+        self.interval = interval
+
+        # the event log, its size, and how many events were logged since the last checkpoint
+        self.eventsPath = None
+        self.eventFile = None
+        self.eventOffset = 0
+        self.sinceCheckpoint = 0
+
+        # events replayed by the last load
+        self.replayed = 0
+
+    '''
+    Loads the accounts from the latest checkpoint and replays the events
+    logged after it.
+
+    When the event log was started from another accounts file, or there is
+    none, the file itself is the starting state: the log is started afresh
+    and a first checkpoint is taken straight away. When the log matches but
+    the checkpoint cannot be used, the whole log is replayed against the
+    file and a new checkpoint taken. Raises a ValueError if the event log
+    has no header or is shorter than the checkpoint. lazy and journal are
+    accepted for compatibility with AccountStore; the whole state is always
+    loaded, and the event log takes the place of the journal.
+    '''
+
+    def load(self, path, lazy=False, journal=True):
+        self.path = path
+        self.eventsPath = path + EVENTS_SUFFIX
+
+        size, crc = fileChecksum(path)
+        checkpoint = None
+        if readEventsHeader(self.eventsPath) != (size, crc):
+            # no log yet, or one left from an earlier accounts file; the new
+            # log is swapped in whole, so a crash never leaves half a header
+            temp_path = self.eventsPath + ".tmp"
+            with open(temp_path, 'wb') as file:
+                file.write(eventsHeader(size, crc))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temp_path, self.eventsPath)
+        else:
+            checkpoint = readSnapshot(path, CHECKPOINT_SUFFIX)
+            if checkpoint is not None and checkpoint.position > os.path.getsize(self.eventsPath):
+                raise ValueError(f"{self.eventsPath}: event log ends before its checkpoint at byte {checkpoint.position}")
+
+        if checkpoint is None:
+            self.loadRecords(path)
+            start = EVENTS_HEADER_SIZE
+        else:
+            self.addAccounts(checkpoint.nums, checkpoint.names, checkpoint.statuses, checkpoint.balances,
+                             checkpoint.offsets)
+            self.highestAccountNum = checkpoint.highestAccountNum
+            self.endOffset = checkpoint.endOffset
+            self.endRecord = checkpoint.endRecord
+            start = checkpoint.position
+
+        self.eventOffset = self.replay(start)
+        self.seedAllocator()
+
+        # drop a torn last event, so new events follow the last complete one
+        with open(self.eventsPath, 'ab') as file:
+            file.truncate(self.eventOffset)
+        self.eventFile = open(self.eventsPath, 'ab')
+
+        if checkpoint is None:
+            self.checkpoint()
+
+    '''
+    Applies the events logged from the given position of the event log on.
+
+    Returns the position just after the last complete event.
+    '''
+
+    def replay(self, start):
+        try:
+            with open(self.eventsPath, 'rb') as file:
+                file.seek(start)
+                data = file.read()
+        except FileNotFoundError:
+            return start
+
+        end = start
+        pos = start
+        sender = None
+        self.replayed = 0
+        for raw in data.splitlines(keepends=True):
+            if not raw.endswith(b"\n"):
+                break
+            pos += len(raw)
+            trans = parseTransaction(raw.decode())
+            if trans is None:
+                continue
+
+            # a transfer is logged as two lines, the sending account first
+            if trans['code'] == TRANSFER and sender is None:
+                sender = trans
+                continue
+            self.applyEvent(trans, sender)
+            sender = None
+            end = pos
+            self.replayed += 1
+        return end
+
+    '''
+    Applies one logged event to the accounts, as the front end did when it
+    recorded it. For a transfer, sender is the line with the sending account.
+    '''
+
+    def applyEvent(self, trans, sender=None):
+        code = trans['code']
+        account_num = trans['account_num']
+        account = self.accountsByNum.get(account_num)
+
+        if code == CREATE:
+            if account is None:
+                self.addAccount(Account(trans['name'], account_num, trans['amount'], "A", None))
+            return
+        if code == TRANSFER:
+            source = self.accountsByNum.get(sender['account_num'])
+            cents = toCents(trans['amount'])
+            if source is not None:
+                source.cents -= cents
+            if account is not None:
+                account.cents += cents
+            return
+        if account is None:
+            return
+
+        if code == WITHDRAWAL or code == PAYBILL:
+            account.cents -= toCents(trans['amount'])
+        elif code == DELETE:
+            self.forgetDeleted(account)
+        elif code == DISABLE:
+            account.status = "D"
+        elif code == CHANGEPLAN and account.plan in ("SP", "NP"):
+            account.plan = "NP" if account.plan == "SP" else "SP"
+
+    '''
+    Appends a transaction recorded by the ATM to the event log.
+    '''
+
+    def recordEvent(self, trans):
+        data = formatTransaction(trans).encode()
+        with self.storeLock:
+            self.eventFile.write(data)
+            self.eventFile.flush()
+            self.eventOffset += len(data)
+            self.sinceCheckpoint += 1
+
+    '''
+    Takes a checkpoint once enough events have been logged since the last one.
+
+    Called between commands, when every change made so far has its event in
+    the log. Returns True if a checkpoint was taken.
+    '''
+
+    def checkpointIfDue(self):
+        with self.storeLock:
+            if self.sinceCheckpoint < self.interval:
+                return False
+            self.checkpoint()
+            return True
+
+    '''
+    Writes a checkpoint of every account, reaching to the end of the event log.
+
+    Accounts created this session are included as if already published, as
+    they would be after a restart. The highest number ever allocated is
+    kept, so numbers of accounts deleted since are not handed out again.
+    '''
+
+    def checkpoint(self):
+        with self.storeLock:
+            self.syncEvents()
+            accounts = [*self.accounts, *self.pending.values()]
+            writeSnapshot(self.path, accounts, 0, max(self.highestAccountNum, self.nextAccountNum - 1),
+                          self.endOffset, self.endRecord, position=self.eventOffset, suffix=CHECKPOINT_SUFFIX)
+            self.sinceCheckpoint = 0
+
+    '''
+    Forces every logged event to disk.
+    '''
+
+    def syncEvents(self):
+        if self.eventFile is not None:
+            self.eventFile.flush()
+            os.fsync(self.eventFile.fileno())
+
+    # the accounts file is never written: changes live in the event log and the checkpoints
+
+    '''
+    Creates a new account (active by default) in memory; its create event is
+    logged by the ATM. Returns the new Account, or None if no account number
+    is available.
+    '''
+
+    def createAccount(self, name, balance, status="A"):
+        with self.storeLock:
+            acc_num = self.allocateAccountNum()
+            if acc_num is None:
+                return None
+
+            account = Account(name, acc_num, balance, status, None)
+            self.adoptBalance(account)
+            self.pending[acc_num] = account
+            return account
+
+    '''
+    Deletes an account from memory; its delete event is logged by the ATM.
+    '''
+
+    def deleteAccount(self, account):
+        with self.storeLock:
+            self.forgetDeleted(account)
+
+    '''
+    Applies a batch of admin changes in memory, as AccountStore.applyBatch
+    does with the accounts file. Returns the new accounts in order, or None
+    if there are not enough account numbers left for them.
+    '''
+
+    def applyBatch(self, creates, deletes, updates):
+        with self.storeLock:
+            nums = self.allocateAccountNums(len(creates))
+            if nums is None:
+                return None
+
+            created = []
+            for acc_num, (name, balance, status) in zip(nums, creates):
+                account = Account(name, acc_num, balance, status, None)
+                self.adoptBalance(account)
+                self.pending[acc_num] = account
+                created.append(account)
+            for account in deletes:
+                self.forgetDeleted(account)
+            return created
+
+    '''
+    Changes are logged as events by the ATM, so there is nothing to mark.
+    '''
+
+    def markDirty(self, account):
+        pass
+
+    '''
+    Numbers are recovered from the checkpoint and the create events, so no
+    high-water mark file is kept.
+    '''
+
+    def writeHighWaterMark(self, num):
+        pass
+
+    '''
+    Syncs the event log; the accounts file itself is never written.
+    '''
+
+    def flush(self):
+        with self.storeLock:
+            self.syncEvents()
+
+    def compactIfNeeded(self):
+        return False
+
+    '''
+    Makes the accounts created this session available for lookups, then
+    takes a checkpoint if one is due.
+    '''
+
+    def publishPending(self, accountNums=None):
+        super().publishPending(accountNums)
+        self.checkpointIfDue()
+
+    '''
+    Closes the event log.
+    '''
+
+    def close(self):
+        with self.storeLock:
+            if self.eventFile is not None:
+                self.syncEvents()
+                self.eventFile.close()
+                self.eventFile = None
+        super().close()
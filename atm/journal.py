@@ -0,0 +1,129 @@
+import os
+import threading
+
+'''
+The Journal class is an append-only write-ahead log of account changes.
+
+Every time an account changes, the store appends the account's new
+fixed-width record to the journal before the change reaches the accounts
+file. If the process dies before the changes are written back, the next
+start replays the journal and nothing is lost.
+
+Entries are handed to the operating system as soon as they are appended,
+but fsync is group-committed: the journal syncs once a batch of entries has
+built up, or once the oldest unsynced entry has waited for the commit
+window, so durability does not cost one fsync per command.
+'''
+
+# suffix of the journal file kept next to the accounts file
+JOURNAL_SUFFIX = ".journal"
+
+# group commit: sync after this many entries, or this many seconds after the first unsynced one
+GROUP_COMMIT_SIZE = 64
+GROUP_COMMIT_WINDOW = 0.05
+
+# width of an entry: one fixed-width account record (see account_store.formatRecord)
+ENTRY_WIDTH = 37
+
+
+class Journal:
+    def __init__(self, path, batchSize=GROUP_COMMIT_SIZE, window=GROUP_COMMIT_WINDOW):
+        self.path = path
+        self.batchSize = batchSize
+        self.window = window
+        self.file = None
+        self.unsynced = 0
+        self.timer = None
+        self.lock = threading.Lock()
+
+    '''
+    Appends a record to the journal.
+
+    The file is opened on the first append of a session. The entry is written
+    through to the operating system straight away and synced as part of the
+    current group commit.
+
+    Raises ValueError, journaling nothing, if the record is not exactly
+    ENTRY_WIDTH characters.
+    '''
+
+    def append(self, record):
+        if len(record) != ENTRY_WIDTH:
+            raise ValueError(f"journal entry is not a {ENTRY_WIDTH} character account record: '{record}'")
+
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'ab')
+
+            self.file.write((record + "\n").encode())
+            self.file.flush()
+            self.unsynced += 1
+
+            if self.unsynced >= self.batchSize:
+                self.syncLocked()
+            elif self.timer is None:
+                # the first entry of a group starts the commit window
+                self.timer = threading.Timer(self.window, self.sync)
+                self.timer.daemon = True
+                self.timer.start()
+
+    '''
+    Forces every appended entry to disk.
+    '''
+
+    def sync(self):
+        with self.lock:
+            self.syncLocked()
+
+    def syncLocked(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+
+        if self.file is not None and self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+
+    '''
+    Discards the journal once its changes are safely in the accounts file.
+    '''
+
+    def checkpoint(self):
+        with self.lock:
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            self.unsynced = 0
+
+            if os.path.exists(self.path):
+                os.remove(self.path)
+
+    '''
+    Returns the records left in the journal by a previous run, oldest first.
+
+    A torn last line from a crash in the middle of an append is ignored.
+    Raises ValueError for any complete entry that is not an account record,
+    leaving the journal in place, rather than lose the change it holds.
+    '''
+
+    def entries(self):
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return []
+
+        # everything after the last newline is a torn append (or nothing)
+        lines = data.split(b"\n")[:-1]
+
+        records = []
+        for number, raw in enumerate(lines, 1):
+            line = raw.decode(errors="replace")
+            if len(line) != ENTRY_WIDTH:
+                raise ValueError(f"{self.path}: entry {number} is not a {ENTRY_WIDTH} character account record: '{line}'")
+            records.append(line)
+        return records
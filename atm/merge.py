@@ -0,0 +1,179 @@
+import heapq
+import os
+import re
+import tempfile
+
+from atm.backend import TRANSFER, END_OF_SESSION
+from atm.output_stream import END_OF_SESSION as END_OF_SESSION_LINE
+
+'''
+The TransactionMerger class combines the day's per-session transaction files
+into one merged daily transaction file for the back end.
+
+Every ATM session writes its own transaction file ending with an end of
+session (00) record. The merger streams all of them into one file, drops
+the per-session 00 records and writes a single 00 record at the end of the
+merged file.
+
+Records are ordered by a configurable key:
+    - "session" keeps the sessions in the order the files are given and the
+      records of each session in their original order
+    - "account" orders records by account number; records for the same
+      account keep their session order
+
+The two lines of a transfer always travel together and are ordered by the
+sending account only. In account order a transfer is therefore not kept in
+session order with the other records of its receiving account: a credit
+from a lower account number still comes first, but a credit from a higher
+one follows every record of the receiver, including debits made later in
+the day. The back end then applies such a debit before the credit that paid
+for it and can reject it for taking the balance below $0.00, which the
+front end did not. Only session order gives the back end the transactions
+in the order the front ends made them; account order suits consumers that
+do not replay balances.
+
+Session order simply streams the files one after the other. Account order
+uses a heap-based k-way merge that holds one record per input file; each
+session file is sorted in memory before it joins the merge (a single session
+is small). When there are more files than can be open at once, they are
+merged in batches into temporary runs first.
+'''
+
+SESSION_ORDER = "session"
+ACCOUNT_ORDER = "account"
+
+# most input files open at the same time; more files are merged in several passes
+MAX_OPEN_FILES = 256
+
+
+'''
+Reads a transaction file as a sequence of records, each a list of lines.
+
+A transfer is one record holding both of its 02 lines. End of session (00)
+records and blank lines are skipped.
+'''
+
+def readRecords(file):
+    held = None
+    for line in file:
+        if not line.endswith("\n"):
+            line += "\n"
+        code = line[0:2]
+
+        if held is not None:
+            if code == TRANSFER:
+                yield [held, line]
+                held = None
+                continue
+            yield [held]
+            held = None
+
+        if len(line.strip()) < 2 or code == END_OF_SESSION:
+            continue
+        if code == TRANSFER:
+            held = line
+            continue
+        yield [line]
+
+    if held is not None:
+        yield [held]
+
+
+'''
+Orders transaction file paths by session, comparing the numbers in their
+names as numbers, so "day_10000.atf" follows "day_9999.atf" (see sessionPath)
+however many digits the session numbers have.
+'''
+
+def sessionOrder(paths):
+    return sorted(paths, key=lambda path: [int(part) if part.isdigit() else part
+                                           for part in re.split(r'(\d+)', path)])
+
+
+'''
+Returns the account number a record is ordered by (the sending account for transfers).
+'''
+
+def accountKey(record):
+    return record[0][24:29]
+
+
+class TransactionMerger:
+    def __init__(self, order=SESSION_ORDER, maxOpenFiles=MAX_OPEN_FILES):
+        if order not in (SESSION_ORDER, ACCOUNT_ORDER):
+            raise ValueError(f"unknown merge order '{order}'")
+        self.order = order
+        self.maxOpenFiles = max(2, maxOpenFiles)
+
+    '''
+    Merges the given session transaction files into outPath.
+
+    Returns the number of records written, not counting the final 00 record.
+    '''
+
+    def merge(self, paths, outPath):
+        if self.order == SESSION_ORDER:
+            return self.concatenate(paths, outPath)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            runs = list(paths)
+            sorted_runs = False
+            run_num = 0
+
+            # merge batches of files into temporary runs until one pass can open them all
+            while len(runs) > self.maxOpenFiles:
+                next_runs = []
+                for start in range(0, len(runs), self.maxOpenFiles):
+                    run_path = os.path.join(temp_dir, f"run{run_num}.atf")
+                    run_num += 1
+                    self.mergeOnce(runs[start:start + self.maxOpenFiles], run_path, sorted_runs, False)
+                    next_runs.append(run_path)
+                runs = next_runs
+                sorted_runs = True
+
+            return self.mergeOnce(runs, outPath, sorted_runs, True)
+
+    '''
+    Writes every session file in the order given, one file open at a time.
+    '''
+
+    def concatenate(self, paths, outPath):
+        count = 0
+        with open(outPath, 'w') as out:
+            for path in paths:
+                with open(path, 'r') as file:
+                    for record in readRecords(file):
+                        out.writelines(record)
+                        count += 1
+            out.write(END_OF_SESSION_LINE)
+        return count
+
+    '''
+    Runs a single k-way merge pass by account over files that can all be open at once.
+
+    Input files that are already ordered (runs from an earlier pass) are
+    streamed; session files are sorted first. heapq.merge takes equal keys
+    from earlier inputs first, so records for the same account stay in
+    session order.
+    '''
+
+    def mergeOnce(self, paths, outPath, sortedInputs, endSession):
+        files = [open(path, 'r') for path in paths]
+        try:
+            if sortedInputs:
+                sources = [readRecords(file) for file in files]
+            else:
+                sources = [sorted(readRecords(file), key=accountKey) for file in files]
+            merged = heapq.merge(*sources, key=accountKey)
+
+            count = 0
+            with open(outPath, 'w') as out:
+                for record in merged:
+                    out.writelines(record)
+                    count += 1
+                if endSession:
+                    out.write(END_OF_SESSION_LINE)
+            return count
+        finally:
+            for file in files:
+                file.close()
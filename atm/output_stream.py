@@ -10,17 +10,86 @@ echoes file-based commands for visibility, and safely captures interruptions
 to ensure controlled session termination.
 '''
 
+import os
+import sys
+
+# the sequence of transactions ends with an end of session (00) transaction code
+END_OF_SESSION = "00" + " " * 38 + "\n"
+
+# write buffer used when streaming transactions
+TRANSACTION_BUFFER_SIZE = 1 << 16
+
+# terminal output held in buffered mode before it is written out in one block
+OUTPUT_BUFFER_SIZE = 1 << 16
+
+
+'''
+Returns the transaction file path for one session of a batch run.
+
+The session number is added before the extension, so "day.atf" becomes
+"day_0001.atf", "day_0002.atf", ... Numbers past 9999 take more digits, so
+the names only sort in session order when compared by number (see
+merge.sessionOrder).
+'''
+
+def sessionPath(path, number):
+    root, ext = os.path.splitext(path)
+    return f"{root}_{number:04d}{ext}"
+
+
 class OutputStream:
-    def __init__(self, srcPath):
+    def __init__(self, srcPath, buffered=False, quiet=False):
         self.srcPath = srcPath
 
+        # open transaction file while streaming a session
+        self.transactionFile = None
+
+        # scripted runs: hold terminal output and write it in large blocks,
+        # and optionally drop menus and prompts, keeping results and errors
+        self.buffered = buffered
+        self.quiet = quiet
+        self.pending = []
+        self.pendingSize = 0
+
     '''
     Writes a message to the output stream.
     In interactive mode, this simply prints the message to the console.
+
+    In buffered mode the message is held until OUTPUT_BUFFER_SIZE characters
+    have piled up (or flush is called) and then written with the rest of the
+    block. Buffered output is meant for scripted input: prompts are not shown
+    before the ATM waits for input.
     '''
 
     def write(self, message):
-        print(message)
+        if not self.buffered:
+            print(message)
+            return
+
+        self.pending.append(message)
+        self.pendingSize += len(message) + 1
+        if self.pendingSize >= OUTPUT_BUFFER_SIZE:
+            self.flush()
+
+    '''
+    Writes a menu or a prompt for input. Quiet mode leaves them out.
+    '''
+
+    def prompt(self, message):
+        if not self.quiet:
+            self.write(message)
+
+    '''
+    Writes out any terminal output held in buffered mode.
+    '''
+
+    def flush(self):
+        if self.pending:
+            self.pending.append("")
+            sys.stdout.write("\n".join(self.pending))
+            sys.stdout.flush()
+            self.pending = []
+            self.pendingSize = 0
 
     '''
     Writes all recorded transactions to the output file
@@ -32,31 +101,76 @@ class OutputStream:
     information. An end-of-session transaction (00) is
     appended after all records.
     '''
-    
+
     def writeTransactionFile(self, transactions):
-        # format: CC_AAAAAAAAAAAAAAAAAAAA_NNNNN_PPPPPPPP_MM
-        # _ --> is a space
-        # CC --> a two-digit transaction code, 01-withdrawal, 02-transfer, 03-paybill, 
-        #        04-deposit, 05-create, 06-delete, 07-disable, 08-changeplan, 00-end of session
-        # NNNNN --> the bank account number
-        # AAAAAAAAAAAAAAAAAAAA --> the account holder’s name
-        # PPPPPPPP --> the amount of funds involved in the transaction (in CAD)
-        # MM --> any additional miscellaneous information that is needed in
-        #        the transaction but does not fit in any of the other fields
-        
         with open(self.srcPath, 'w') as file:
             for trans in transactions:
-                # Format each field according to requirements
-                code = trans['code']
-                name = trans['name'].ljust(20)[:20]  # alphabetic fields are left justified, filled with spaces
-                account = f"{trans['account_num'].zfill(5)}" #numeric fields are right justified, filled with zeroes
-                amount = f"{trans['amount']:08.2f}"  # “.00” is appended to the end of the value
-                misc = trans['misc'].ljust(2)[:2]
-                
-                # create 40 character line
-                line = f"{code} {name} {account} {amount} {misc}\n"
-                file.write(line)
+                file.write(formatTransaction(trans))
             
             # the sequence of transactions ends with an end of session (00) transaction code
-            end_line = "00" + " " * 38 + "\n"
-            file.write(end_line)
\ No newline at end of file
+            file.write(END_OF_SESSION)
+
+    '''
+    Streams a single transaction to the output file.
+
+    Used when transactions are not buffered for the whole session: the
+    record is formatted straight away and appended through a buffered
+    writer, so memory use stays constant however long the session runs.
+    The file is opened on the first transaction of the session.
+    '''
+
+    def streamTransaction(self, trans):
+        if self.transactionFile is None:
+            self.transactionFile = open(self.srcPath, 'w', buffering=TRANSACTION_BUFFER_SIZE)
+        self.transactionFile.write(formatTransaction(trans))
+
+    '''
+    Ends a streamed transaction file.
+
+    Writes the end-of-session (00) transaction and closes the file. A session
+    without transactions still produces a file holding only the 00 record.
+    '''
+
+    def closeTransactionFile(self):
+        if self.transactionFile is None:
+            self.transactionFile = open(self.srcPath, 'w')
+        self.transactionFile.write(END_OF_SESSION)
+        self.transactionFile.close()
+        self.transactionFile = None
+
+
+'''
+Formats one transaction as a 40 character transaction file line (plus newline).
+
+format: CC_AAAAAAAAAAAAAAAAAAAA_NNNNN_PPPPPPPP_MM
+_ --> is a space
+CC --> a two-digit transaction code, 01-withdrawal, 02-transfer, 03-paybill, 
+       04-deposit, 05-create, 06-delete, 07-disable, 08-changeplan, 00-end of session
+NNNNN --> the bank account number
+AAAAAAAAAAAAAAAAAAAA --> the account holder’s name
+PPPPPPPP --> the amount of funds involved in the transaction (in CAD)
+MM --> any additional miscellaneous information that is needed in
+       the transaction but does not fit in any of the other fields
+
+A transfer is written as two consecutive 02 lines: the first carries the
+account the money comes from and the second the account it goes to, so the
+back end can apply both sides.
+'''
+
+def formatTransaction(trans):
+    # Format each field according to requirements
+    code = trans['code']
+    name = trans['name'].ljust(20)[:20]  # alphabetic fields are left justified, filled with spaces
+    account = f"{trans['account_num'].zfill(5)}" #numeric fields are right justified, filled with zeroes
+    amount = f"{trans['amount']:08.2f}"  # “.00” is appended to the end of the value
+    misc = trans['misc'].ljust(2)[:2]
+    
+    # create 40 character line
+    line = f"{code} {name} {account} {amount} {misc}\n"
+
+    # transfers add a second line for the receiving account
+    if 'account_num_reciever' in trans:
+        receiver = trans['account_num_reciever'].zfill(5)
+        line += f"{code} {name} {receiver} {amount} {misc}\n"
+
+    return line
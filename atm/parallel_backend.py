@@ -0,0 +1,235 @@
+import multiprocessing
+import os
+import tempfile
+from bisect import bisect_right
+
+from atm.account import Account
+from atm.backend import BackEnd, parseTransaction, TRANSFER, END_OF_SESSION
+
+'''
+The ParallelBackEnd class runs the overnight back end across several processes.
+
+Every transaction except a transfer touches a single account, so the work
+splits cleanly by account. Accounts are partitioned into contiguous ranges
+of account numbers holding roughly the same number of accounts, and each
+range is processed by its own worker in a multiprocessing pool.
+
+The parent streams the day's transaction files once and routes every
+transaction to a spill file for the partition that owns its account,
+keeping the original order within each partition. Transfers whose two
+accounts fall in the same partition are routed there whole. Transfers that
+cross partitions are split: the worker owning the sender debits it, and a
+reconciliation step in the parent credits the receiver afterwards, refunding
+the sender if the receiver cannot take the money.
+
+Because of that, money moved between partitions reaches the receiver at the
+end of the run rather than at its place in the day, so the results can
+differ from a sequential BackEnd run wherever a later transaction depends
+on the credit:
+    - a withdrawal, bill payment or transfer from the receiver later in the
+      day that needs the credited money is rejected for insufficient funds
+    - a deposit to the receiver later in the day is checked against the
+      balance without the credit, so it can be accepted and the credit then
+      rejected (and refunded) for going past the maximum balance
+    - a receiver disabled or deleted later in the day rejects the credit,
+      which the sequential run would have accepted
+    - the refund of a rejected credit is lost if the sender was deleted later
+      in the day; this is reported in the error log
+Runs whose cross-partition receivers do not depend on their credits give
+the same accounts as a sequential run. The error log lists routing errors
+first, then each partition's errors, then reconciliation errors.
+'''
+
+# spill record tags: a whole transaction, or the sending half of a cross-partition transfer
+SPILL_TRANSACTION = "T"
+SPILL_TRANSFER_OUT = "O"
+
+
+'''
+Converts an account number to an integer for range partitioning.
+'''
+
+def accountNumber(accountNum):
+    return int(accountNum) if accountNum.isdigit() else 0
+
+
+'''
+Writes one entry to a partition spill file.
+'''
+
+def writeSpill(spill, tag, receiver_num, path, line_num, line):
+    spill.write(f"{tag}\t{receiver_num}\t{path}\t{line_num}\t{line}\n")
+
+
+'''
+Packs accounts and their transaction counts into plain tuples for another process.
+'''
+
+def dumpAccounts(accounts, counts):
+    return [(num, account.name, account.status, account.cents, account.plan, counts[num])
+            for num, account in accounts.items()]
+
+
+'''
+Unpacks accounts sent by dumpAccounts into a back end.
+'''
+
+def loadAccounts(backend, rows):
+    for num, name, status, cents, plan, count in rows:
+        backend.accounts[num] = Account(name, num, None, status, plan, column=backend.balances,
+                                        slot=len(backend.balances))
+        backend.balances.append(cents)
+        backend.counts[num] = count
+
+
+'''
+Worker entry point: applies one partition's spill file to its accounts.
+
+Returns the partition's final accounts, the cross-partition transfers whose
+sender was debited, and the number of errors written to the partition's
+error file.
+'''
+
+def applyPartition(task):
+    rows, spill_path, error_path = task
+    backend = BackEnd()
+    loadAccounts(backend, rows)
+    outbound = []
+
+    with open(spill_path, 'r') as spill, open(error_path, 'w') as errorLog:
+        backend.errorLog = errorLog
+        for entry in spill:
+            tag, receiver_num, path, line_num, line = entry.rstrip('\n').split('\t', 4)
+            where = (path, int(line_num))
+            try:
+                trans = parseTransaction(line)
+            except ValueError:
+                backend.error(where, f"malformed transaction '{line}'")
+                continue
+
+            if tag == SPILL_TRANSFER_OUT:
+                if backend.transferOut(trans, where):
+                    outbound.append((trans['account_num'], receiver_num, trans['amount'], where))
+            else:
+                backend.applyTransaction(trans, where)
+
+    return dumpAccounts(backend.accounts, backend.counts), outbound, backend.errorCount
+
+
+class ParallelBackEnd(BackEnd):
+    def __init__(self, workers=None):
+        super().__init__()
+        self.workers = workers or os.cpu_count() or 1
+
+        # upper account number bounds of every partition but the last
+        self.bounds = []
+
+    '''
+    Splits the loaded accounts into ranges holding about the same number of accounts.
+    '''
+
+    def partition(self):
+        nums = sorted(accountNumber(num) for num in self.accounts)
+        parts = max(1, min(self.workers, len(nums)))
+        self.bounds = [nums[len(nums) * i // parts] for i in range(1, parts)]
+
+    '''
+    Returns the index of the partition that owns an account number.
+    '''
+
+    def partitionOf(self, accountNum):
+        return bisect_right(self.bounds, accountNumber(accountNum))
+
+    '''
+    Streams a transaction file and routes each transaction to its partition's spill file.
+    '''
+
+    def route(self, path, spills):
+        pending = None
+        with open(path, 'r') as file:
+            for line_num, line in enumerate(file, 1):
+                line = line.rstrip('\n')
+                if len(line) < 2:
+                    continue
+                code = line[0:2]
+
+                if pending is not None:
+                    sender_line, sender_line_num, sender_part = pending
+                    pending = None
+                    if code == TRANSFER:
+                        receiver_num = line[24:29].strip()
+                        receiver_part = self.partitionOf(receiver_num)
+                        if receiver_part == sender_part:
+                            writeSpill(spills[sender_part], SPILL_TRANSACTION, "", path, sender_line_num, sender_line)
+                            writeSpill(spills[sender_part], SPILL_TRANSACTION, "", path, line_num, line)
+                        else:
+                            writeSpill(spills[sender_part], SPILL_TRANSFER_OUT, receiver_num, path, sender_line_num, sender_line)
+                        continue
+                    self.error((path, sender_line_num), "transfer is missing the receiving account")
+
+                if code == END_OF_SESSION:
+                    continue
+
+                part = self.partitionOf(line[24:29].strip())
+                if code == TRANSFER:
+                    pending = (line, line_num, part)
+                    continue
+                writeSpill(spills[part], SPILL_TRANSACTION, "", path, line_num, line)
+
+        if pending is not None:
+            self.error((path, pending[1]), "transfer is missing the receiving account")
+
+    '''
+    Runs a full overnight pass with the accounts partitioned across the worker pool.
+
+    Produces the same files as BackEnd.run.
+    '''
+
+    def run(self, masterPath, transactionPaths, newMasterPath, currentPath, errorPath):
+        self.loadMaster(masterPath)
+        self.partition()
+        parts = len(self.bounds) + 1
+
+        with tempfile.TemporaryDirectory() as temp_dir, open(errorPath, 'w') as errorLog:
+            self.errorLog = errorLog
+
+            spill_paths = [os.path.join(temp_dir, f"partition{i}.spill") for i in range(parts)]
+            spills = [open(spill_path, 'w') for spill_path in spill_paths]
+            try:
+                for path in transactionPaths:
+                    self.route(path, spills)
+            finally:
+                for spill in spills:
+                    spill.close()
+
+            # hand every partition its accounts; they come back from the workers once applied
+            rows = [{} for _ in range(parts)]
+            for num, account in self.accounts.items():
+                rows[self.partitionOf(num)][num] = account
+            error_paths = [os.path.join(temp_dir, f"partition{i}.errors") for i in range(parts)]
+            tasks = [(dumpAccounts(rows[i], self.counts), spill_paths[i], error_paths[i]) for i in range(parts)]
+            self.accounts = {}
+            self.counts = {}
+            del rows
+
+            with multiprocessing.Pool(min(self.workers, parts)) as pool:
+                results = pool.map(applyPartition, tasks)
+
+            outbound = []
+            for i, (part_rows, part_outbound, error_count) in enumerate(results):
+                loadAccounts(self, part_rows)
+                outbound.extend(part_outbound)
+                self.errorCount += error_count
+                with open(error_paths[i], 'r') as part_errors:
+                    for line in part_errors:
+                        errorLog.write(line)
+
+            # reconciliation: credit the receivers of cross-partition transfers
+            for sender_num, receiver_num, amount, where in outbound:
+                self.transferIn(sender_num, receiver_num, amount, where)
+
+            self.errorLog = None
+
+        self.writeMaster(newMasterPath)
+        self.writeCurrent(currentPath)
+
@@ -9,11 +9,20 @@ an output file.
 
 It maintains the session’s transaction history and provides functionality
 to retrieve or clear recorded actions as needed.
+
+When given an output stream, it runs in streaming mode instead: every
+action is handed to the stream as soon as it is recorded and nothing is
+kept in memory.
+
+When given an event-sourced store (see event_store), every action is also
+logged to its event log as soon as it is recorded.
 '''
 
 class RecordActions:
-    def __init__(self):
+    def __init__(self, stream=None, events=None):
         self.transactions = []
+        self.stream = stream
+        self.events = events
 
     '''
     Records a standard banking transaction.
@@ -31,7 +40,7 @@ class RecordActions:
             'amount': amount,
             'misc': misc
         }
-        self.transactions.append(transaction)
+        self.store(transaction)
 
     
     '''
@@ -52,8 +61,20 @@ class RecordActions:
             'amount': amount,
             'misc': misc
         }
-        self.transactions.append(transaction)
+        self.store(transaction)
+
+    '''
+    Keeps a recorded transaction for the end of the session,
+    or streams it straight out in streaming mode.
+    '''
 
+    def store(self, transaction):
+        if self.events is not None:
+            self.events.recordEvent(transaction)
+        if self.stream is not None:
+            self.stream.streamTransaction(transaction)
+        else:
+            self.transactions.append(transaction)
 
     '''
     Retrieves the list of recorded transactions for the current session.
@@ -0,0 +1,44 @@
+'''
+Object returned by every ATM operation.
+
+Callers driving the ATM in-process get the outcome as data instead of
+having to parse terminal text.
+
+Stores the following information
+    - Whether the operation succeeded
+    - The messages the ATM reports for it, in order (the command line
+      prints them exactly as they are)
+    - The account the operation acted on, when there is one
+    - The accounts a search found (empty for other operations)
+'''
+class Result:
+    __slots__ = ('ok', 'messages', 'account', 'accounts')
+
+    def __init__(self, ok, messages, account=None, accounts=()):
+        self.ok = ok
+        self.messages = messages
+        self.account = account
+        self.accounts = accounts
+
+    '''
+    The messages as a single block of text, one message per line.
+    '''
+
+    def __str__(self):
+        return "\n".join(self.messages)
+
+
+'''
+Builds the Result of an operation that succeeded.
+'''
+
+def success(*messages, account=None, accounts=()):
+    return Result(True, list(messages), account, accounts)
+
+
+'''
+Builds the Result of an operation that was rejected, with the reason.
+'''
+
+def failure(message, account=None):
+    return Result(False, [message], account)
@@ -0,0 +1,194 @@
+import asyncio
+import os
+
+from atm.storage import openAccountStore
+from atm.atm import ATM, InvalidNumber, splitCommand, version
+from atm.input_stream import InputStream
+from atm.output_stream import OutputStream, sessionPath
+
+'''
+The ATMServer class serves many concurrent ATM sessions over the network.
+
+All connections share one AccountStore, loaded once when the server starts.
+Every connection gets its own ATM controller, and with it its own Session,
+RecordActions and session limits, so sessions only meet through the
+accounts themselves. Each session writes its own transaction file, named
+after the connection and the session (day.atf -> day_0003_0001.atf).
+
+The server runs on a single asyncio event loop. Every command but logout
+is applied in one step on the loop, so those commands never interleave.
+A logout writes the session's transaction file and flushes and syncs the
+accounts, so it runs on a worker thread instead (see run_in_executor),
+leaving the loop to serve the other connections meanwhile; the store's
+own locks (see AccountStore) keep it apart from their commands. Idle
+connections cost only their socket and a small controller object.
+
+Protocol (UTF-8 text, one line per command):
+    - the client sends a whole command on one line, with its fields after
+      the command word, e.g. withdraw "boss test" 00002 120.00
+      (see splitCommand); there are no prompts, so a command missing a
+      field is rejected without changing anything
+    - the server answers every command with its messages, one per line,
+      followed by an empty line
+    - on connecting, the server sends its welcome message the same way
+A connection closed while logged in is logged out first, so the session's
+transactions are written.
+
+Logging in as admin needs no credentials, so the bulk command is refused
+unless the server has a batch directory, and then only reads batch files
+inside it (see ATM.bulk).
+'''
+
+# answer sent when a command leaves out fields it needs
+MISSING_FIELDS = "error: missing fields, send the whole command on one line"
+
+# answer sent when the amount field of a command is not a number
+INVALID_NUMBER = "error: invalid number"
+
+# command run on a worker thread, since it writes and syncs files
+LOGOUT = "logout"
+
+
+'''
+Raised when a command reads more fields than the client sent.
+'''
+
+class MissingField(Exception):
+    pass
+
+
+'''
+Input for a network session: fields only come from the command line itself.
+'''
+
+class ConnectionInput(InputStream):
+    def readNextLine(self):
+        raise MissingField()
+
+
+'''
+Output for a network session: messages are collected for the reply to the
+current command instead of being printed. Menus and prompts are left out.
+'''
+
+class ConnectionOutput(OutputStream):
+    def __init__(self, srcPath):
+        super().__init__(srcPath, quiet=True)
+        self.lines = []
+
+    def write(self, message):
+        self.lines.append(message)
+
+    '''
+    Returns the reply collected so far, terminated by an empty line, and starts a new one.
+    '''
+
+    def takeReply(self):
+        self.lines.append("\n")
+        reply = "\n".join(self.lines)
+        self.lines = []
+        return reply.encode()
+
+    def flush(self):
+        pass
+
+
+class ATMServer:
+    def __init__(self, accounts_path, outputPath, lazyLoad=False, batchDir=None):
+        self.accounts = openAccountStore(accounts_path, lazy=lazyLoad)
+        self.accounts_path = accounts_path
+        self.outputPath = outputPath
+        self.batchDir = batchDir
+
+        self.connectionCount = 0
+        self.connections = 0
+        self.server = None
+
+    '''
+    Creates the controller for a new connection, sharing the server's accounts.
+    '''
+
+    def openSession(self):
+        self.connectionCount += 1
+        outputPath = sessionPath(self.outputPath, self.connectionCount)
+        return ATM(self.accounts_path, outputPath, batch=True, accounts=self.accounts,
+                   inputStream=ConnectionInput(), outputStream=ConnectionOutput(outputPath),
+                   bulk=self.batchDir is not None, batchDir=self.batchDir)
+
+    '''
+    Runs one command line for a connection and returns the reply.
+    '''
+
+    def execute(self, atm, line):
+        try:
+            atm.dispatch(line)
+        except MissingField:
+            atm.outputStream.write(MISSING_FIELDS)
+        except InvalidNumber:
+            atm.outputStream.write(INVALID_NUMBER)
+        return atm.outputStream.takeReply()
+
+    '''
+    Runs one command line for a connection without blocking the event loop
+    on file writes: a logout runs on a worker thread.
+    '''
+
+    async def executeAsync(self, atm, line):
+        command, _ = splitCommand(line)
+        if command == LOGOUT:
+            return await asyncio.get_running_loop().run_in_executor(None, self.execute, atm, line)
+        return self.execute(atm, line)
+
+    '''
+    Serves one client connection until it disconnects.
+    '''
+
+    async def handle(self, reader, writer):
+        atm = self.openSession()
+        self.connections += 1
+        try:
+            atm.outputStream.write(f"welcome to ATM {version}")
+            writer.write(atm.outputStream.takeReply())
+            await writer.drain()
+
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                writer.write(await self.executeAsync(atm, line.decode()))
+                await writer.drain()
+        except (ConnectionError, UnicodeDecodeError):
+            pass
+        finally:
+            self.connections -= 1
+
+            # a dropped session still writes its transactions
+            if atm.session.loggedIn:
+                await asyncio.get_running_loop().run_in_executor(None, atm.logout)
+            writer.close()
+
+    '''
+    Starts listening on a TCP port, or on a Unix domain socket when a path is given.
+    '''
+
+    async def start(self, host="127.0.0.1", port=0, unixPath=None):
+        if unixPath is not None:
+            if os.path.exists(unixPath):
+                os.remove(unixPath)
+            self.server = await asyncio.start_unix_server(self.handle, path=unixPath)
+        else:
+            self.server = await asyncio.start_server(self.handle, host, port)
+        return self.server
+
+    '''
+    Serves clients until the server is stopped, then writes back every
+    change still waiting in the account store.
+    '''
+
+    async def serveForever(self, host="127.0.0.1", port=0, unixPath=None):
+        server = await self.start(host, port, unixPath)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.accounts.flush()
@@ -0,0 +1,155 @@
+import os
+import struct
+import zlib
+from array import array
+
+'''
+Binary snapshot of a loaded accounts file, so later starts skip parsing it.
+
+A snapshot is kept next to the accounts file and holds what loading the
+file produced: every live account with its record offset, plus the store's
+bookkeeping (tombstone count, highest account number, END_OF_FILE record).
+The accounts are stored column by column, so reading them back is a few
+bulk decodes instead of slicing and converting every record:
+    - account numbers, holder names: newline-separated UTF-8 text
+    - statuses: one character per account
+    - balances: array of 64-bit integers, in cents
+    - offsets: array of 64-bit integers
+
+The header records the size and CRC-32 of the accounts file the snapshot
+was taken from, and a CRC-32 of the columns. A snapshot is only used when
+the accounts file still has that size and checksum and the columns are
+intact; otherwise the file is parsed as usual and the snapshot written
+again. Checksumming the file reads it once but parses nothing, which is
+cheap next to parsing every record.
+
+The same format holds the checkpoints of an event-sourced store (see
+event_store), kept under their own suffix. Their header also records how far
+into the event log the checkpoint reaches.
+'''
+
+# suffix of the snapshot file kept next to the accounts file
+SNAPSHOT_SUFFIX = ".snap"
+
+MAGIC = b"ATMSNAP3"
+
+# magic, account count, accounts file size and CRC-32, tombstones, highest number,
+# END_OF_FILE offset (-1 if none), event log position (0 for a plain snapshot),
+# length of each text column and of the END_OF_FILE record, CRC-32 of
+# everything after the header
+HEADER = struct.Struct("<8sQQIQQqQQQQQI")
+
+
+'''
+Accounts and bookkeeping read back from a snapshot.
+'''
+
+class Snapshot:
+    __slots__ = ('nums', 'names', 'statuses', 'balances', 'offsets',
+                 'tombstones', 'highestAccountNum', 'endOffset', 'endRecord', 'position')
+
+
+'''
+Returns the size and CRC-32 of an accounts file, which a snapshot is matched against.
+'''
+
+def fileChecksum(path):
+    with open(path, 'rb') as file:
+        data = file.read()
+    return len(data), zlib.crc32(data)
+
+
+'''
+Returns the size and modification time of an accounts file, which tell
+whether it has been written since it was last looked at.
+'''
+
+def fileStamp(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+'''
+Writes the snapshot for an accounts file.
+
+accounts must be in file order; an account without a record offset is
+stored with offset -1. The snapshot is written next to the old one and
+swapped in atomically, so a reader never sees half a snapshot.
+'''
+
+def writeSnapshot(path, accounts, tombstones, highestAccountNum, endOffset, endRecord,
+                  position=0, suffix=SNAPSHOT_SUFFIX):
+    # names are stored as parsing their records gives them back: cut to the 20 columns of the record
+    nums = "\n".join(account.accountNum for account in accounts).encode()
+    names = "\n".join(account.name[:20].strip() for account in accounts).encode()
+    statuses = "".join(account.status for account in accounts).encode()
+    balances = array('q', (account.cents for account in accounts)).tobytes()
+    offsets = array('q', (-1 if account.offset is None else account.offset for account in accounts)).tobytes()
+    endRecord = endRecord or b""
+
+    body = b"".join((nums, names, statuses, balances, offsets, endRecord))
+    size, crc = fileChecksum(path)
+    header = HEADER.pack(MAGIC, len(accounts), size, crc, tombstones, highestAccountNum,
+                         -1 if endOffset is None else endOffset, position,
+                         len(nums), len(names), len(statuses), len(endRecord), zlib.crc32(body))
+
+    temp_path = path + suffix + ".tmp"
+    with open(temp_path, 'wb') as file:
+        file.write(header)
+        file.write(body)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path + suffix)
+
+
+'''
+Reads the snapshot of an accounts file.
+
+Returns a Snapshot, or None if there is no snapshot, it does not match the
+accounts file as it is now, or it is damaged.
+'''
+
+def readSnapshot(path, suffix=SNAPSHOT_SUFFIX):
+    try:
+        with open(path + suffix, 'rb') as file:
+            data = file.read()
+        matched = fileChecksum(path)
+    except FileNotFoundError:
+        return None
+
+    if len(data) < HEADER.size:
+        return None
+    (magic, count, size, crc, tombstones, highest, endOffset, position,
+     numsLen, namesLen, statusesLen, endLen, checksum) = HEADER.unpack_from(data)
+    if magic != MAGIC or (size, crc) != matched:
+        return None
+
+    body = memoryview(data)[HEADER.size:]
+    if len(body) != numsLen + namesLen + statusesLen + 16 * count + endLen or zlib.crc32(body) != checksum:
+        return None
+
+    snapshot = Snapshot()
+    pos = 0
+    if count:
+        snapshot.nums = bytes(body[pos:pos + numsLen]).decode().split("\n")
+        pos += numsLen
+        snapshot.names = bytes(body[pos:pos + namesLen]).decode().split("\n")
+        pos += namesLen
+    else:
+        snapshot.nums = []
+        snapshot.names = []
+    snapshot.statuses = bytes(body[pos:pos + statusesLen]).decode()
+    pos += statusesLen
+    snapshot.balances = array('q')
+    snapshot.balances.frombytes(body[pos:pos + 8 * count])
+    pos += 8 * count
+    snapshot.offsets = array('q')
+    snapshot.offsets.frombytes(body[pos:pos + 8 * count])
+    pos += 8 * count
+
+    snapshot.tombstones = tombstones
+    snapshot.highestAccountNum = highest
+    snapshot.endOffset = None if endOffset < 0 else endOffset
+    snapshot.endRecord = bytes(body[pos:pos + endLen]) or None
+    snapshot.position = position
+    return snapshot
@@ -0,0 +1,597 @@
+import os
+import sqlite3
+import threading
+from array import array
+from contextlib import contextmanager
+
+from atm.account import Account, toCents
+from atm.account_store import parseRecord, formatRecord, TOMBSTONE, MAX_ACCOUNT_NUM, HIGH_WATER_MARK_SUFFIX
+
+'''
+The SQLiteAccountStore class keeps the accounts in a SQLite database
+instead of the fixed-width accounts file.
+
+It offers the same methods as AccountStore, so the ATM, the network server
+and the account service can use either one (see openAccountStore). Nothing
+is loaded up front: every lookup is a query on the number or name index,
+so startup and lookups cost the same however many accounts the bank holds,
+and only the accounts a session touches are ever held in memory.
+
+The database runs in WAL mode, so lookups from other connections and other
+processes never wait for a writer. Every command runs in its own
+transaction: locked() begins it (taking the database write lock, so a
+check-then-change cannot interleave with another writer) and commits it
+when the command is done, or rolls it back if the command fails.
+
+As with AccountStore, one Account object is kept per account number, so an
+account looked up twice is the same object. Lookups re-read the row and
+refresh the object in place, so they see changes made by other processes.
+Balances are stored as whole cents, and the cached accounts keep them in
+one balance column (see Account), reusing the slots of deleted accounts.
+
+Accounts created in a session are stored straight away but marked as not
+yet available, and publishPending makes them available when the session
+ends. Accounts left unavailable by a session that never ended (a crash)
+stay so until recoverAccounts is run on the database offline. Deleted
+accounts are removed from the table; the highest account number ever
+allocated is kept in the meta table so numbers are never reused.
+
+Creates and deletes change the cache and the pending accounts only once
+their transaction commits (see afterCommit), so a command rolled back
+leaves no account in memory that the database does not hold.
+
+Each thread uses its own connection to the database.
+'''
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS accounts (
+    num TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    balance_cents INTEGER NOT NULL,
+    available INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS accounts_by_name ON accounts (name);
+CREATE INDEX IF NOT EXISTS accounts_by_folded_name ON accounts (name COLLATE NOCASE);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+'''
+
+# columns selected for an account, in the order toAccount expects them
+COLUMNS = "num, name, status, balance_cents"
+
+# databases written before balances were kept in cents hold them in dollars,
+# in a balance column; load converts them
+CENTS_MIGRATION = '''
+CREATE TABLE accounts_cents (
+    num TEXT NOT NULL UNIQUE,
+    name TEXT NOT NULL,
+    status TEXT NOT NULL,
+    balance_cents INTEGER NOT NULL,
+    available INTEGER NOT NULL DEFAULT 1
+);
+INSERT INTO accounts_cents (rowid, num, name, status, balance_cents, available)
+    SELECT rowid, num, name, status, CAST(round(balance * 100) AS INTEGER), available FROM accounts ORDER BY rowid;
+DROP TABLE accounts;
+ALTER TABLE accounts_cents RENAME TO accounts;
+CREATE INDEX accounts_by_name ON accounts (name);
+CREATE INDEX accounts_by_folded_name ON accounts (name COLLATE NOCASE);
+'''
+
+# seconds a connection waits for another writer before giving up
+BUSY_TIMEOUT = 30
+
+
+class SQLiteAccountStore:
+    def __init__(self):
+        self.path = None
+
+        # one Account object per account number, refreshed by every lookup,
+        # with the balances of the cached accounts in cents (see Account) and
+        # the slots left free by deleted ones
+        self.cache = {}
+        self.balances = array('q')
+        self.freeSlots = []
+
+        # accounts created this session: stored but not yet available for lookups
+        self.pending = {}
+
+        # connection of each thread
+        self.local = threading.local()
+        self.connections = []
+
+        # per-account locks by account number, created on first use,
+        # and the lock guarding the store's own structures
+        self.locks = {}
+        self.storeLock = threading.RLock()
+
+    '''
+    Opens the accounts database, creating its tables if needed.
+
+    Balances stored in dollars by older databases are converted to cents.
+    Accounts not yet available are left so: another process may be in the
+    middle of the session that created them (see recoverAccounts).
+    lazy and journal are accepted for compatibility with AccountStore:
+    the database is always read on demand and keeps its own write-ahead log.
+    '''
+
+    def load(self, path, lazy=False, journal=True):
+        self.path = path
+        connection = self.connection()
+        connection.executescript(SCHEMA)
+        columns = [row[1] for row in connection.execute("PRAGMA table_info(accounts)")]
+        if "balance_cents" not in columns:
+            connection.executescript(f"BEGIN IMMEDIATE; {CENTS_MIGRATION} COMMIT;")
+
+    '''
+    Returns the calling thread's connection, opening it on first use.
+    '''
+
+    def connection(self):
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            # transactions are started explicitly, see transaction
+            connection = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT, isolation_level=None,
+                                         check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+            with self.storeLock:
+                self.connections.append(connection)
+        return connection
+
+    '''
+    Runs a with block in a write transaction, committing it at the end or
+    rolling it back on an exception. Inside an open transaction the block
+    runs in a savepoint of it, so an exception rolls back the block's own
+    changes (and drops its afterCommit actions) even when the caller
+    handles the exception and the transaction goes on.
+    '''
+
+    @contextmanager
+    def transaction(self):
+        connection = self.connection()
+        if connection.in_transaction:
+            actions = len(self.local.afterCommit)
+            connection.execute("SAVEPOINT nested")
+            try:
+                yield connection
+            except BaseException:
+                connection.execute("ROLLBACK TO nested")
+                connection.execute("RELEASE nested")
+                del self.local.afterCommit[actions:]
+                raise
+            connection.execute("RELEASE nested")
+            return
+
+        connection.execute("BEGIN IMMEDIATE")
+        self.local.afterCommit = []
+        try:
+            yield connection
+        except BaseException:
+            connection.rollback()
+            self.local.afterCommit = []
+            raise
+        connection.commit()
+
+        actions, self.local.afterCommit = self.local.afterCommit, []
+        for action in actions:
+            action()
+
+    '''
+    Runs an action once the calling thread's transaction has committed,
+    for changes to the store's memory that must only follow a change
+    to the database. The action is dropped if the transaction rolls back.
+    Must be called inside a transaction.
+    '''
+
+    def afterCommit(self, action):
+        self.local.afterCommit.append(action)
+
+    '''
+    Returns the cached Account for a row, refreshed from the row.
+    '''
+
+    def toAccount(self, row):
+        if row is None:
+            return None
+
+        num, name, status, cents = row
+        with self.storeLock:
+            account = self.cache.get(num)
+            if account is None:
+                slot = self.freeSlots.pop() if self.freeSlots else None
+                if slot is None:
+                    slot = len(self.balances)
+                    self.balances.append(cents)
+                else:
+                    self.balances[slot] = cents
+                account = Account(name, num, None, status, None, column=self.balances, slot=slot)
+                self.cache[num] = account
+                return account
+
+            # an account locked by another thread is in the middle of a command;
+            # the row does not hold its changes yet, and that thread re-reads it anyway
+            if self.lockFor(num).locked() and num not in self.heldNums():
+                return account
+
+            account.name = name
+            account.status = status
+            account.cents = cents
+            return account
+
+    '''
+    Returns the account numbers locked by the calling thread.
+    '''
+
+    def heldNums(self):
+        held = getattr(self.local, 'held', None)
+        if held is None:
+            held = self.local.held = set()
+        return held
+
+    '''
+    Allocates a new, unique account number past the high-water mark.
+
+    Must run inside a transaction. Returns the number as a five digit
+    string, or None once every account number has been used.
+    '''
+
+    def allocateAccountNum(self, connection):
+        row = connection.execute("SELECT value FROM meta WHERE key = 'hwm'").fetchone()
+        num = (row[0] if row else 0) + 1
+        if num > MAX_ACCOUNT_NUM:
+            return None
+
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('hwm', ?)", (num,))
+        return f"{num:05d}"
+
+    '''
+    Creates a new account (active by default) and stores it.
+
+    The account gets the next number from the allocator. It is kept as pending:
+    it can be deleted, but lookups do not return it until the next session.
+
+    Returns the new Account, or None if no account number is available.
+    '''
+
+    def createAccount(self, name, balance, status="A"):
+        with self.transaction() as connection:
+            acc_num = self.allocateAccountNum(connection)
+            if acc_num is None:
+                return None
+
+            cents = toCents(balance)
+            connection.execute("INSERT INTO accounts (num, name, status, balance_cents, available) VALUES (?, ?, ?, ?, 0)",
+                               (acc_num, name, status, cents))
+
+            account = Account(name, acc_num, None, status, None, column=array('q', (cents,)))
+            self.afterCommit(lambda: self.adoptCreated(account))
+        return account
+
+    '''
+    Caches an account whose create has committed and keeps it as pending.
+    Its balance moves into the balance column.
+    '''
+
+    def adoptCreated(self, account):
+        with self.storeLock:
+            # a lookup inside the create's transaction may have cached the row already
+            cached = self.cache.get(account.accountNum)
+            if cached is not None:
+                self.forget(cached)
+            account.moveTo(self.balances, self.freeSlots.pop() if self.freeSlots else None)
+            self.cache[account.accountNum] = account
+            self.pending[account.accountNum] = account
+
+    '''
+    Makes the accounts created this session available for lookups: only
+    those given by number, or every pending account (see AccountStore).
+    '''
+
+    def publishPending(self, accountNums=None):
+        with self.storeLock:
+            if accountNums is None:
+                accountNums = list(self.pending)
+            nums = [num for num in accountNums if self.pending.pop(num, None) is not None]
+        if nums:
+            with self.transaction() as connection:
+                connection.executemany("UPDATE accounts SET available = 1 WHERE num = ?", [(num,) for num in nums])
+
+    '''
+    Deletes an account by removing its row. The account leaves the cache,
+    and gets the tombstone status, once the delete has committed.
+    '''
+
+    def deleteAccount(self, account):
+        with self.transaction() as connection:
+            connection.execute("DELETE FROM accounts WHERE num = ?", (account.accountNum,))
+            self.afterCommit(lambda: self.forgetDeleted(account))
+
+    '''
+    Drops an account whose delete has committed from the store.
+    '''
+
+    def forgetDeleted(self, account):
+        with self.storeLock:
+            self.pending.pop(account.accountNum, None)
+            self.forget(account)
+        account.status = TOMBSTONE
+
+    '''
+    Drops an account from the cache. Its balance moves to a column of its
+    own, so it stays readable, and its slot is freed for the next account.
+    Must be called with the store lock held.
+    '''
+
+    def forget(self, account):
+        if self.cache.get(account.accountNum) is account:
+            del self.cache[account.accountNum]
+        if account.column is self.balances:
+            slot = account.slot
+            account.moveTo(array('q'))
+            self.balances[slot] = 0
+            self.freeSlots.append(slot)
+
+    '''
+    Applies a batch of admin changes in one transaction, as
+    AccountStore.applyBatch does: creates holds the (name, balance, status)
+    of each new account, deletes the accounts to delete, and updates the
+    accounts whose status changed.
+
+    Returns the new accounts in order, or None, changing nothing, if there
+    are not enough account numbers left for them. The new accounts are
+    cached, and the deleted ones dropped, only once the batch has committed.
+    '''
+
+    def applyBatch(self, creates, deletes, updates):
+        with self.transaction() as connection:
+            row = connection.execute("SELECT value FROM meta WHERE key = 'hwm'").fetchone()
+            if (row[0] if row else 0) + len(creates) > MAX_ACCOUNT_NUM:
+                return None
+
+            created = [self.createAccount(name, balance, status) for name, balance, status in creates]
+            for account in deletes:
+                self.deleteAccount(account)
+            for account in updates:
+                self.markDirty(account)
+        return created
+
+    '''
+    Returns the lock of an account number, creating it on first use.
+    '''
+
+    def lockFor(self, accountNum):
+        lock = self.locks.get(accountNum)
+        if lock is None:
+            with self.storeLock:
+                lock = self.locks.setdefault(accountNum, threading.Lock())
+        return lock
+
+    '''
+    Holds the given accounts for the duration of a with block, in one transaction.
+
+    The account locks are taken in account number order, then the database
+    write lock. The accounts are re-read once both are held, so the block
+    checks and changes their current state, and its changes are committed
+    together when it ends. An account deleted in the meantime is marked with
+    the tombstone status.
+    '''
+
+    @contextmanager
+    def locked(self, *accounts):
+        nums = sorted({account.accountNum for account in accounts}, key=lambda num: (len(num), num))
+        locks = [self.lockFor(num) for num in nums]
+        for lock in locks:
+            lock.acquire()
+        # once the store lock has been passed, no other thread's lookup is
+        # still refreshing these accounts, and none will until they are released
+        with self.storeLock:
+            held = self.heldNums()
+            held.update(nums)
+        try:
+            with self.transaction():
+                for account in accounts:
+                    if self.findRecord(account.accountNum) is None:
+                        with self.storeLock:
+                            self.forget(account)
+                        account.status = TOMBSTONE
+                yield
+        finally:
+            held.difference_update(nums)
+            for lock in reversed(locks):
+                lock.release()
+
+    '''
+    Writes an account's balance and status back to its row.
+
+    Inside locked() the change is committed with the rest of the command.
+    Accounts deleted in the meantime are ignored.
+    '''
+
+    def markDirty(self, account):
+        if account.status == TOMBSTONE:
+            return
+        self.connection().execute("UPDATE accounts SET status = ?, balance_cents = ? WHERE num = ?",
+                                  (account.status, account.cents, account.accountNum))
+
+    '''
+    Changes are committed by every command, so there is nothing left to write.
+    '''
+
+    def flush(self):
+        pass
+
+    '''
+    Deleted rows are reclaimed by SQLite itself, so there is never anything to compact.
+    '''
+
+    def compactIfNeeded(self):
+        return False
+
+    '''
+    Closes every connection opened by the store.
+    '''
+
+    def close(self):
+        with self.storeLock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+        self.local = threading.local()
+
+    '''
+    Finds the record for an account number, including accounts created
+    this session that are not available for lookups yet.
+
+    Returns the matching Account object if found. Returns None if no match is found.
+    '''
+
+    def findRecord(self, accountNum):
+        row = self.connection().execute(f"SELECT {COLUMNS} FROM accounts WHERE num = ?", (accountNum,)).fetchone()
+        return self.toAccount(row)
+
+    '''
+    Searches for an account using both account holder name
+    and account number.
+
+    Returns the matching Account object if found. Returns None if no match is found.
+    '''
+
+    def findAccountByNameAndNumber(self, name, accountNum):
+        account = self.findAccountByAccountNum(accountNum)
+        if account and account.name == name:
+            return account
+        return None
+
+    '''
+    Searches for an account using only the account holder name.
+
+    When several accounts share a holder name, the first one stored is returned.
+
+    Returns the matching Account object if found. Returns None if no match is found.
+    '''
+
+    def findAccountByName(self, name):
+        row = self.connection().execute(
+            f"SELECT {COLUMNS} FROM accounts WHERE name = ? AND available = 1 ORDER BY rowid LIMIT 1",
+            (name,)).fetchone()
+        return self.toAccount(row)
+
+    '''
+    Searches for an account using only the account number.
+
+    Returns the matching Account object if found. Returns None if no match is found.
+    '''
+
+    def findAccountByAccountNum(self, accountNum):
+        row = self.connection().execute(
+            f"SELECT {COLUMNS} FROM accounts WHERE num = ? AND available = 1", (accountNum,)).fetchone()
+        return self.toAccount(row)
+
+    '''
+    Searches for accounts by holder name, as AccountStore.findAccountsByName does.
+
+    Each search is a range query on one of the name indexes; searches
+    regardless of case use the index that ignores case.
+
+    Returns the matching accounts ordered by name (accounts sharing a name
+    in the order they were stored), at most limit of them when a limit is given.
+    '''
+
+    def findAccountsByName(self, name, prefix=False, ignoreCase=False, limit=None):
+        collate = " COLLATE NOCASE" if ignoreCase else ""
+        if prefix:
+            # every name starting with the text sorts before the text followed by the last code point
+            match = f"name >= ?{collate} AND name < ?{collate}"
+            args = (name, name + "\U0010ffff")
+        else:
+            match = f"name = ?{collate}"
+            args = (name,)
+
+        rows = self.connection().execute(
+            f"SELECT {COLUMNS} FROM accounts WHERE {match} AND available = 1 "
+            f"ORDER BY name COLLATE NOCASE, rowid LIMIT ?", args + (-1 if limit is None else limit,))
+        return [self.toAccount(row) for row in rows.fetchall()]
+
+
+'''
+Copies a fixed-width accounts file into a new accounts database.
+
+Deleted (tombstoned) records are left out, but their numbers and the
+accounts file's high-water mark still count towards the highest number
+allocated, so the database never hands them out again.
+
+Returns the number of accounts copied.
+'''
+
+def importAccounts(accountsPath, databasePath):
+    if os.path.exists(databasePath):
+        raise FileExistsError(f"{databasePath} already exists")
+
+    rows = []
+    highest = 0
+    with open(accountsPath, 'r') as file:
+        for line in file:
+            account = parseRecord(line.rstrip('\n'))
+            if account is None:
+                break
+            if account.accountNum.isdigit():
+                highest = max(highest, int(account.accountNum))
+            if account.status != TOMBSTONE:
+                rows.append((account.accountNum, account.name, account.status, account.cents))
+
+    try:
+        with open(accountsPath + HIGH_WATER_MARK_SUFFIX, 'r') as file:
+            highest = max(highest, int(file.read().strip() or 0))
+    except (FileNotFoundError, ValueError):
+        pass
+
+    store = SQLiteAccountStore()
+    store.load(databasePath)
+    with store.transaction() as connection:
+        # a number given twice keeps its first record, as AccountStore does
+        connection.executemany("INSERT OR IGNORE INTO accounts (num, name, status, balance_cents) VALUES (?, ?, ?, ?)", rows)
+        connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('hwm', ?)", (highest,))
+    store.close()
+    return len(rows)
+
+
+'''
+Makes available the accounts left unavailable by sessions that ended
+without publishing them, as reloading the accounts file would after a crash.
+
+Only run it offline, when no ATM, server or account service has the
+database open: a live session's new accounts must stay unavailable until
+it ends. Returns the number of accounts made available.
+'''
+
+def recoverAccounts(databasePath):
+    store = SQLiteAccountStore()
+    store.load(databasePath)
+    with store.transaction() as connection:
+        count = connection.execute("UPDATE accounts SET available = 1 WHERE available = 0").rowcount
+    store.close()
+    return count
+
+
+'''
+Writes the accounts of a database out as a fixed-width accounts file,
+ending with the END_OF_FILE record, e.g. to hand them to the back end.
+
+Returns the number of accounts written.
+'''
+
+def exportAccounts(databasePath, accountsPath):
+    store = SQLiteAccountStore()
+    store.load(databasePath)
+    count = 0
+    with open(accountsPath, 'w') as file:
+        for num, name, status, cents in store.connection().execute(f"SELECT {COLUMNS} FROM accounts ORDER BY rowid"):
+            file.write(formatRecord(Account(name, num, None, status, None, column=array('q', (cents,)))) + "\n")
+            count += 1
+        file.write("00000 END_OF_FILE          D 00000.00\n")
+    store.close()
+    return count
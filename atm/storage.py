@@ -0,0 +1,45 @@
+from atm.account_store import AccountStore
+from atm.event_store import EventSourcedStore
+from atm.sqlite_store import SQLiteAccountStore
+
+'''
+Chooses the account storage backend for an accounts path.
+
+Every backend offers the same methods, which are all the ATM uses:
+    - load(path, lazy, journal)
+    - findAccountByAccountNum, findAccountByName, findAccountByNameAndNumber
+    - findRecord (also finds accounts created this session)
+    - findAccountsByName (exact, prefix and case-insensitive name searches)
+    - createAccount, deleteAccount, markDirty, locked
+    - applyBatch (several creates, deletes and status changes in one go)
+    - flush, compactIfNeeded, publishPending, close
+
+AccountStore keeps the accounts in the fixed-width accounts file,
+SQLiteAccountStore in a SQLite database, and RemoteAccountStore (see
+account_service) asks a running account service. EventSourcedStore keeps
+the day's changes in an event log with periodic checkpoints instead of
+writing them to the accounts file.
+'''
+
+# accounts paths with these suffixes are SQLite databases
+SQLITE_SUFFIXES = (".db", ".sqlite", ".sqlite3")
+
+
+'''
+Returns a store for the accounts at the given path, loaded and ready for lookups.
+
+Paths ending in .db, .sqlite or .sqlite3 open a SQLite database; any
+other path is read as a fixed-width accounts file. Given events, a
+fixed-width accounts file is opened event-sourced, with a checkpoint every
+that many events.
+'''
+
+def openAccountStore(path, lazy=False, journal=True, events=None):
+    if path.endswith(SQLITE_SUFFIXES):
+        store = SQLiteAccountStore()
+    elif events:
+        store = EventSourcedStore(events)
+    else:
+        store = AccountStore()
+    store.load(path, lazy=lazy, journal=journal)
+    return store
@@ -0,0 +1,39 @@
+import argparse
+from atm.backend import BackEnd
+from atm.parallel_backend import ParallelBackEnd
+'''
+Script used to run the overnight back end of the banking system
+
+Reads the master bank accounts file and applies every transaction file
+written by the ATM front end during the day, in the order given.
+
+Produces:
+    - a new master bank accounts file
+    - a new current bank accounts file for the next day's ATM sessions
+    - an error log listing every transaction that broke a constraint
+
+HOW TO USE:
+    python backend.py master_accounts.txt day/*.atf --new-master new_master.txt --current current_accounts.txt --errors errors.log
+
+OPTIONS:
+    --workers N : partition the accounts by number range across N worker processes
+'''
+def main():
+    parser = argparse.ArgumentParser(description="Banking system overnight back end")
+    parser.add_argument("master_file")
+    parser.add_argument("transaction_files", nargs="+")
+    parser.add_argument("--new-master", required=True, help="where to write the new master accounts file")
+    parser.add_argument("--current", required=True, help="where to write the new current accounts file")
+    parser.add_argument("--errors", required=True, help="where to write the error log")
+    parser.add_argument("--workers", type=int, default=0, help="number of worker processes (0 runs in a single process)")
+    args = parser.parse_args()
+
+    if args.workers > 0:
+        backend = ParallelBackEnd(args.workers)
+    else:
+        backend = BackEnd()
+    backend.run(args.master_file, args.transaction_files, args.new_master, args.current, args.errors)
+    print(f"applied {len(args.transaction_files)} transaction file(s), {backend.errorCount} error(s)")
+
+if __name__ == "__main__":
+    main()
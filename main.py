@@ -1,5 +1,6 @@
-import sys
+import argparse
 from atm.atm import ATM
+from atm.account_service import RemoteAccountStore
 '''
 Main class used to run the program
 
@@ -21,21 +22,62 @@ The ATM interface has several options.
     - Delete : Remove accounts
     - Disable : Deactivate an account
     - Change Plan : Toggle between Student and non-student account 
+    - Find : list the accounts whose holder name starts with the given text,
+             regardless of case (not shown in the menu)
+    - Bulk : apply a batch file of create, delete, disable and changeplan
+             operations in one go (not shown in the menu, see ATM.bulk)
 
 The ATM is then run which then acts as a front end for the banking system.
 
 HOW TO USE:
     The ATM will prompt the user for information (ex account name or money amount)
     The user then types the requires information and the ATM will verify if the operation can be conducted
+    A command can also be given with all its fields on one line, quoting names
+    that hold spaces, e.g. paybill "boss test" 00002 EC 120.00
+
+ACCOUNTS:
+    The accounts file is a fixed-width text file, or a SQLite database when
+    its name ends in .db, .sqlite or .sqlite3 (see sqlite_accounts.py)
 
 LOGOUT:
     When logged out, the ATM refreshed and updates transaction logs.
+
+OPTIONS:
+    --lazy : memory-map the accounts file and decode accounts only when used
+    --stream : write each transaction to the transaction file as it happens
+    --batch : serve every session in the input in one run, writing one
+              transaction file per session (output_0001.atf, output_0002.atf, ...)
+    --buffered : write terminal output in large blocks (for scripted input)
+    --quiet : leave out menus and prompts, printing only results and errors
+    --service SOCKET : use the accounts held by a running account service
+                       (see account_service.py) instead of loading the accounts file
+    --events N : event-sourced mode: log every transaction to ACCOUNTS.events and
+                 checkpoint the accounts every N events instead of writing the
+                 accounts file; a restart replays only the events after the last checkpoint
+    --batch-dir DIR : only read bulk batch files inside DIR; with --service, bulk
+                      is refused unless this is given
 '''
 def main():
-    accounts_file = sys.argv[1]
-    output_file = sys.argv[2]
+    parser = argparse.ArgumentParser(description="ATM banking front end")
+    parser.add_argument("accounts_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--lazy", action="store_true", help="memory-map the accounts file and decode accounts on demand")
+    parser.add_argument("--stream", action="store_true", help="stream transactions to the output file instead of writing them at logout")
+    parser.add_argument("--batch", action="store_true", help="keep running after logout and serve sessions until the end of the input")
+    parser.add_argument("--buffered", action="store_true", help="write terminal output in large blocks instead of line by line")
+    parser.add_argument("--quiet", action="store_true", help="leave out menus and prompts")
+    parser.add_argument("--service", metavar="SOCKET", help="use the account service listening on this Unix socket")
+    parser.add_argument("--events", type=int, metavar="N", help="log transactions as events and checkpoint the accounts every N events")
+    parser.add_argument("--batch-dir", metavar="DIR", help="only read bulk batch files from this directory")
+    args = parser.parse_args()
+
+    accounts = None
+    if args.service:
+        accounts = RemoteAccountStore(args.service)
 
-    atm = ATM(accounts_file, output_file)
+    atm = ATM(args.accounts_file, args.output_file, lazyLoad=args.lazy, streaming=args.stream, batch=args.batch,
+              buffered=args.buffered, quiet=args.quiet, accounts=accounts, events=args.events,
+              bulk=args.service is None or args.batch_dir is not None, batchDir=args.batch_dir)
     atm.run()
     
 if __name__ == "__main__":    
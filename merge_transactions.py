@@ -0,0 +1,36 @@
+import argparse
+from atm.merge import TransactionMerger, sessionOrder, SESSION_ORDER, ACCOUNT_ORDER
+'''
+Script used to merge the day's session transaction files
+
+Every ATM session writes its own transaction file. This script combines
+them into one merged daily transaction file for the back end, dropping the
+end of session (00) record of every session and ending the merged file
+with a single one.
+
+The files are taken in session order: by the session numbers in their names
+compared as numbers (day_9999.atf before day_10000.atf), whatever order
+the shell lists them in.
+
+Account order moves a transfer with its sending account, so a debit that
+spends a transfer's credit can come before it; use the default session
+order for files the back end will run (see atm.merge).
+
+HOW TO USE:
+    python merge_transactions.py day/*.atf --output merged.atf
+    python merge_transactions.py day/*.atf --output merged.atf --order account
+'''
+def main():
+    parser = argparse.ArgumentParser(description="Merge session transaction files into one daily file")
+    parser.add_argument("transaction_files", nargs="+")
+    parser.add_argument("--output", required=True, help="where to write the merged transaction file")
+    parser.add_argument("--order", choices=[SESSION_ORDER, ACCOUNT_ORDER], default=SESSION_ORDER,
+                        help="keep sessions in the order given (for the back end), or order records by account number")
+    args = parser.parse_args()
+
+    merger = TransactionMerger(args.order)
+    count = merger.merge(sessionOrder(args.transaction_files), args.output)
+    print(f"merged {len(args.transaction_files)} file(s), {count} transaction(s)")
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,17 @@ For each test case:
 3) Output transaction (.atf) and terminal (.out) files are generated
 4) The exit status is evaluated to determine pass/fail
 
+A test case may also come with:
+- tests/accounts/<test>.txt: accounts file to start from instead of currentaccounts.txt
+- tests/inputs/<test>.args: extra command line options for the ATM program
+- tests/inputs/<test>.setup: shell script run first, with $ACCOUNTS set to the
+  temporary accounts file (e.g. to leave files behind as a crashed run would)
+- tests/expected/accounts/<test>.txt: the accounts file the run must leave
+  behind; it is copied to tests/output/accounts for validate_tests.sh
+
+Checks that drive the system from Python (tests/*.py) are run as well, and
+pass when they exit with status 0.
+
 The script tracks total, passed, and failed tests,
 and returns a non-zero exit code if any test fails.
 '
@@ -20,6 +31,9 @@ and returns a non-zero exit code if any test fails.
 INPUT_DIR="tests/inputs"
 OUTPUT_ATF_DIR="tests/output/atf"
 OUTPUT_TERMINAL_DIR="tests/output/terminal"
+OUTPUT_ACCOUNTS_DIR="tests/output/accounts"
+EXPECTED_ACCOUNTS_DIR="tests/expected/accounts"
+ACCOUNTS_DIR="tests/accounts"
 ACCOUNTS_FILE="tests/accounts/currentaccounts.txt"
 TEMP_ACCOUNTS="tests/accounts/temp_currentaccounts.txt"
 
@@ -36,6 +50,7 @@ TOTAL_COUNT=0
 # create output directories if they don't exist
 mkdir -p "$OUTPUT_ATF_DIR"
 mkdir -p "$OUTPUT_TERMINAL_DIR"
+mkdir -p "$OUTPUT_ACCOUNTS_DIR"
 
 echo "┌───────────────────┐"
 echo "│ Running ATM Tests │"
@@ -49,16 +64,38 @@ for input_file in "$INPUT_DIR"/*.in; do
     filename=$(basename "$input_file")
     test_name="${filename%.in}"
       
-    # copy accounts file to temp location
-    cp "$ACCOUNTS_FILE" "$TEMP_ACCOUNTS"
+    # copy accounts file (the test's own, if it has one) to temp location,
+    # dropping sidecar files left by earlier runs
+    accounts_file="$ACCOUNTS_FILE"
+    if [ -f "$ACCOUNTS_DIR/$test_name.txt" ]; then
+        accounts_file="$ACCOUNTS_DIR/$test_name.txt"
+    fi
+    rm -f "$TEMP_ACCOUNTS".*
+    cp "$accounts_file" "$TEMP_ACCOUNTS"
     
     # define output file paths
     output_atf="$OUTPUT_ATF_DIR/$test_name.atf"
     output_terminal="$OUTPUT_TERMINAL_DIR/$test_name.out"
+
+    # extra options for the ATM program, if any
+    options=()
+    if [ -f "$INPUT_DIR/$test_name.args" ]; then
+        read -r -a options < "$INPUT_DIR/$test_name.args"
+    fi
+
+    # run the test's setup first, if it has one
+    if [ -f "$INPUT_DIR/$test_name.setup" ]; then
+        ACCOUNTS="$TEMP_ACCOUNTS" bash "$INPUT_DIR/$test_name.setup" > /dev/null 2>&1
+    fi
     
     # run the ATM program
-    python3 main.py "$TEMP_ACCOUNTS" "$output_atf" < "$input_file" > "$output_terminal" 2>&1
+    python3 main.py "$TEMP_ACCOUNTS" "$output_atf" "${options[@]}" < "$input_file" > "$output_terminal" 2>&1
     exit_code=$?  # capture exit code immediately
+
+    # keep the accounts file left behind, if the test checks it
+    if [ -f "$EXPECTED_ACCOUNTS_DIR/$test_name.txt" ]; then
+        cp "$TEMP_ACCOUNTS" "$OUTPUT_ACCOUNTS_DIR/$test_name.txt"
+    fi
     
     if [ $exit_code -eq 0 ]; then
         printf "[${GREEN}PASS${RESET_COLOR}] test: %s\n" "$test_name"
@@ -76,8 +113,33 @@ for input_file in "$INPUT_DIR"/*.in; do
         FAIL_COUNT=$((FAIL_COUNT + 1))
     fi
     
-    # clean up temp accounts file
-    rm -f "$TEMP_ACCOUNTS"
+    # clean up temp accounts file and its sidecar files
+    rm -f "$TEMP_ACCOUNTS" "$TEMP_ACCOUNTS".*
+done
+
+# run every check script
+for check_file in tests/*.py; do
+    [ -e "$check_file" ] || continue
+    TOTAL_COUNT=$((TOTAL_COUNT + 1))
+    test_name=$(basename "$check_file" .py)
+
+    check_output=$(python3 "$check_file" 2>&1)
+    exit_code=$?
+
+    if [ $exit_code -eq 0 ]; then
+        printf "[${GREEN}PASS${RESET_COLOR}] check: %s\n" "$test_name"
+        PASS_COUNT=$((PASS_COUNT + 1))
+    else
+        printf "[${RED}FAIL${RESET_COLOR}] check: %s\n" "$test_name"
+        printf "       exit code: %d\n" "$exit_code"
+
+        # show last 5 lines for quick debugging
+        echo "       ─── last 5 lines ───"
+        echo "$check_output" | tail -n 5
+        echo "       ────────────────────"
+
+        FAIL_COUNT=$((FAIL_COUNT + 1))
+    fi
 done
 
 echo   ""
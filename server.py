@@ -0,0 +1,42 @@
+import argparse
+import asyncio
+from atm.server import ATMServer
+'''
+Script used to run the ATM network front end
+
+Loads the accounts file once and serves many concurrent ATM sessions over
+TCP or a Unix domain socket. Every connection is its own ATM session and
+sends whole commands on one line, e.g.
+    login standard "boss test"
+    withdraw "boss test" 00002 120.00
+Each command is answered with its messages followed by an empty line, and
+every session writes its own transaction file.
+
+HOW TO USE:
+    python server.py data/current_accounts.txt day/session.atf --port 5050
+    python server.py data/current_accounts.txt day/session.atf --unix /tmp/atm.sock
+
+OPTIONS:
+    --lazy : memory-map the accounts file and decode accounts only when used
+    --batch-dir DIR : allow the bulk command, for batch files inside DIR only;
+                      without it bulk is refused, as clients log in as admin freely
+'''
+def main():
+    parser = argparse.ArgumentParser(description="ATM network front end")
+    parser.add_argument("accounts_file")
+    parser.add_argument("output_file")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=5050, help="TCP port to listen on")
+    parser.add_argument("--unix", help="listen on this Unix domain socket path instead of TCP")
+    parser.add_argument("--lazy", action="store_true", help="memory-map the accounts file and decode accounts on demand")
+    parser.add_argument("--batch-dir", metavar="DIR", help="allow bulk batch files from this directory only")
+    args = parser.parse_args()
+
+    server = ATMServer(args.accounts_file, args.output_file, lazyLoad=args.lazy, batchDir=args.batch_dir)
+    try:
+        asyncio.run(server.serveForever(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
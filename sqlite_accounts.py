@@ -0,0 +1,40 @@
+import argparse
+from atm.sqlite_store import importAccounts, exportAccounts, recoverAccounts
+'''
+Script used to move accounts between a fixed-width accounts file and a SQLite accounts database
+
+The ATM, the network server and the account service open an accounts path
+ending in .db, .sqlite or .sqlite3 as a SQLite database. The back end still
+reads and writes fixed-width accounts files, so a database is exported for
+the overnight run and the new current accounts file imported again after it.
+
+After a crash, accounts created by sessions that never ended stay
+unavailable; recover makes them available. Only run it while nothing else
+has the database open.
+
+HOW TO USE:
+    python sqlite_accounts.py import data/current_accounts.txt data/accounts.db
+    python sqlite_accounts.py export data/accounts.db day/current_accounts.txt
+    python sqlite_accounts.py recover data/accounts.db
+'''
+def main():
+    parser = argparse.ArgumentParser(description="Convert between accounts files and SQLite accounts databases")
+    parser.add_argument("action", choices=["import", "export", "recover"])
+    parser.add_argument("source")
+    parser.add_argument("destination", nargs="?")
+    args = parser.parse_args()
+
+    if args.action == "recover":
+        count = recoverAccounts(args.source)
+        print(f"{count} accounts made available in {args.source}")
+        return
+    if args.destination is None:
+        parser.error(f"{args.action} needs a destination")
+    if args.action == "import":
+        count = importAccounts(args.source, args.destination)
+    else:
+        count = exportAccounts(args.source, args.destination)
+    print(f"{count} accounts copied to {args.destination}")
+
+if __name__ == "__main__":
+    main()
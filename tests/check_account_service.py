@@ -0,0 +1,109 @@
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from atm.account_service import AccountService, RemoteAccountStore
+from atm.atm import ATM
+from atm.server import ConnectionInput, ConnectionOutput
+
+'''
+Checks ATM sessions served by the account service.
+
+    - a session that logs out publishes only the accounts it created, not
+      those created meanwhile by another ATM process's live session
+    - a request the service fails on fails the command with the service's
+      message instead of ending the ATM
+
+HOW TO USE:
+    python tests/check_account_service.py
+
+Exits with a non-zero status if a check fails.
+'''
+
+ACCOUNTS_FILE = os.path.join(ROOT, "tests", "accounts", "currentaccounts.txt")
+
+
+'''
+Returns an ATM on its own connection to the service, taking its commands
+through dispatch (see ATMServer).
+'''
+
+def openATM(temp_dir, socket_path, name):
+    output_path = os.path.join(temp_dir, f"{name}.atf")
+    return ATM(None, output_path, batch=True, accounts=RemoteAccountStore(socket_path),
+               inputStream=ConnectionInput(), outputStream=ConnectionOutput(output_path))
+
+
+def run(atm, line):
+    atm.dispatch(line)
+    return atm.outputStream.takeReply().decode()
+
+
+def checkPublish(temp_dir, socket_path, failures):
+    first = openATM(temp_dir, socket_path, "first")
+    second = openATM(temp_dir, socket_path, "second")
+    run(first, "login admin")
+    run(second, "login admin")
+    alpha = run(first, "create alpha 100").split()[2]
+    beta = run(second, "create beta 200").split()[2]
+
+    run(first, "logout")
+    lookup = RemoteAccountStore(socket_path)
+    if lookup.findAccountByAccountNum(alpha) is None:
+        failures.append("an account was not published when its session ended")
+    if lookup.findAccountByAccountNum(beta) is not None:
+        failures.append("a live session's new account was published by another session's logout")
+
+    run(second, "logout")
+    if lookup.findAccountByAccountNum(beta) is None:
+        failures.append("an account was not published when its own session ended")
+
+
+def checkServiceError(temp_dir, socket_path, service, failures):
+    atm = openATM(temp_dir, socket_path, "failing")
+    run(atm, "login admin")
+
+    def failingLookup(accountNum):
+        raise OSError("accounts file unreadable")
+    service.store.findAccountByAccountNum = failingLookup
+    try:
+        reply = run(atm, 'withdraw "broke test" 00001 10')
+    except Exception as e:
+        failures.append(f"a failed service request ended the ATM with {type(e).__name__}")
+        return
+    finally:
+        del service.store.findAccountByAccountNum
+    if "accounts file unreadable" not in reply:
+        failures.append(f"a failed service request was answered with {reply!r}")
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "accounts.txt")
+        shutil.copy(ACCOUNTS_FILE, path)
+        socket_path = os.path.join(temp_dir, "accounts.sock")
+        service = AccountService(path, socket_path)
+        thread = threading.Thread(target=service.serve_forever, daemon=True)
+        thread.start()
+        try:
+            checkPublish(temp_dir, socket_path, failures)
+            checkServiceError(temp_dir, socket_path, service, failures)
+        finally:
+            service.shutdown()
+            service.close()
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("PASS: sessions publish only their own accounts; service failures fail the command")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from atm.account_store import AccountStore
+from atm.backend import BackEnd
+from atm.output_stream import formatTransaction, END_OF_SESSION
+from atm.sqlite_store import SQLiteAccountStore, importAccounts
+
+'''
+Checks that the balance column of a store does not grow as accounts come
+and go, and that the SQLite store keeps balances in whole cents.
+
+    - creating and deleting accounts over and over reuses the slots of the
+      deleted accounts, in the AccountStore, in the SQLiteAccountStore and
+      in the overnight BackEnd
+    - a deleted account still reads the balance it had
+    - the SQLite rows hold balances in cents, exactly
+    - a database from before balances were kept in cents is converted on load
+
+HOW TO USE:
+    python tests/check_balance_slots.py
+
+Exits with a non-zero status if a check fails.
+'''
+
+ACCOUNTS_FILE = os.path.join(ROOT, "tests", "accounts", "currentaccounts.txt")
+ROUNDS = 50
+
+
+def churn(store, label, failures):
+    store.createAccount("churn holder", 10.01)
+    size = len(store.balances)
+    for round in range(ROUNDS):
+        account = store.createAccount("churn holder", round + 0.07)
+        store.deleteAccount(account)
+        if account.balance != round + 0.07:
+            failures.append(f"{label}: deleted account {account.accountNum} reads {account.balance:.2f}")
+            break
+    if len(store.balances) != size + 1:
+        failures.append(f"{label}: balance column grew from {size} to {len(store.balances)} slots")
+
+
+def checkAccountStore(temp_dir, failures):
+    path = os.path.join(temp_dir, "accounts.txt")
+    shutil.copy(ACCOUNTS_FILE, path)
+    store = AccountStore()
+    store.load(path, journal=False, snapshot=False)
+    churn(store, "accounts file", failures)
+
+
+def checkSQLite(temp_dir, failures):
+    path = os.path.join(temp_dir, "accounts.db")
+    importAccounts(ACCOUNTS_FILE, path)
+    store = SQLiteAccountStore()
+    store.load(path)
+    churn(store, "sqlite", failures)
+
+    account = store.createAccount("cents holder", 0.29)
+    account.balance += 0.01
+    store.markDirty(account)
+    rows = sqlite3.connect(path).execute("SELECT balance_cents FROM accounts WHERE num = ?",
+                                         (account.accountNum,)).fetchall()
+    if rows != [(30,)]:
+        failures.append(f"sqlite: balance of $0.30 stored as {rows}")
+
+
+def checkBackEnd(temp_dir, failures):
+    day = os.path.join(temp_dir, "day.atf")
+    with open(day, 'w') as file:
+        for round in range(ROUNDS):
+            for code in ("05", "06"):
+                file.write(formatTransaction({'code': code, 'name': "churn holder", 'account_num': f"{100 + round:05d}",
+                                              'amount': round + 0.07, 'misc': ""}))
+        file.write(END_OF_SESSION)
+
+    loaded = BackEnd()
+    loaded.loadMaster(ACCOUNTS_FILE)
+    size = len(loaded.balances)
+
+    backend = BackEnd()
+    backend.run(ACCOUNTS_FILE, [day], *(os.path.join(temp_dir, f"backend.{suffix}")
+                                        for suffix in ("master", "current", "errors")))
+    if backend.errorCount:
+        failures.append(f"back end: {backend.errorCount} create or delete rejected")
+    if len(backend.balances) > size + 1:
+        failures.append(f"back end: balance column grew from {size} to {len(backend.balances)} slots")
+
+
+def checkMigration(temp_dir, failures):
+    path = os.path.join(temp_dir, "old.db")
+    connection = sqlite3.connect(path)
+    connection.executescript('''
+        CREATE TABLE accounts (num TEXT NOT NULL UNIQUE, name TEXT NOT NULL, status TEXT NOT NULL,
+                               balance REAL NOT NULL, available INTEGER NOT NULL DEFAULT 1);
+        INSERT INTO accounts (num, name, status, balance) VALUES ('00001', 'old holder', 'A', 123.45);
+    ''')
+    connection.commit()
+    connection.close()
+
+    store = SQLiteAccountStore()
+    store.load(path)
+    account = store.findAccountByAccountNum("00001")
+    if account is None or account.cents != 12345:
+        failures.append("sqlite: a balance stored in dollars was not converted to cents")
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        checkAccountStore(temp_dir, failures)
+        checkSQLite(temp_dir, failures)
+        checkBackEnd(temp_dir, failures)
+        checkMigration(temp_dir, failures)
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print(f"PASS: {ROUNDS} creates and deletes reuse balance slots; sqlite balances are whole cents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from atm.server import ATMServer
+
+'''
+Checks that a network client cannot use the bulk command to read files on
+the server.
+
+    - a server without a batch directory refuses bulk
+    - a server with one refuses batch files outside it, by relative or
+      absolute path
+    - a missing batch file and an unreadable one get the same reply
+    - a rejected line is reported by its number, without its contents
+
+HOW TO USE:
+    python tests/check_bulk.py
+
+Exits with a non-zero status if a check fails.
+'''
+
+ACCOUNTS_FILE = os.path.join(ROOT, "tests", "accounts", "currentaccounts.txt")
+SECRET = "not-a-batch-operation"
+
+
+def run(server, path):
+    atm = server.openSession()
+    server.execute(atm, "login admin")
+    return server.execute(atm, f"bulk {path}").decode()
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "accounts.txt")
+        shutil.copy(ACCOUNTS_FILE, path)
+        secret = os.path.join(temp_dir, "secret.txt")
+        with open(secret, 'w') as file:
+            file.write(f"{SECRET}\n")
+        batch_dir = os.path.join(temp_dir, "batches")
+        os.mkdir(batch_dir)
+        shutil.copy(secret, os.path.join(batch_dir, "bad.batch"))
+        os.mkdir(os.path.join(batch_dir, "folder.batch"))
+
+        server = ATMServer(path, os.path.join(temp_dir, "day.atf"))
+        reply = run(server, secret)
+        if SECRET in reply or "not available" not in reply:
+            failures.append(f"a server without a batch directory ran bulk: {reply!r}")
+        server.accounts.close()
+
+        server = ATMServer(path, os.path.join(temp_dir, "day.atf"), batchDir=batch_dir)
+        for outside in (secret, os.path.join("..", "secret.txt")):
+            reply = run(server, outside)
+            if SECRET in reply or "batch directory" not in reply:
+                failures.append(f"a batch file outside the batch directory was read: {outside} gave {reply!r}")
+
+        missing = run(server, "missing.batch")
+        unreadable = run(server, "folder.batch")
+        if missing != unreadable:
+            failures.append(f"a missing and an unreadable batch file got different replies: {missing!r}, {unreadable!r}")
+
+        reply = run(server, "bad.batch")
+        if SECRET in reply or "line 1 rejected" not in reply:
+            failures.append(f"a rejected line was not reported by its number alone: {reply!r}")
+        server.accounts.close()
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("PASS: bulk reads only batch files in the server's batch directory and shows no file contents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,54 @@
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from atm.output_stream import sessionPath, formatTransaction, END_OF_SESSION
+
+'''
+Checks that merge_transactions.py keeps sessions in session order once the
+session numbers of a batch run outgrow four digits.
+
+Sessions 9998, 9999 and 10000 each write one withdrawal. The shell lists
+day_10000.atf first (it sorts before day_9998.atf as text), so the merged
+file must still hold the withdrawals in session order.
+
+HOW TO USE:
+    python tests/check_merge_order.py
+
+Exits with a non-zero status if a check fails.
+'''
+
+SESSIONS = (9998, 9999, 10000)
+
+
+def main():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        day = os.path.join(temp_dir, "day.atf")
+        for number in SESSIONS:
+            trans = {'code': "01", 'name': "holder", 'account_num': "00001", 'amount': number / 100, 'misc': ""}
+            with open(sessionPath(day, number), 'w') as file:
+                file.write(formatTransaction(trans) + END_OF_SESSION)
+
+        # as the shell would expand day_*.atf
+        paths = sorted(glob.glob(os.path.join(temp_dir, "day_*.atf")))
+        merged = os.path.join(temp_dir, "merged.atf")
+        subprocess.run([sys.executable, os.path.join(ROOT, "merge_transactions.py"), *paths, "--output", merged],
+                       check=True, stdout=subprocess.DEVNULL)
+
+        with open(merged, 'r') as file:
+            amounts = [line[30:38] for line in file if line.startswith("01")]
+
+    expected = [f"{number / 100:08.2f}" for number in SESSIONS]
+    if amounts != expected:
+        print(f"FAIL: merged sessions in order {amounts}, expected {expected}")
+        sys.exit(1)
+    print(f"PASS: sessions {SESSIONS[0]}-{SESSIONS[-1]} merged in session order")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from atm.backend import BackEnd
+from atm.merge import TransactionMerger, SESSION_ORDER, ACCOUNT_ORDER
+from atm.output_stream import formatTransaction, END_OF_SESSION
+
+'''
+Checks how the merge orders a transfer's credit against a later debit of
+the receiving account.
+
+Session 1 transfers $50.00 from 00009 to 00008, which holds $0.00.
+Session 2 then withdraws $30.00 from 00008, spending the credit.
+    - session order keeps the credit first, so the back end applies the
+      withdrawal and 00008 ends with $20.00
+    - account order moves the transfer with its sender, 00009, after every
+      record of 00008, so the back end sees the withdrawal first and
+      rejects it, as documented in atm.merge
+
+HOW TO USE:
+    python tests/check_merge_transfer_order.py
+
+Exits with a non-zero status if a check fails.
+'''
+
+
+def record(num, balance):
+    return f"{num:05d} {'holder ' + str(num):<20} A {balance:08.2f}"
+
+
+def transaction(code, num, amount, receiver=None):
+    trans = {'code': code, 'name': f"holder {num}", 'account_num': f"{num:05d}", 'amount': amount, 'misc': ""}
+    if receiver is not None:
+        trans['account_num_reciever'] = f"{receiver:05d}"
+    return formatTransaction(trans)
+
+
+'''
+Merges the sessions in the given order, runs the back end on the merged
+file, and returns its current accounts and error log.
+'''
+
+def runMerged(temp_dir, sessions, master, order):
+    merged = os.path.join(temp_dir, f"{order}.atf")
+    TransactionMerger(order).merge(sessions, merged)
+
+    current = os.path.join(temp_dir, f"{order}.current")
+    errors = os.path.join(temp_dir, f"{order}.errors")
+    BackEnd().run(master, [merged], os.path.join(temp_dir, f"{order}.master"), current, errors)
+    with open(current, 'r') as file:
+        accounts = file.read()
+    with open(errors, 'r') as file:
+        return accounts, file.read()
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        master = os.path.join(temp_dir, "master.txt")
+        with open(master, 'w') as file:
+            file.write(f"{record(8, 0)} 0000 NP\n{record(9, 100)} 0000 NP\n")
+
+        sessions = []
+        for number, lines in enumerate(([transaction("02", 9, 50, 8)], [transaction("01", 8, 30)]), 1):
+            path = os.path.join(temp_dir, f"day_{number:04d}.atf")
+            with open(path, 'w') as file:
+                file.write("".join(lines) + END_OF_SESSION)
+            sessions.append(path)
+
+        accounts, errors = runMerged(temp_dir, sessions, master, SESSION_ORDER)
+        if record(8, 20) not in accounts or errors:
+            failures.append("session order: the back end did not apply the withdrawal after the credit")
+
+        accounts, errors = runMerged(temp_dir, sessions, master, ACCOUNT_ORDER)
+        if record(8, 50) not in accounts or "account 00008 balance would fall below $0.00" not in errors:
+            failures.append("account order: the withdrawal was not applied before the credit, as documented")
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("PASS: session order keeps a transfer's credit before the debit that spends it")
+
+
+if __name__ == "__main__":
+    main()
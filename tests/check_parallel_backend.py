@@ -0,0 +1,150 @@
+import os
+import random
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from atm.backend import BackEnd
+from atm.parallel_backend import ParallelBackEnd
+from atm.output_stream import formatTransaction, END_OF_SESSION
+
+'''
+Compares the ParallelBackEnd with the sequential BackEnd on days full of
+transfers between partitions.
+
+Each day is run through both back ends (the parallel one with two workers,
+so accounts 00001-00004 and 00005-00008 land in different partitions) and
+their output files are compared:
+    - independent day: cross-partition transfers, withdrawals and deposits
+      that never depend on a credit give the same master, current and error
+      files
+    - receiver spends its credit: the one documented difference, the
+      receiver's later withdrawal is rejected by the parallel run only
+    - lost refund: a credit rejected by a disabled receiver cannot be
+      refunded to a sender deleted later in the day; both runs end with the
+      same accounts and the parallel run reports the lost refund
+
+HOW TO USE:
+    python tests/check_parallel_backend.py
+
+Exits with a non-zero status if a check fails.
+'''
+
+ACCOUNTS = 8
+WORKERS = 2
+
+
+def record(num, balance, status="A"):
+    return f"{num:05d} {'holder ' + str(num):<20} {status} {balance:08.2f}"
+
+
+def writeMaster(path, balances, statuses={}):
+    with open(path, 'w') as file:
+        for num in range(1, ACCOUNTS + 1):
+            file.write(f"{record(num, balances[num], statuses.get(num, 'A'))} 0000 NP\n")
+
+
+def transaction(code, num, amount, receiver=None):
+    trans = {'code': code, 'name': f"holder {num}", 'account_num': f"{num:05d}", 'amount': amount, 'misc': ""}
+    if receiver is not None:
+        trans['account_num_reciever'] = f"{receiver:05d}"
+    return formatTransaction(trans)
+
+
+'''
+Runs a day through a back end and returns its master, current and error files.
+'''
+
+def runDay(backend, temp_dir, name, master, day):
+    day_path = os.path.join(temp_dir, f"{name}.atf")
+    with open(day_path, 'w') as file:
+        file.write("".join(day) + END_OF_SESSION)
+
+    outputs = [os.path.join(temp_dir, f"{name}.{suffix}") for suffix in ("master", "current", "errors")]
+    backend.run(master, [day_path], *outputs)
+
+    contents = []
+    for path in outputs:
+        with open(path, 'r') as file:
+            # error lines name the day file, which differs between the two runs
+            contents.append(file.read().replace(day_path, "day.atf"))
+    return contents
+
+
+def runBoth(temp_dir, name, master, day):
+    sequential = runDay(BackEnd(), temp_dir, name + "_sequential", master, day)
+    parallel = runDay(ParallelBackEnd(WORKERS), temp_dir, name + "_parallel", master, day)
+    return sequential, parallel
+
+
+def checkIndependent(temp_dir, failures):
+    master = os.path.join(temp_dir, "independent.master")
+    writeMaster(master, {num: 10000 for num in range(1, ACCOUNTS + 1)})
+
+    rng = random.Random(7)
+    day = []
+    for _ in range(2000):
+        sender = rng.randint(1, ACCOUNTS)
+        amount = rng.randint(1, 20)
+        if rng.random() < 0.8:
+            # always to the other partition
+            receiver = (sender + ACCOUNTS // 2 - 1) % ACCOUNTS + 1
+            day.append(transaction("02", sender, amount, receiver))
+        elif rng.random() < 0.5:
+            day.append(transaction("01", sender, amount))
+        else:
+            day.append(transaction("04", sender, amount))
+
+    sequential, parallel = runBoth(temp_dir, "independent", master, day)
+    for label, expected, actual in zip(("master", "current", "errors"), sequential, parallel):
+        if expected != actual:
+            failures.append(f"independent day: {label} files differ")
+
+
+def checkSpentCredit(temp_dir, failures):
+    master = os.path.join(temp_dir, "spent.master")
+    writeMaster(master, {**{num: 100 for num in range(1, ACCOUNTS + 1)}, 8: 0})
+
+    # 00008 spends money it only has once the transfer from 00001 is credited
+    day = [transaction("02", 1, 50, 8), transaction("01", 8, 30)]
+    sequential, parallel = runBoth(temp_dir, "spent", master, day)
+
+    if record(8, 20) not in sequential[1]:
+        failures.append("spent credit: the sequential run did not apply the withdrawal")
+    if record(8, 50) not in parallel[1]:
+        failures.append("spent credit: the parallel run did not reject the withdrawal")
+    if sequential[2] != "" or "account 00008 balance would fall below $0.00" not in parallel[2]:
+        failures.append("spent credit: unexpected error logs")
+
+
+def checkLostRefund(temp_dir, failures):
+    master = os.path.join(temp_dir, "refund.master")
+    writeMaster(master, {num: 100 for num in range(1, ACCOUNTS + 1)}, {8: "D"})
+
+    # 00008 is disabled, so the credit is rejected; 00001 is gone before it can be refunded
+    day = [transaction("02", 1, 50, 8), transaction("06", 1, 0)]
+    sequential, parallel = runBoth(temp_dir, "refund", master, day)
+
+    if sequential[:2] != parallel[:2]:
+        failures.append("lost refund: the runs ended with different accounts")
+    if "refund of $50.00 to account 00001 lost" not in parallel[2]:
+        failures.append("lost refund: the parallel run did not report the lost refund")
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        checkIndependent(temp_dir, failures)
+        checkSpentCredit(temp_dir, failures)
+        checkLostRefund(temp_dir, failures)
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("PASS: parallel back end matches the sequential one where documented")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from atm.server import ATMServer, INVALID_NUMBER
+
+'''
+Checks how the network front end answers commands and where it runs logouts.
+
+    - an amount that is not a number is answered with the invalid number error
+    - a fault raised by the store is not reported as an invalid number
+    - a logout flushes the accounts on a worker thread, not on the event loop,
+      and another connection is served meanwhile
+
+HOW TO USE:
+    python tests/check_server.py
+
+Exits with a non-zero status if a check fails.
+'''
+
+ACCOUNTS_FILE = os.path.join(ROOT, "tests", "accounts", "currentaccounts.txt")
+
+
+async def readReply(reader):
+    lines = []
+    while True:
+        line = await reader.readline()
+        if not line or line == b"\n":
+            return lines
+        lines.append(line.decode().rstrip("\n"))
+
+
+async def send(reader, writer, line):
+    writer.write((line + "\n").encode())
+    await writer.drain()
+    return await readReply(reader)
+
+
+async def connect(socket_path):
+    reader, writer = await asyncio.open_unix_connection(socket_path)
+    await readReply(reader)
+    return reader, writer
+
+
+async def runChecks(server, socket_path, failures):
+    await server.start(unixPath=socket_path)
+    loop_thread = threading.current_thread()
+
+    # the injected fault below ends its connection; keep its traceback out of the output
+    asyncio.get_running_loop().set_exception_handler(lambda loop, context: None)
+
+    reader, writer = await connect(socket_path)
+    await send(reader, writer, "login admin")
+    reply = await send(reader, writer, 'transfer "boss test" 00002 00003 ten')
+    if reply != [INVALID_NUMBER]:
+        failures.append(f"a non-numeric amount was answered with {reply}")
+
+    # a fault in the store must not pass for a mistyped amount; it ends the connection
+    store = server.accounts
+    def failingMarkDirty(account):
+        raise ValueError("record does not fit")
+    store.markDirty = failingMarkDirty
+    reply = await send(reader, writer, 'withdraw "broke test" 00001 10')
+    if INVALID_NUMBER in reply:
+        failures.append("a fault in the store was reported as an invalid number")
+    del store.markDirty
+    writer.close()
+
+    # a slow flush on logout must leave the other connections served
+    flush = store.flush
+    flushing = threading.Event()
+    release = threading.Event()
+    threads = []
+    def slowFlush():
+        threads.append(threading.current_thread())
+        flushing.set()
+        release.wait(5)
+        flush()
+    store.flush = slowFlush
+
+    first = await connect(socket_path)
+    second = await connect(socket_path)
+    await send(*first, "login admin")
+    await send(*second, "login admin")
+    logout = asyncio.ensure_future(send(*first, "logout"))
+    while not flushing.is_set():
+        await asyncio.sleep(0.01)
+    reply = await asyncio.wait_for(send(*second, "find boss"), 5)
+    if not any("boss test" in line for line in reply):
+        failures.append(f"another connection was not served during a logout: {reply}")
+    release.set()
+    await logout
+    await send(*second, "logout")
+    if not threads or any(thread is loop_thread for thread in threads):
+        failures.append("a logout flushed the accounts on the event loop")
+    del store.flush
+    for _, writer in (first, second):
+        writer.close()
+    server.server.close()
+    await server.server.wait_closed()
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, "accounts.txt")
+        shutil.copy(ACCOUNTS_FILE, path)
+        server = ATMServer(path, os.path.join(temp_dir, "day.atf"))
+        asyncio.run(runChecks(server, os.path.join(temp_dir, "atm.sock"), failures))
+        server.accounts.close()
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("PASS: the server reports only bad amounts as invalid numbers and logs out off the event loop")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import gc
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import weakref
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from atm.account_store import AccountStore
+from atm.snapshot import SNAPSHOT_SUFFIX
+
+'''
+Checks the binary snapshot upkeep of the AccountStore.
+
+    - a store loads the same accounts from its snapshot as from parsing the file
+    - closing a store writes its snapshot
+    - a store that is no longer used is freed, rather than kept alive until
+      the process exits to write its snapshot
+    - a load that fails (here on a damaged journal) leaves no snapshot behind
+
+HOW TO USE:
+    python tests/check_snapshot.py
+
+Exits with a non-zero status if a check fails.
+'''
+
+ACCOUNTS_FILE = os.path.join(ROOT, "tests", "accounts", "currentaccounts.txt")
+
+
+def state(store):
+    return [(account.accountNum, account.name, account.status, account.cents, account.offset)
+            for account in store.accounts]
+
+
+def checkRoundTrip(temp_dir, failures):
+    path = os.path.join(temp_dir, "roundtrip.txt")
+    shutil.copy(ACCOUNTS_FILE, path)
+
+    parsed = AccountStore()
+    parsed.load(path)
+    parsed.close()
+    if not os.path.exists(path + SNAPSHOT_SUFFIX):
+        failures.append("closing the store did not write its snapshot")
+
+    restored = AccountStore()
+    restored.load(path)
+    if state(restored) != state(parsed):
+        failures.append("the accounts read from the snapshot differ from the parsed ones")
+    restored.close()
+
+
+def checkFreed(temp_dir, failures):
+    path = os.path.join(temp_dir, "freed.txt")
+    shutil.copy(ACCOUNTS_FILE, path)
+
+    store = AccountStore()
+    store.load(path, journal=False)
+    ref = weakref.ref(store)
+    del store
+    gc.collect()
+    if ref() is not None:
+        failures.append("a store no longer used is still alive")
+
+
+def checkFailedLoad(temp_dir, failures):
+    path = os.path.join(temp_dir, "failed.txt")
+    shutil.copy(ACCOUNTS_FILE, path)
+    with open(path + ".journal", 'w') as file:
+        file.write("00002 boss test            A 100000.00\n")
+
+    # the load raises; the process then exits as it would after the error
+    script = "import sys; from atm.account_store import AccountStore; AccountStore().load(sys.argv[1])"
+    run = subprocess.run([sys.executable, "-c", script, path], cwd=ROOT, capture_output=True)
+    if run.returncode == 0:
+        failures.append("loading with a damaged journal did not fail")
+    if os.path.exists(path + SNAPSHOT_SUFFIX):
+        failures.append("a failed load left a snapshot behind")
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        checkRoundTrip(temp_dir, failures)
+        checkFreed(temp_dir, failures)
+        checkFailedLoad(temp_dir, failures)
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("PASS: snapshots are written on close, by live stores only, and never after a failed load")
+
+
+if __name__ == "__main__":
+    main()
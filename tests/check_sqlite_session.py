@@ -0,0 +1,163 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+from atm.sqlite_store import SQLiteAccountStore, importAccounts, exportAccounts, recoverAccounts
+
+'''
+Runs an admin session against a SQLite accounts database and checks the
+accounts it leaves behind, then checks how new accounts are kept from
+other processes.
+
+The accounts file is imported into a database, main.py serves the session
+below on it, and the database is exported back to a fixed-width file, which
+must hold:
+    - the withdrawal, transfer and bill payment applied to the balances
+    - the deleted account gone, and the disabled one disabled
+    - the created account, published with its opening balance
+
+Then:
+    - a second process opening the database does not make available an
+      account a live session has just created; recoverAccounts does
+    - a batch that fails and is rolled back leaves no new account in the
+      store's memory, and a failed batch inside a command commits nothing
+
+HOW TO USE:
+    python tests/check_sqlite_session.py
+
+Exits with a non-zero status if a check fails.
+'''
+
+ACCOUNTS_FILE = os.path.join(ROOT, "tests", "accounts", "currentaccounts.txt")
+
+SESSION = """login
+admin
+withdraw
+broke test
+00001
+100
+transfer
+boss test
+00002
+00003
+250.50
+paybill
+boss test
+00002
+EC
+49.50
+create
+new holder
+150.00
+disable
+matteo
+00003
+delete
+broke test
+00001
+logout
+"""
+
+EXPECTED = [
+    "00002 boss test            A 04700.00",
+    "00003 matteo               D 03250.50",
+    "00004 new holder           A 00150.00",
+    "00000 END_OF_FILE          D 00000.00",
+]
+
+
+def checkPending(temp_dir, failures):
+    path = os.path.join(temp_dir, "pending.db")
+    importAccounts(ACCOUNTS_FILE, path)
+
+    live = SQLiteAccountStore()
+    live.load(path)
+    account = live.createAccount("new holder", 10.00)
+
+    other = SQLiteAccountStore()
+    other.load(path)
+    if other.findAccountByAccountNum(account.accountNum) is not None:
+        failures.append("opening the database made a live session's new account available")
+    other.close()
+    live.close()
+
+    recoverAccounts(path)
+    recovered = SQLiteAccountStore()
+    recovered.load(path)
+    if recovered.findAccountByAccountNum(account.accountNum) is None:
+        failures.append("recoverAccounts did not make an abandoned account available")
+    recovered.close()
+
+
+def checkRolledBackBatch(temp_dir, failures):
+    path = os.path.join(temp_dir, "batch.db")
+    importAccounts(ACCOUNTS_FILE, path)
+    store = SQLiteAccountStore()
+    store.load(path)
+    account = store.findAccountByAccountNum("00003")
+
+    def failingMarkDirty(account):
+        raise OSError("disk full")
+    store.markDirty = failingMarkDirty
+
+    # on its own, and inside a command that carries on after the failure
+    for inCommand in (False, True):
+        try:
+            if inCommand:
+                with store.locked(account):
+                    try:
+                        store.applyBatch([("ghost", 1.00, "A")], [], [account])
+                    except OSError:
+                        pass
+            else:
+                store.applyBatch([("ghost", 1.00, "A")], [], [account])
+        except OSError:
+            pass
+
+        label = "inside a command" if inCommand else "on its own"
+        if any(cached.name == "ghost" for cached in store.cache.values()) or store.pending:
+            failures.append(f"a rolled back batch {label} left its new account in memory")
+        if store.findAccountsByName("ghost") or store.findRecord("00004") is not None:
+            failures.append(f"a failed batch {label} left its new account in the database")
+    del store.markDirty
+    store.close()
+
+
+def main():
+    failures = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        checkPending(temp_dir, failures)
+        checkRolledBackBatch(temp_dir, failures)
+
+        database = os.path.join(temp_dir, "accounts.db")
+        importAccounts(ACCOUNTS_FILE, database)
+
+        run = subprocess.run([sys.executable, os.path.join(ROOT, "main.py"), database,
+                              os.path.join(temp_dir, "session.atf")],
+                             input=SESSION, text=True, capture_output=True, cwd=ROOT)
+        if run.returncode != 0:
+            print(f"FAIL: the session exited with status {run.returncode}")
+            print(run.stderr)
+            sys.exit(1)
+
+        exported = os.path.join(temp_dir, "exported.txt")
+        exportAccounts(database, exported)
+        with open(exported, 'r') as file:
+            records = file.read().splitlines()
+
+    if records != EXPECTED:
+        failures.append("the session left the database holding\n    " + "\n    ".join(records))
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print("PASS: a session on a SQLite database leaves the expected accounts, and new ones only its own")
+
+
+if __name__ == "__main__":
+    main()
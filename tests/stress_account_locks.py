@@ -0,0 +1,181 @@
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from atm.account_store import AccountStore
+from atm.atm import ATM
+
+'''
+Stress test for the per-account locks of the AccountStore.
+
+Several admin sessions, each on its own thread with its own ATM, share one
+AccountStore and hammer a small set of accounts with transfers and
+withdrawals, logging out and back in now and then so flushes run while
+other sessions keep changing balances. Another admin session deletes a few
+of the accounts while this goes on.
+
+Every read of a balance gives up the rest of the thread's time slice (see
+YieldingColumn), so another session gets to run between an operation's
+balance check and its update, exactly where a missing lock loses money.
+
+Checks afterwards that:
+    - money is conserved: the balances left, plus those of the deleted
+      accounts when they were deleted, add up to the opening total less the
+      amount withdrawn successfully
+    - no balance went below $0.00
+    - the accounts file written back holds the same balances as memory,
+      and none of the deleted accounts
+
+The same run is then repeated with the locks taken out, and must fail a
+check; otherwise the test could not tell that the locks work.
+
+HOW TO USE:
+    python tests/stress_account_locks.py
+
+Exits with a non-zero status if a check fails.
+'''
+
+ACCOUNTS = 20
+OPENING_BALANCE = 5000
+THREADS = 8
+OPERATIONS = 3000
+
+# accounts deleted while the sessions run, and the pause before each delete
+DELETED = (17, 18, 19, 20)
+DELETE_PAUSE = 0.05
+
+
+'''
+Balance column that yields to the other threads on every read, after
+reading the balance and before the caller can act on it.
+'''
+
+class YieldingColumn(list):
+    def __getitem__(self, slot):
+        balance = super().__getitem__(slot)
+        time.sleep(0)
+        return balance
+
+
+@contextmanager
+def unlocked(*accounts):
+    yield
+
+
+def writeAccounts(path):
+    with open(path, 'w') as file:
+        for num in range(1, ACCOUNTS + 1):
+            file.write(f"{num:05d} {'holder ' + str(num):<20} A {OPENING_BALANCE:08.2f}\n")
+        file.write("00000 END_OF_FILE          D 00000.00\n")
+
+
+def runSession(atm, seed, withdrawn):
+    rng = random.Random(seed)
+    atm.login("admin")
+    for op in range(OPERATIONS):
+        sender = rng.randint(1, ACCOUNTS)
+        amount = rng.randint(1, 50)
+        if rng.random() < 0.99:
+            receiver = rng.randint(1, ACCOUNTS)
+            atm.transfer(f"holder {sender}", f"{sender:05d}", f"{receiver:05d}", amount)
+        else:
+            result = atm.withdraw(f"holder {sender}", f"{sender:05d}", amount)
+            if result.ok:
+                withdrawn[seed] += amount
+
+        if op % 500 == 499:
+            atm.logout()
+            atm.login("admin")
+    atm.logout()
+
+
+def runDeletes(atm, store, deleted):
+    atm.login("admin")
+    for num in DELETED:
+        time.sleep(DELETE_PAUSE)
+        account = store.findAccountByAccountNum(f"{num:05d}")
+        if atm.delete(account.name, account.accountNum).ok:
+            # the account is tombstoned, so no session may change its balance any more
+            deleted[account.accountNum] = account.balance
+    atm.logout()
+
+
+'''
+Runs every session against one store and returns the checks that failed.
+'''
+
+def runStress(temp_dir, locks):
+    path = os.path.join(temp_dir, f"accounts_{locks}.txt")
+    writeAccounts(path)
+
+    store = AccountStore()
+    store.load(path)
+    if not locks:
+        store.locked = unlocked
+
+    # every balance read goes through the yielding column
+    column = YieldingColumn(store.balances)
+    for account in store.accounts:
+        account.column = column
+    store.balances = column
+
+    withdrawn = [0] * THREADS
+    deleted = {}
+    threads = []
+    for seed in range(THREADS):
+        atm = ATM(path, os.path.join(temp_dir, f"session{seed}.atf"), batch=True, accounts=store)
+        threads.append(threading.Thread(target=runSession, args=(atm, seed, withdrawn)))
+    atm = ATM(path, os.path.join(temp_dir, "deletes.atf"), batch=True, accounts=store)
+    threads.append(threading.Thread(target=runDeletes, args=(atm, store, deleted)))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    store.flush()
+
+    failures = []
+    balances = {account.accountNum: account.balance for account in store.accounts}
+    expected = ACCOUNTS * OPENING_BALANCE - sum(withdrawn)
+    total = sum(balances.values()) + sum(deleted.values())
+    if round(total * 100) != round(expected * 100):
+        failures.append(f"total balance is {total:.2f}, expected {expected:.2f}")
+    for num, balance in sorted(balances.items()):
+        if balance < 0:
+            failures.append(f"account {num} balance is {balance:.2f}")
+
+    reloaded = AccountStore()
+    reloaded.load(path, journal=False, snapshot=False)
+    for account in reloaded.accounts:
+        if account.accountNum in deleted:
+            failures.append(f"deleted account {account.accountNum} is back in the accounts file")
+        elif account.balance != balances[account.accountNum]:
+            failures.append(f"account {account.accountNum} is {account.balance:.2f} on disk, {balances[account.accountNum]:.2f} in memory")
+    return failures, expected
+
+
+def main():
+    # switch threads as often as possible to provoke races
+    sys.setswitchinterval(1e-6)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        failures, expected = runStress(temp_dir, locks=True)
+        unlocked_failures, _ = runStress(temp_dir, locks=False)
+    if not unlocked_failures:
+        failures.append("the run without locks passed every check, so the checks cannot catch a race")
+
+    if failures:
+        for failure in failures:
+            print(f"FAIL: {failure}")
+        sys.exit(1)
+    print(f"PASS: {THREADS} sessions x {OPERATIONS} operations, total balance {expected:.2f} conserved "
+          f"({len(unlocked_failures)} check(s) failed without locks, as they should)")
+
+
+if __name__ == "__main__":
+    main()
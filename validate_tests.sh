@@ -7,6 +7,7 @@ This script validates the results of executed ATM tests by comparing:
 
 1) Generated transaction files (.atf)
 2) Generated terminal output files (.out)
+3) Accounts files left behind, for the tests that check them (.txt)
 
 Each output file is compared against a corresponding expected file.
 Differences are displayed using unified diff format.
@@ -17,8 +18,10 @@ The script exits with non-zero status if any mismatch is detected.
 # directories
 OUTPUT_ATF_DIR="tests/output/atf"
 OUTPUT_TERMINAL_DIR="tests/output/terminal"
+OUTPUT_ACCOUNTS_DIR="tests/output/accounts"
 EXPECTED_ATF_DIR="tests/expected/atf"
 EXPECTED_TERMINAL_DIR="tests/expected/terminal"
+EXPECTED_ACCOUNTS_DIR="tests/expected/accounts"
 
 # color codes
 GREEN='\033[0;32m'
@@ -105,8 +108,49 @@ printf "│ Total: %d │ ${GREEN}Passed: %d${RESET_COLOR} │ ${RED}Failed: %d$
     "$OUT_TOTAL_COUNT" "$OUT_PASS_COUNT" "$OUT_FAIL_COUNT"
 echo "└───────────┴────────────┴───────────┘"
 
+# ACCOUNTS FILES
+# accounts file counters
+ACC_PASS_COUNT=0
+ACC_FAIL_COUNT=0
+ACC_TOTAL_COUNT=0
+
+echo ""
+echo "┌────────────────────────────┐"
+echo "│ Validating Accounts Files  │"
+echo "└────────────────────────────┘"
+
+# check every expected accounts file, so a test that left none behind fails
+for expected_file in "$EXPECTED_ACCOUNTS_DIR"/*.txt; do
+    [ -e "$expected_file" ] || continue
+    ACC_TOTAL_COUNT=$((ACC_TOTAL_COUNT + 1))
+
+    # get test name
+    filename=$(basename "$expected_file")
+    test_name="${filename%.txt}"
+    actual_file="$OUTPUT_ACCOUNTS_DIR/$filename"
+
+    if diff -q "$actual_file" "$expected_file" > /dev/null 2>&1; then
+        printf "[${GREEN}PASS${RESET_COLOR}] test: %s\n" "$test_name"
+        ACC_PASS_COUNT=$((ACC_PASS_COUNT + 1))
+    else
+        printf "[${RED}FAIL${RESET_COLOR}] test: %s\n" "$test_name"
+        echo "       expected: $expected_file"
+        echo "       actual:   $actual_file"
+        echo "       ─── diff (first 10 lines) ───"
+        # unified diff is way easier to read
+        diff -u "$actual_file" "$expected_file" | head -n 10
+        echo "       ───────────────────────────"
+        ACC_FAIL_COUNT=$((ACC_FAIL_COUNT + 1))
+    fi
+done
+
+echo "┌───────────┬────────────┬───────────┐"
+printf "│ Total: %d │ ${GREEN}Passed: %d${RESET_COLOR} │ ${RED}Failed: %d${RESET_COLOR} │\n" \
+    "$ACC_TOTAL_COUNT" "$ACC_PASS_COUNT" "$ACC_FAIL_COUNT"
+echo "└───────────┴────────────┴───────────┘"
+
 # exit if any test failed
-if [ "$ATF_FAIL_COUNT" -ne 0 ] || [ "$OUT_FAIL_COUNT" -ne 0 ]; then
+if [ "$ATF_FAIL_COUNT" -ne 0 ] || [ "$OUT_FAIL_COUNT" -ne 0 ] || [ "$ACC_FAIL_COUNT" -ne 0 ]; then
     exit 1
 fi
 